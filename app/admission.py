@@ -0,0 +1,156 @@
+# app/admission.py
+"""
+准入控制：按路由类别限制并发，超出时快速返回 503
+
+同步路由在线程池（约 40 个线程）里执行，而数据库连接池只有 POOL_SIZE + MAX_OVERFLOW 个连接。
+请求突增时线程都卡在等连接上，连廉价的页面也一起变慢。这里在进入线程池之前按类别限流：
+- read：GET/HEAD 页面与接口
+- write：其他方法的写操作
+- auth：登录、注册（bcrypt 计算量大，单独限制，避免拖慢页面读取）
+每类有并发上限和有界等待队列；队列已满或等待超时直接返回 503 + Retry-After。
+静态资源、媒体文件、/metrics 与 SSE 事件流（长连接，不占用数据库连接，由 live 模块单独限制）不受限制。
+"""
+import asyncio
+import json
+import os
+
+from . import deps, metrics
+
+ENABLED = os.getenv("ADMISSION_CONTROL", "1") not in ("0", "false", "off")
+POOL_TOTAL = deps.POOL_SIZE + deps.MAX_OVERFLOW
+
+# 默认按连接池大小分配：auth 2，write 约三分之一，其余给 read
+AUTH_LIMIT = int(os.getenv("ADMISSION_AUTH_LIMIT", "2"))
+WRITE_LIMIT = int(os.getenv("ADMISSION_WRITE_LIMIT", str(max(1, (POOL_TOTAL - AUTH_LIMIT) // 3))))
+READ_LIMIT = int(os.getenv("ADMISSION_READ_LIMIT", str(max(1, POOL_TOTAL - AUTH_LIMIT - WRITE_LIMIT))))
+# 每类最多排队的请求数（相对并发上限的倍数）与最长等待秒数
+QUEUE_FACTOR = float(os.getenv("ADMISSION_QUEUE_FACTOR", "2"))
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2.0"))
+RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+EXEMPT_PREFIXES = ("/static/", "/media/")
+EXEMPT_SUFFIXES = ("/events",)
+# 过载时仍要能抓取指标
+EXEMPT_PATHS = {"/metrics"}
+AUTH_PATHS = {"/login", "/register"}
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class Gate:
+    """一个路由类别的并发闸门：信号量 + 有界等待队列"""
+
+    def __init__(self, name: str, limit: int, queue: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self) -> bool:
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+        elif self.waiting >= self.queue:
+            self.rejected += 1
+            return False
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return False
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {"limit": self.limit, "queue": self.queue, "in_flight": self.in_flight, "waiting": self.waiting,
+                "admitted": self.admitted, "rejected": self.rejected, "timed_out": self.timed_out}
+
+
+def _make_gate(name: str, limit: int) -> Gate:
+    return Gate(name, limit, max(1, int(limit * QUEUE_FACTOR)), QUEUE_TIMEOUT)
+
+
+gates = {
+    "read": _make_gate("read", READ_LIMIT),
+    "write": _make_gate("write", WRITE_LIMIT),
+    "auth": _make_gate("auth", AUTH_LIMIT),
+}
+
+
+def classify(method: str, path: str):
+    """返回路由类别；None 表示不限流"""
+    if path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES) or path.endswith(EXEMPT_SUFFIXES):
+        return None
+    if path in AUTH_PATHS and method == "POST":
+        return "auth"
+    if method in READ_METHODS:
+        return "read"
+    return "write"
+
+
+def snapshot() -> dict:
+    return {name: gate.snapshot() for name, gate in gates.items()}
+
+
+@metrics.register_collector
+def _collect():
+    families = []
+    for field, kind, help_text in (("in_flight", "gauge", "Admitted requests currently running"),
+                                   ("waiting", "gauge", "Requests queued for admission"),
+                                   ("rejected", "counter", "Requests rejected because the queue was full"),
+                                   ("timed_out", "counter", "Requests that timed out waiting for admission")):
+        name = f"admission_{field}" + ("_total" if kind == "counter" else "")
+        families.append((name, kind, help_text,
+                         [({"class": gate.name}, getattr(gate, field)) for gate in gates.values()]))
+    return families
+
+
+async def _reject(send, gate: Gate) -> None:
+    body = json.dumps({"detail": "Server busy, please retry later", "class": gate.name}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", str(RETRY_AFTER).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """纯 ASGI 中间件（不缓冲响应，流式响应结束后才释放名额）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        route_class = classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        gate = gates[route_class]
+        if not await gate.acquire():
+            await _reject(send, gate)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
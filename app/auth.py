@@ -11,6 +11,8 @@ from . import crud
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+# 管理员用户名，逗号分隔
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
@@ -39,3 +41,7 @@ def get_current_user(db: Session = Depends(), token: str = Depends(oauth2_scheme
     if user is None:
         raise credentials_exception
     return user
+
+
+def is_admin(user) -> bool:
+    return user is not None and user.username in ADMIN_USERNAMES
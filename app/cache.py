@@ -0,0 +1,102 @@
+# app/cache.py
+"""进程内缓存：模板字节码缓存目录、与用户无关的页面片段缓存，以及每个用户已点赞文章 id 的集合。"""
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from . import invalidation, metrics
+
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "litebook-jinja"))
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "512"))
+FRAGMENT_CACHE_TTL = float(os.getenv("FRAGMENT_CACHE_TTL", "60"))
+LIKED_CACHE_SIZE = int(os.getenv("LIKED_CACHE_SIZE", "2048"))
+LIKED_CACHE_TTL = float(os.getenv("LIKED_CACHE_TTL", "300"))
+
+
+class FragmentCache:
+    """
+    渲染结果缓存（LRU + TTL）。
+
+    key 为元组，第一个元素是命名空间（如 "sidebar"），便于按命名空间整体失效。
+    渲染期间若发生失效，则本次结果不写回缓存，避免把旧数据重新放进去。
+    """
+
+    def __init__(self, maxsize: int = FRAGMENT_CACHE_SIZE, ttl: float = FRAGMENT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key: tuple, render: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self.evictions += 1
+            generation = self._generation
+
+        value = render()
+
+        with self._lock:
+            if generation == self._generation:
+                self._data[key] = (now + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, namespace: Optional[str] = None) -> None:
+        """失效指定命名空间下的全部片段；namespace 为空时清空全部。"""
+        with self._lock:
+            self._generation += 1
+            if namespace is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if k[0] == namespace]:
+                del self._data[key]
+
+    def discard(self, key: tuple) -> None:
+        """失效单个 key（同样会让进行中的渲染结果不写回）"""
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._data)}
+
+
+# 侧边栏等片段的全局缓存（每个进程一份）
+fragments = FragmentCache()
+# 每个用户已点赞的文章 id 集合，key 为 ("liked", user_id)
+liked_sets = FragmentCache(maxsize=LIKED_CACHE_SIZE, ttl=LIKED_CACHE_TTL)
+metrics.register_cache("fragments", fragments.stats)
+metrics.register_cache("liked_sets", liked_sets.stats)
+
+
+@invalidation.subscribe
+def _on_invalidate(event: dict) -> None:
+    kind = event.get("k")
+    if kind == "*":
+        fragments.invalidate()
+        liked_sets.invalidate()
+    elif kind == "like":
+        liked_sets.discard(("liked", event.get("uid")))
+    elif kind in ("article", "user"):
+        # 侧边栏包含标题、分类计数与作者昵称
+        fragments.invalidate("sidebar")
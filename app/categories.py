@@ -0,0 +1,134 @@
+# app/categories.py
+"""
+分类维表
+
+文章仍以 Article.category 保存分类名；categories 表为每个分类名保存稳定的 id、预先算好的 slug（即页面上的 cat_id）
+和文章数。分类列表、分组总数、按 cat_id 查分类都直接读这张表，不再对 articles 做 SELECT DISTINCT / COUNT。
+
+- 新分类在文章的写入事务里用保存点插入（并发插入同名分类时以唯一约束去重，回滚保存点后重查），计数做原子加减
+- 文章数为 0 的分类保留（id、slug 不变），列表中不显示
+- 绕过 crud 直接写 articles 的脚本（批量导入、同步）结束后调用 sync() 按实际数据重算；
+  表由 app/migrations.py 创建（应用启动时自动建好），建表后立即 sync() 回填
+    python -m app.categories    # 手动重算
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import deps, migrations, models
+
+SLUG_RE = re.compile(r"[ （）()/\\]")
+
+def slugify(name: str) -> str:
+    """分类名转 cat_id（与旧链接保持一致：空格、括号、斜杠换成下划线）"""
+    return SLUG_RE.sub("_", name)
+
+
+def _unique_slug(db: Session, name: str, taken: Optional[set] = None) -> str:
+    """不同分类名可能转成同一个 slug，重复时加序号"""
+    def exists(slug: str) -> bool:
+        if taken is not None:
+            return slug in taken
+        return db.query(models.Category.id).filter(models.Category.slug == slug).first() is not None
+
+    base = slug = slugify(name)
+    n = 1
+    while exists(slug):
+        n += 1
+        slug = f"{base}_{n}"
+    return slug
+
+
+def ensure(db: Session, name: str) -> None:
+    """分类不存在时在调用方的会话中创建（保存点内插入，不提交，随文章一起提交）"""
+    for _ in range(3):
+        if db.query(models.Category.id).filter(models.Category.name == name).first() is not None:
+            return
+        # slug 在保存点外查好：SQLite 上保存点会开启事务，事务里先读后写可能因快照过期直接报 database is locked
+        slug = _unique_slug(db, name)
+        try:
+            with db.begin_nested():
+                db.add(models.Category(name=name, slug=slug, article_count=0))
+            return
+        except IntegrityError:
+            # 其他请求同时创建了同名分类（或占用了同一个 slug），保存点已回滚，重新检查
+            continue
+    raise RuntimeError(f"无法创建分类 {name!r}")
+
+
+def adjust(db: Session, name: str, delta: int) -> None:
+    """调整分类的文章数（不提交，随文章一起提交）；分类需已由 ensure() 创建"""
+    db.query(models.Category).filter(models.Category.name == name).update(
+        {models.Category.article_count: models.Category.article_count + delta}, synchronize_session=False)
+
+
+def list_categories(db: Session) -> List["models.Category"]:
+    """有文章的分类（按名称排序）"""
+    return (db.query(models.Category)
+            .filter(models.Category.article_count > 0)
+            .order_by(models.Category.name)
+            .all())
+
+
+def names(db: Session) -> List[str]:
+    return [category.name for category in list_categories(db)]
+
+
+def get_by_slug(db: Session, slug: str) -> Optional["models.Category"]:
+    category = db.query(models.Category).filter(models.Category.slug == slug).first()
+    return category if category is not None and category.article_count > 0 else None
+
+
+def get_by_name(db: Session, name: str) -> Optional["models.Category"]:
+    return db.query(models.Category).filter(models.Category.name == name).first()
+
+
+def slug_for(db: Session, name: str) -> str:
+    category = get_by_name(db, name)
+    return category.slug if category is not None else slugify(name)
+
+
+def slug_map(db: Session, category_names: Iterable[str]) -> Dict[str, str]:
+    """一次查出多个分类名对应的 slug"""
+    category_names = list(category_names)
+    if not category_names:
+        return {}
+    found = dict(db.query(models.Category.name, models.Category.slug).filter(
+        models.Category.name.in_(category_names)))
+    return {name: found.get(name) or slugify(name) for name in category_names}
+
+
+def sync(db: Session) -> int:
+    """按 articles 的实际数据补齐分类并重算文章数（提交），返回分类数"""
+    counts = dict(db.query(models.Article.category, func.count(models.Article.id))
+                  .filter(models.Article.category.isnot(None))
+                  .group_by(models.Article.category))
+    existing = {category.name: category for category in db.query(models.Category)}
+    taken = {category.slug for category in existing.values()}
+    for name, category in existing.items():
+        category.article_count = counts.get(name, 0)
+    for name in sorted(set(counts) - set(existing)):
+        slug = _unique_slug(db, name, taken)
+        taken.add(slug)
+        db.add(models.Category(name=name, slug=slug, article_count=counts[name]))
+    db.commit()
+    print(f"[categories] 同步 {len(counts)} 个分类")
+    return len(counts)
+
+
+def main() -> None:
+    migrations.ensure_tables(deps.engine)
+    db = deps.SessionLocal()
+    try:
+        sync(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# app/content_codec.py
+"""
+文章正文的压缩存储（可选）
+
+ARTICLE_COMPRESSION=zlib|zstd 时正文以二进制保存（PostgreSQL 为 bytea，MySQL 为 LONGBLOB，
+SQLite 无需改表），较长的正文压缩后带格式标记写入；读取时按标记自动解压，未压缩的旧数据照常读取。
+默认 none，列类型仍为 Text，行为与以前一致。
+
+切换前后需运行 test/compress_articles.py 转换列类型和已有数据。
+zstd 需要安装 zstandard，未安装时退回 zlib。
+"""
+import os
+import threading
+import time
+import zlib
+
+from sqlalchemy.types import LargeBinary, Text, TypeDecorator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC = os.getenv("ARTICLE_COMPRESSION", "none").lower()
+if CODEC == "zstd" and zstandard is None:
+    print("[content_codec] 未安装 zstandard，改用 zlib")
+    CODEC = "zlib"
+# 短于该字节数的正文不压缩（压缩收益抵不过开销）
+MIN_SIZE = int(os.getenv("ARTICLE_COMPRESSION_MIN_SIZE", 512))
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+# 格式标记：\x00 开头（UTF-8 文本不会以 NUL 开头）+ 一个字节的编码类型
+MARKERS = {"zlib": b"\x00Z", "zstd": b"\x00S"}
+
+
+def binary_storage(codec: str = None) -> bool:
+    return (codec or CODEC) in MARKERS
+
+
+def encode(text: str, codec: str = None) -> bytes:
+    codec = codec or CODEC
+    raw = text.encode("utf-8")
+    if codec not in MARKERS or len(raw) < MIN_SIZE:
+        return raw
+    if codec == "zstd":
+        packed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    else:
+        packed = zlib.compress(raw, ZLIB_LEVEL)
+    if len(packed) + 2 >= len(raw):
+        return raw
+    return MARKERS[codec] + packed
+
+
+class DecodeStats:
+    """读取时的解压次数与耗时（进程内累计）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.reads = 0
+        self.decoded = 0
+        self.seconds = 0.0
+        self.stored_bytes = 0
+        self.raw_bytes = 0
+
+    def record(self, stored: int, raw: int, seconds: float, decoded: bool):
+        with self._lock:
+            self.reads += 1
+            self.stored_bytes += stored
+            self.raw_bytes += raw
+            if decoded:
+                self.decoded += 1
+                self.seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "codec": CODEC,
+                "reads": self.reads,
+                "decoded": self.decoded,
+                "decode_us_avg": round(self.seconds / self.decoded * 1e6, 1) if self.decoded else 0.0,
+                "stored_bytes": self.stored_bytes,
+                "raw_bytes": self.raw_bytes,
+                "saved_ratio": round(1 - self.stored_bytes / self.raw_bytes, 3) if self.raw_bytes else 0.0,
+            }
+
+
+stats = DecodeStats()
+
+
+def decode(value) -> str:
+    """按格式标记解压；str（未迁移的 Text 数据）原样返回"""
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    marker = data[:2]
+    if marker == MARKERS["zstd"]:
+        if zstandard is None:
+            raise RuntimeError("正文以 zstd 压缩，需要安装 zstandard")
+        started = time.perf_counter()
+        text = zstandard.ZstdDecompressor().decompress(data[2:]).decode("utf-8")
+    elif marker == MARKERS["zlib"]:
+        started = time.perf_counter()
+        text = zlib.decompress(data[2:]).decode("utf-8")
+    else:
+        text = data.decode("utf-8")
+        stats.record(len(data), len(data), 0.0, False)
+        return text
+    stats.record(len(data), len(text.encode("utf-8")), time.perf_counter() - started, True)
+    return text
+
+
+class CompressedText(TypeDecorator):
+    """对模型层透明的正文类型：写入时按 CODEC 编码，读取时自动解码"""
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        # SQLite 列类型宽松，TEXT 列可直接存 BLOB；其他数据库压缩模式下列类型为二进制
+        if binary_storage() and dialect.name != "sqlite":
+            return dialect.type_descriptor(LargeBinary())
+        return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not binary_storage():
+            return value
+        return encode(value)
+
+    def process_result_value(self, value, dialect):
+        return decode(value)
+
+    def coerce_compared_value(self, op, value):
+        # LIKE 等比较不经过压缩
+        return Text()
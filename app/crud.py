@@ -1,9 +1,10 @@
-from typing import Optional
+from typing import List, Optional, Set
 
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session, defer, joinedload
 
-from . import models, schemas
+from . import categories, models, schemas, invalidation, media, metrics, outbox, related, rendering, viewers
 from .models import Article, ArticleLike
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -14,7 +15,8 @@ def get_user_by_username(db: Session, username: str):
 
 
 def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+    with metrics.BCRYPT_DURATION.time(op="hash"):
+        hashed_password = pwd_context.hash(user.password)
     db_user = models.User(username=user.username, hashed_password=hashed_password, nickname=user.nickname)
     db.add(db_user)
     db.commit()
@@ -29,23 +31,40 @@ def update_user_nickname(db: Session, user_id: int, nickname: str | None):
     user.nickname = nickname
     db.commit()
     db.refresh(user)
+    # 侧边栏展示作者昵称
+    invalidation.publish(db, "user", id=user_id)
     return user
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    with metrics.BCRYPT_DURATION.time(op="verify"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 
 def create_article(db: Session, user_id: int, article: schemas.ArticleCreate):
-    db_article = models.Article(**article.dict(), author_id=user_id)
+    data = article.dict()
+    categories.ensure(db, data["category"])
+    # 内嵌的 data: 图片转存到媒体目录，正文只保留链接
+    data["content"] = media.extract_images(data["content"], db)
+    db_article = models.Article(**data, author_id=user_id)
     db.add(db_article)
+    db.flush()
+    categories.adjust(db, db_article.category, 1)
+    rendering.schedule(db, db_article)
+    related.schedule(db, db_article.id, related.text_version(db_article.title, db_article.content))
     db.commit()
     db.refresh(db_article)
+    invalidation.publish(db, "article", id=db_article.id, cat=db_article.category)
     return db_article
 
 
+# 列表查询不加载正文（正文可能很大，列表只需要标题等字段）
+def _article_listing(db: Session):
+    return db.query(models.Article).options(defer(models.Article.content))
+
+
 def get_articles(db: Session, skip=0, limit=10):
-    return db.query(models.Article).order_by(models.Article.created_at.desc()).offset(skip).limit(limit).all()
+    return _article_listing(db).order_by(models.Article.created_at.desc()).offset(skip).limit(limit).all()
 
 
 def get_articles_count(db: Session):
@@ -59,25 +78,40 @@ def get_article(db: Session, article_id: int):
 def update_article(db: Session, article_id: int, article: schemas.ArticleUpdate):
     db_article = get_article(db, article_id)
     if db_article:
+        old_category = db_article.category
+        if article.category != old_category:
+            categories.ensure(db, article.category)
+            categories.adjust(db, old_category, -1)
+            categories.adjust(db, article.category, 1)
         setattr(db_article, 'title', article.title)
-        setattr(db_article, 'content', article.content)
+        setattr(db_article, 'content', media.extract_images(article.content, db))
         setattr(db_article, 'category', article.category)
+        rendering.schedule(db, db_article)
+        related.schedule(db, article_id, related.text_version(db_article.title, db_article.content))
         db.commit()
         db.refresh(db_article)
+        invalidation.publish(db, "article", id=article_id, cat=db_article.category,
+                             old=old_category if old_category != db_article.category else None)
     return db_article
 
 
 def delete_article(db: Session, article_id: int):
     db_article = get_article(db, article_id)
     if db_article:
+        category = db_article.category
+        categories.adjust(db, category, -1)
+        rendering.discard(db, [article_id])
+        viewers.discard(db, [article_id])
+        related.discard(db, [article_id])
         db.delete(db_article)
         db.commit()
+        invalidation.publish(db, "article", id=article_id, cat=category)
     return db_article
 
 
 
 def get_articles_by_category(db: Session, category: str, skip=0, limit=10):
-    return db.query(models.Article).filter(models.Article.category == category).order_by(
+    return _article_listing(db).filter(models.Article.category == category).order_by(
         models.Article.created_at.desc()).offset(skip).limit(limit).all()
 
 
@@ -88,46 +122,39 @@ def get_articles_count_by_category(db: Session, category: str):
 # 首页推荐 - 最新文章
 def get_latest_articles(db: Session, limit: int = 10):
     return (
-        db.query(models.Article)
+        _article_listing(db)
         .order_by(models.Article.created_at.desc())
         .limit(limit)
         .all()
     )
 
 
-# 首页推荐 - 热门文章（按评论数->点赞数->浏览数排序）
-def get_hot_articles(db: Session, limit: int = 10):
+# 热门排序：评论数 -> 点赞数 -> 独立访客数（HyperLogLog 估计，不含重复浏览）
+def _hot_listing(db: Session):
     return (
-        db.query(models.Article)
+        _article_listing(db)
+        .outerjoin(models.ArticleViewers, models.ArticleViewers.article_id == models.Article.id)
         .order_by(
             models.Article.comment_count.desc(),
             models.Article.like_count.desc(),
-            models.Article.view_count.desc(),
+            func.coalesce(models.ArticleViewers.unique_views, 0).desc(),
             models.Article.created_at.desc()
         )
-        .limit(limit)
-        .all()
     )
 
 
+# 首页推荐 - 热门文章
+def get_hot_articles(db: Session, limit: int = 10):
+    return _hot_listing(db).limit(limit).all()
+
+
 def get_hot_articles_paginated(db: Session, skip: int = 0, limit: int = 10):
-    return (
-        db.query(models.Article)
-        .order_by(
-            models.Article.comment_count.desc(),
-            models.Article.like_count.desc(),
-            models.Article.view_count.desc(),
-            models.Article.created_at.desc()
-        )
-        .offset(skip)
-        .limit(limit)
-        .all()
-    )
+    return _hot_listing(db).offset(skip).limit(limit).all()
 
 
 def get_user_articles_by_category(db: Session, author_id: int, category: str, skip=0, limit=10):
     return (
-        db.query(models.Article)
+        _article_listing(db)
         .filter(models.Article.author_id == author_id, models.Article.category == category)
         .order_by(models.Article.created_at.desc())
         .offset(skip)
@@ -155,16 +182,35 @@ def create_comment(db: Session, comment_data: schemas.CommentCreate, user_id: Op
         anonymous_name=comment_data.anonymous_name
     )
     db.add(comment)
+    db.flush()
+    # 文章评论数由后台重算后再发布事件，与评论在同一事务中登记
+    _enqueue_comment_count(db, comment, "new")
     db.commit()
     db.refresh(comment)
+    return comment
 
-    # 更新文章的评论数量
-    article = db.query(models.Article).filter(models.Article.id == comment_data.article_id).first()
-    if article:
-        article.comment_count += 1
-        db.commit()
 
-    return comment
+def _enqueue_comment_count(db: Session, comment: models.Comment, op: str) -> None:
+    # 幂等键由评论 id 与创建时间组成：同一事件重复登记只执行一次；
+    # 旧 SQLite 表没有 AUTOINCREMENT，id 可能被复用，但复用者的创建时间不同
+    created = comment.created_at.strftime("%Y%m%d%H%M%S%f") if comment.created_at else ""
+    outbox.enqueue(db, "comment.count", key=f"comment:{comment.id}:{op}:{created}",
+                   aid=comment.article_id, id=comment.id, op=op)
+
+
+@outbox.handler("comment.count")
+def _recount_comments(db: Session, payloads: list) -> None:
+    """按实际行数重算文章评论数（幂等），然后发布评论事件"""
+    article_ids = {payload["aid"] for payload in payloads}
+    counts = dict(db.query(models.Comment.article_id, func.count(models.Comment.id)).filter(
+        models.Comment.article_id.in_(article_ids)).group_by(models.Comment.article_id).all())
+    for article_id in article_ids:
+        db.query(models.Article).filter(models.Article.id == article_id).update(
+            {"comment_count": counts.get(article_id, 0)}, synchronize_session=False)
+    db.commit()
+    for payload in payloads:
+        invalidation.publish(db, "comment", id=payload["id"], aid=payload["aid"], op=payload["op"],
+                             n=counts.get(payload["aid"], 0))
 
 
 def get_comments_by_article(db: Session, article_id: int):
@@ -211,6 +257,72 @@ def get_comment_replies(db: Session, comment_id: int):
     return get_replies_recursive(comment_id)
 
 
+def comment_payload(comment, reply_count=None) -> dict:
+    """评论的 JSON 表示；reply_count 为 None 时不带回复数"""
+    # 优先显示昵称，如果没有昵称则显示用户名
+    user_display_name = None
+    if comment.user:
+        user_display_name = comment.user.nickname or comment.user.username
+
+    data = {
+        "id": comment.id,
+        "content": comment.content,
+        "created_at": comment.created_at.strftime('%Y-%m-%d %H:%M'),
+        "user": {
+            "id": comment.user.id,
+            "username": comment.user.username,
+            "nickname": comment.user.nickname,
+            "display_name": user_display_name  # 添加显示名称字段
+        } if comment.user else None,
+        "anonymous_name": comment.anonymous_name,
+        "parent_id": comment.parent_id
+    }
+    if reply_count is not None:
+        data["reply_count"] = reply_count
+    return data
+
+
+def _comment_page(query, after: Optional[tuple], limit: int, newest_first: bool):
+    """按 (created_at, id) 游标取一页，多取一条用于判断是否还有下一页"""
+    created_at, comment_id = models.Comment.created_at, models.Comment.id
+    if after is not None:
+        after_time, after_id = after
+        if newest_first:
+            query = query.filter(or_(created_at < after_time, and_(created_at == after_time, comment_id < after_id)))
+        else:
+            query = query.filter(or_(created_at > after_time, and_(created_at == after_time, comment_id > after_id)))
+    if newest_first:
+        query = query.order_by(created_at.desc(), comment_id.desc())
+    else:
+        query = query.order_by(created_at.asc(), comment_id.asc())
+    return query.options(joinedload(models.Comment.user)).limit(limit + 1).all()
+
+
+def get_top_level_comments_page(db: Session, article_id: int, after: Optional[tuple] = None, limit: int = 20):
+    """分页获取文章的顶级评论（最新在前），返回最多 limit + 1 条"""
+    query = db.query(models.Comment).filter(
+        models.Comment.article_id == article_id,
+        models.Comment.parent_id.is_(None)
+    )
+    return _comment_page(query, after, limit, newest_first=True)
+
+
+def get_replies_page(db: Session, parent_id: int, after: Optional[tuple] = None, limit: int = 50):
+    """分页获取评论的直接回复（最早在前），返回最多 limit + 1 条"""
+    query = db.query(models.Comment).filter(models.Comment.parent_id == parent_id)
+    return _comment_page(query, after, limit, newest_first=False)
+
+
+def count_replies(db: Session, comment_ids: List[int]) -> dict:
+    """一次查询每条评论的直接回复数"""
+    if not comment_ids:
+        return {}
+    rows = db.query(models.Comment.parent_id, func.count(models.Comment.id)).filter(
+        models.Comment.parent_id.in_(comment_ids)
+    ).group_by(models.Comment.parent_id).all()
+    return dict(rows)
+
+
 def get_comment(db: Session, comment_id: int):
     """获取单个评论"""
     return db.query(models.Comment).filter(models.Comment.id == comment_id).first()
@@ -247,26 +359,14 @@ def delete_comment(db: Session, comment_id: int, user_id: int) -> Optional[model
         return deleted_count
 
     # 先删除所有子评论
-    deleted_replies = delete_replies_recursive(comment_id)
+    delete_replies_recursive(comment_id)
 
     # 删除主评论
     db.delete(comment)
 
-    # 计算总共删除的评论数量
-    total_deleted = deleted_replies + 1
-
-    # 保存 article_id（commit 后 comment 对象属性不可访问）
-    article_id = comment.article_id
-
-    # 提交删除操作
+    # 提交删除操作（文章评论数由后台重算）
+    _enqueue_comment_count(db, comment, "del")
     db.commit()
-
-    # 更新文章的评论数量
-    article = db.query(models.Article).filter(models.Article.id == article_id).first()
-    if article and article.comment_count >= total_deleted:
-        article.comment_count -= total_deleted
-        db.commit()
-
     return comment
 
 
@@ -296,6 +396,8 @@ def toggle_article_like(db: Session, user_id: int, article_id: int) -> bool:
         if article and article.like_count > 0:
             article.like_count -= 1
         db.commit()
+        invalidation.publish(db, "like", aid=article_id, uid=user_id, d=-1,
+                            n=article.like_count if article else 0)
         return False
     else:
         # 如果没有点赞，则添加点赞
@@ -306,6 +408,8 @@ def toggle_article_like(db: Session, user_id: int, article_id: int) -> bool:
         if article:
             article.like_count += 1
         db.commit()
+        invalidation.publish(db, "like", aid=article_id, uid=user_id, d=1,
+                            n=article.like_count if article else 0)
         return True
 
 
@@ -318,6 +422,19 @@ def get_user_article_like_status(db: Session, user_id: int, article_id: int) ->
     return like is not None
 
 
+def get_user_liked_article_ids(db: Session, user_id: int, article_ids: Optional[List[int]] = None,
+                               limit: Optional[int] = None) -> Set[int]:
+    """获取用户点赞过的文章 id；给定 article_ids 时只在其中查找（一次 IN 查询）"""
+    query = db.query(ArticleLike.article_id).filter(ArticleLike.user_id == user_id)
+    if article_ids is not None:
+        if not article_ids:
+            return set()
+        query = query.filter(ArticleLike.article_id.in_(article_ids))
+    if limit is not None:
+        query = query.limit(limit)
+    return {article_id for (article_id,) in query}
+
+
 def get_article_likes_count(db: Session, article_id: int) -> int:
     """获取文章的点赞数"""
     return db.query(ArticleLike).filter(ArticleLike.article_id == article_id).count()
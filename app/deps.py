@@ -2,22 +2,35 @@
 from __future__ import annotations
 
 import os
+import re
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 from typing import Generator, Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
 from urllib.parse import urlparse
 
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from . import metrics
 
 DATABASE_URL = os.getenv("DB_URL", "postgresql://localhost:5432/litebook")
 POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
 MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
 
+# SQLite（单机部署）：WAL 下读不阻塞写；写入在进程内排队，同一时刻只有一个连接持有写事务
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_SERIALIZE_WRITES = os.getenv("SQLITE_SERIALIZE_WRITES", "1") in ("1", "true", "on")
+
 _parsed = urlparse(DATABASE_URL)
 print(f"[deps] 使用数据库: {_parsed.scheme}://{_parsed.hostname}{_parsed.path}")
 
@@ -26,10 +39,122 @@ engine: Optional[Engine] = None
 SessionLocal: Optional[sessionmaker] = None
 
 
+class TimedQueuePool(QueuePool):
+    """记录借出连接的等待时间与超时次数（/metrics）"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            metrics.POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+_WRITE_RE = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b", re.IGNORECASE)
+_write_lock = threading.Lock()
+# 持有写锁的 DBAPI 连接（同一时刻至多一个）
+_write_owner = None
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+
+def _release_write_lock(dbapi_connection) -> None:
+    global _write_owner
+    # 连接池归还时的回滚传入的是代理连接
+    dbapi_connection = getattr(dbapi_connection, "dbapi_connection", dbapi_connection)
+    if dbapi_connection is not None and dbapi_connection is _write_owner:
+        _write_owner = None
+        _write_lock.release()
+
+
+def _setup_sqlite(eng: Engine, memory: bool) -> None:
+    """每个新连接设置 PRAGMA；开启写入排队时，连接第一次写入前取得进程内写锁，真正提交/回滚之后释放"""
+
+    @event.listens_for(eng, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if not memory:
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        finally:
+            cursor.close()
+
+    if memory or not SQLITE_SERIALIZE_WRITES:
+        return
+
+    @event.listens_for(eng, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        global _write_owner
+        dbapi_connection = conn.connection.dbapi_connection
+        if dbapi_connection is _write_owner or not _WRITE_RE.match(statement):
+            return
+        started = time.perf_counter()
+        # 等待超过 busy_timeout 时不再排队，交给 SQLite 自己的忙等待（避免同一线程嵌套写事务时死锁）
+        acquired = _write_lock.acquire(timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        metrics.DB_WRITE_LOCK_WAIT.observe(time.perf_counter() - started)
+        if acquired:
+            _write_owner = dbapi_connection
+        else:
+            print("[deps] 等待写锁超时，直接写入")
+
+    # 引擎的 commit/rollback 事件在 DBAPI 提交之前触发，过早释放会让下一个写入者撞上 SQLite 的忙等待，
+    # 因此包装方言的 do_commit/do_rollback，在提交完成后释放
+    dialect = eng.dialect
+    do_commit, do_rollback = dialect.do_commit, dialect.do_rollback
+
+    def _do_commit(dbapi_connection):
+        try:
+            do_commit(dbapi_connection)
+        finally:
+            _release_write_lock(dbapi_connection)
+
+    def _do_rollback(dbapi_connection):
+        try:
+            do_rollback(dbapi_connection)
+        finally:
+            _release_write_lock(dbapi_connection)
+
+    dialect.do_commit, dialect.do_rollback = _do_commit, _do_rollback
+
+    @event.listens_for(eng.pool, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        _release_write_lock(dbapi_connection)
+
+
 def _build_engine() -> tuple[Engine, sessionmaker]:
+    if DATABASE_URL.startswith("sqlite"):
+        memory = _is_sqlite_memory(DATABASE_URL)
+        if memory:
+            # 内存库每个连接是独立的库，只能共用一个连接
+            eng = create_engine(DATABASE_URL, poolclass=StaticPool,
+                                connect_args={"check_same_thread": False}, future=True)
+        else:
+            # 读连接池；写入由 _setup_sqlite 的写锁串行化
+            eng = create_engine(
+                DATABASE_URL,
+                poolclass=TimedQueuePool,
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+                connect_args={"check_same_thread": False},
+                future=True,
+            )
+        _setup_sqlite(eng, memory)
+        session_cls = sessionmaker(bind=eng, autoflush=False, autocommit=False, expire_on_commit=False)
+        return eng, session_cls
+
     eng = create_engine(
         DATABASE_URL,
-        poolclass=QueuePool,
+        poolclass=TimedQueuePool,
         pool_size=POOL_SIZE,
         max_overflow=MAX_OVERFLOW,
         pool_pre_ping=True,
@@ -0,0 +1,125 @@
+# app/export.py
+"""
+全站数据流式导出（CSV / JSON Lines，可选 gzip）
+
+服务端游标分块读取，逐块编码输出，内存占用与表大小无关；
+按 id 区间导出（after_id 不含、max_id 含），中断后从最后收到的 id 继续即可。
+
+命令行:
+    python -m app.export articles --format jsonl --gzip -o articles.jsonl.gz
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from . import deps, models
+
+CHUNK_SIZE = 1000
+
+# 可导出的表及列（users 不含密码哈希）
+EXPORTS = {
+    "articles": models.Article.__table__.columns,
+    "comments": models.Comment.__table__.columns,
+    "users": [models.User.__table__.c.id, models.User.__table__.c.username, models.User.__table__.c.nickname],
+    "likes": models.ArticleLike.__table__.columns,
+}
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+def export_columns(name: str) -> list:
+    return list(EXPORTS[name])
+
+
+def iter_rows(engine: Engine, name: str, after_id: Optional[int] = None, max_id: Optional[int] = None,
+              chunk_size: int = CHUNK_SIZE) -> Iterator[list]:
+    """按 id 升序分块产出行（每块为行列表）"""
+    columns = export_columns(name)
+    id_col = columns[0].table.c.id
+    query = select(*columns).order_by(id_col)
+    if after_id is not None:
+        query = query.where(id_col > after_id)
+    if max_id is not None:
+        query = query.where(id_col <= max_id)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for chunk in result.partitions(chunk_size):
+            yield chunk
+
+
+def _to_json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return value
+
+
+def encode_csv(chunks: Iterable[list], names: list) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(names)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def encode_jsonl(chunks: Iterable[list], names: list) -> Iterator[bytes]:
+    for chunk in chunks:
+        lines = [json.dumps({k: _to_json_value(v) for k, v in zip(names, row)}, ensure_ascii=False)
+                 for row in chunk]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def gzip_stream(parts: Iterable[bytes]) -> Iterator[bytes]:
+    """边生成边压缩（gzip 格式）"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(name: str, fmt: str = "jsonl", gzip: bool = False, after_id: Optional[int] = None,
+                  max_id: Optional[int] = None, engine: Optional[Engine] = None) -> Iterator[bytes]:
+    names = [c.name for c in export_columns(name)]
+    chunks = iter_rows(engine or deps.engine, name, after_id, max_id)
+    parts = encode_csv(chunks, names) if fmt == "csv" else encode_jsonl(chunks, names)
+    return gzip_stream(parts) if gzip else parts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stream-export LiteBook tables")
+    parser.add_argument("table", choices=sorted(EXPORTS))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="jsonl")
+    parser.add_argument("--gzip", action="store_true", help="Compress output with gzip")
+    parser.add_argument("--after-id", type=int, default=None, help="Only rows with id > AFTER_ID")
+    parser.add_argument("--max-id", type=int, default=None, help="Only rows with id <= MAX_ID")
+    parser.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for part in stream_export(args.table, args.format, args.gzip, args.after_id, args.max_id):
+            out.write(part)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
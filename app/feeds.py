@@ -0,0 +1,262 @@
+# app/feeds.py
+"""
+订阅源与站点地图
+
+    /feed.xml                     全站最新文章（Atom）
+    /category/{cat_id}/feed.xml   分类最新文章
+    /u/{username}/feed.xml        作者最新文章
+    /sitemap.xml                  文章页、分类页、作者主页
+
+生成时只查列表需要的列（标题、分类、时间、作者名，摘要取自 article_renders），不加载正文；
+后台尚未算完摘要的新文章读取正文现算，缓存的订阅源不会缺摘要。
+生成结果连同 gzip / brotli（安装 brotli 时）压缩版本缓存在进程内，文章或用户变更时随失效事件整体丢弃，
+下一次请求再重新生成；内容没变时保留原来的 Last-Modified。请求带 If-None-Match / If-Modified-Since
+且未变化时返回 304，抓取程序和阅读器的重复请求基本不访问数据库。
+
+站点地图最多 SITEMAP_LIMIT（协议上限 50000）条地址，超出部分截断。
+链接以 SITE_URL 为前缀，生产环境应当配置；未配置时取请求的 Host，缓存只保留一份。
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import cache, categories, invalidation, metrics, models, rendering
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SITE_URL = os.getenv("SITE_URL", "")
+SITE_TITLE = os.getenv("SITE_TITLE", "西江月")
+FEED_SIZE = int(os.getenv("FEED_SIZE", "30"))
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "256"))
+# 失效事件丢失时的兜底过期时间
+FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", "3600"))
+FEED_MAX_AGE = int(os.getenv("FEED_MAX_AGE", "300"))
+SITEMAP_LIMIT = min(int(os.getenv("SITEMAP_LIMIT", "50000")), 50000)
+
+ATOM_TYPE = "application/atom+xml; charset=utf-8"
+XML_TYPE = "application/xml; charset=utf-8"
+
+
+class Document:
+    """生成好的 XML 及其压缩版本"""
+
+    def __init__(self, body: bytes, media_type: str, last_modified: datetime, site: str):
+        self.body = body
+        self.site = site
+        self.media_type = media_type
+        self.etag = hashlib.md5(body).hexdigest()
+        self.last_modified = last_modified
+        self.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+        self.br = brotli.compress(body) if brotli is not None else None
+
+
+documents = cache.FragmentCache(maxsize=FEED_CACHE_SIZE, ttl=FEED_CACHE_TTL)
+metrics.register_cache("feeds", documents.stats)
+
+# key -> (etag, 首次生成该内容的时间)：重新生成但内容不变时沿用，条件请求仍然命中；
+# 键与 documents 相同，按最近使用保留 FEED_CACHE_SIZE 个
+_modified: "OrderedDict[tuple, Tuple[str, datetime]]" = OrderedDict()
+_modified_lock = threading.Lock()
+
+
+@invalidation.subscribe
+def _on_invalidate(event: dict) -> None:
+    # 订阅源包含标题、分类、作者昵称；变更不频繁，整体丢弃，按需重新生成
+    if event.get("k") in ("*", "article", "user"):
+        documents.invalidate()
+
+
+def _document(key: tuple, site: str, media_type: str, generate: Callable[[], str]) -> Document:
+    def build() -> Document:
+        body = generate().encode("utf-8")
+        etag = hashlib.md5(body).hexdigest()
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with _modified_lock:
+            previous = _modified.get(key)
+            last_modified = previous[1] if previous is not None and previous[0] == etag else now
+            _modified[key] = (etag, last_modified)
+            _modified.move_to_end(key)
+            while len(_modified) > FEED_CACHE_SIZE:
+                _modified.popitem(last=False)
+        return Document(body, media_type, last_modified, site)
+
+    document = documents.get_or_render(key, build)
+    if document.site == site:
+        return document
+    # 未配置 SITE_URL 时缓存键不含 Host（Host 由客户端决定）：以缓存中的文档为准，其他 Host 的请求现场生成，不进缓存
+    return Document(generate().encode("utf-8"), media_type, datetime.now(timezone.utc).replace(microsecond=0), site)
+
+
+def base_url(request: Request) -> str:
+    return (SITE_URL or str(request.base_url)).rstrip("/")
+
+
+def _iso(value: Optional[datetime]) -> str:
+    value = value or datetime(1970, 1, 1)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat(timespec="seconds")
+
+
+# ---- Atom ----
+
+def _entries(db: Session, *filters, limit: int = FEED_SIZE) -> list:
+    return (db.query(models.Article.id, models.Article.title, models.Article.category, models.Article.created_at,
+                     models.User.username, models.User.nickname)
+            .outerjoin(models.User, models.User.id == models.Article.author_id)
+            .filter(*filters)
+            .order_by(models.Article.created_at.desc())
+            .limit(limit)
+            .all())
+
+
+def _attr(value: str) -> str:
+    return escape(value, {'"': "&quot;"})
+
+
+def _atom(db: Session, site: str, path: str, alternate: str, title: str, rows: list) -> str:
+    summaries = rendering.excerpts(db, [row.id for row in rows])
+    updated = max((row.created_at for row in rows if row.created_at), default=None)
+    cat_slugs = categories.slug_map(db, {row.category for row in rows if row.category})
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">',
+        f"<title>{escape(title)}</title>",
+        f'<link rel="self" href="{_attr(site + path)}"/>',
+        f'<link rel="alternate" type="text/html" href="{_attr(site + alternate)}"/>',
+        f"<id>{escape(site + path)}</id>",
+        f"<updated>{_iso(updated)}</updated>",
+    ]
+    for row in rows:
+        url = f"{site}/article/{row.id}"
+        parts.append("<entry>")
+        parts.append(f"<title>{escape(row.title)}</title>")
+        parts.append(f'<link rel="alternate" type="text/html" href="{_attr(url)}"/>')
+        parts.append(f"<id>{escape(url)}</id>")
+        parts.append(f"<published>{_iso(row.created_at)}</published>")
+        parts.append(f"<updated>{_iso(row.created_at)}</updated>")
+        parts.append(f"<author><name>{escape(row.nickname or row.username or '')}</name>"
+                     + (f"<uri>{escape(f'{site}/u/{row.username}/articles')}</uri>" if row.username else "")
+                     + "</author>")
+        if row.category:
+            parts.append(f'<category term="{_attr(cat_slugs[row.category])}" label="{_attr(row.category)}"/>')
+        if summaries.get(row.id):
+            parts.append(f"<summary>{escape(summaries[row.id])}</summary>")
+        parts.append("</entry>")
+    parts.append("</feed>\n")
+    return "\n".join(parts)
+
+
+def site_feed(db: Session, site: str) -> Document:
+    return _document(("feed", "site"), site, ATOM_TYPE,
+                     lambda: _atom(db, site, "/feed.xml", "/", SITE_TITLE, _entries(db)))
+
+
+def category_feed(db: Session, site: str, category: "models.Category") -> Document:
+    return _document(("feed", "category", category.slug), site, ATOM_TYPE,
+                     lambda: _atom(db, site, f"/category/{category.slug}/feed.xml", f"/category/{category.slug}",
+                                   f"{SITE_TITLE} · {category.name}",
+                                   _entries(db, models.Article.category == category.name)))
+
+
+def author_feed(db: Session, site: str, author: "models.User") -> Document:
+    return _document(("feed", "author", author.id), site, ATOM_TYPE,
+                     lambda: _atom(db, site, f"/u/{author.username}/feed.xml", f"/u/{author.username}/articles",
+                                   f"{SITE_TITLE} · {author.nickname or author.username}",
+                                   _entries(db, models.Article.author_id == author.id)))
+
+
+# ---- sitemap ----
+
+def _sitemap(db: Session, site: str) -> str:
+    urls: List[Tuple[str, Optional[datetime]]] = [(f"{site}/", None)]
+    for category in categories.list_categories(db):
+        urls.append((f"{site}/category/{category.slug}", None))
+    authors = (db.query(models.User.username, func.max(models.Article.created_at))
+               .join(models.Article, models.Article.author_id == models.User.id)
+               .group_by(models.User.username))
+    urls += [(f"{site}/u/{username}/articles", latest) for username, latest in authors]
+    remaining = SITEMAP_LIMIT - len(urls)
+    articles = (db.query(models.Article.id, models.Article.created_at)
+                .order_by(models.Article.created_at.desc())
+                .limit(max(remaining, 0) + 1)
+                .all())
+    if len(articles) > remaining:
+        print(f"[feeds] 站点地图超过 {SITEMAP_LIMIT} 条，已截断")
+        articles = articles[:remaining]
+    urls += [(f"{site}/article/{article_id}", created_at) for article_id, created_at in articles]
+
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n'
+             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for loc, lastmod in urls:
+        parts.append(f"<url><loc>{escape(loc)}</loc>"
+                     + (f"<lastmod>{lastmod.date().isoformat()}</lastmod>" if lastmod else "")
+                     + "</url>")
+    parts.append("</urlset>\n")
+    return "\n".join(parts)
+
+
+def sitemap(db: Session, site: str) -> Document:
+    return _document(("sitemap",), site, XML_TYPE, lambda: _sitemap(db, site))
+
+
+# ---- 响应 ----
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def _not_modified(request: Request, document: Document) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # 各压缩版本的 ETag 只差后缀，比较时忽略后缀与弱校验前缀
+        tags = {tag.strip().removeprefix("W/").strip('"').split("-")[0] for tag in if_none_match.split(",")}
+        return "*" in tags or document.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return document.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def respond(request: Request, document: Document) -> Response:
+    accepted = _accepted_encodings(request)
+    body, encoding = document.body, None
+    if document.br is not None and "br" in accepted:
+        body, encoding = document.br, "br"
+    elif "gzip" in accepted:
+        body, encoding = document.gzip, "gzip"
+    headers = {
+        "ETag": f'"{document.etag}-{encoding}"' if encoding else f'"{document.etag}"',
+        "Last-Modified": format_datetime(document.last_modified, usegmt=True),
+        "Cache-Control": f"public, max-age={FEED_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+    if _not_modified(request, document):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=document.media_type, headers=headers)
@@ -0,0 +1,179 @@
+# app/invalidation.py
+"""
+跨进程缓存失效通道。
+
+crud 写入提交后调用 publish() 发布精简的失效事件（如文章 id、分类），
+每个进程的后台监听线程收到事件后，交给 subscribe() 注册的处理函数清理本地缓存。
+
+- PostgreSQL：NOTIFY / LISTEN，事件随事务提交送达
+- 其他数据库（SQLite 等）：写入 cache_invalidations 表（由 app/migrations.py 创建），监听线程轮询
+"""
+from __future__ import annotations
+
+import json
+import os
+import select
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import deps, models
+
+CHANNEL = os.getenv("INVALIDATION_CHANNEL", "litebook_invalidate")
+POLL_INTERVAL = float(os.getenv("INVALIDATION_POLL_INTERVAL", "2"))
+RETENTION_SECONDS = int(os.getenv("INVALIDATION_RETENTION", "600"))
+MAX_BACKOFF = 30.0
+
+# 本进程标识：监听到自己发出的事件时跳过（发布时已在本地处理过）
+ORIGIN = uuid.uuid4().hex[:8]
+
+_handlers: list[Callable[[dict], None]] = []
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def subscribe(handler: Callable[[dict], None]) -> Callable[[dict], None]:
+    """注册失效处理函数，可作装饰器使用。事件 k == "*" 表示需要清空全部缓存。"""
+    _handlers.append(handler)
+    return handler
+
+
+def _dispatch(event: dict) -> None:
+    for handler in _handlers:
+        try:
+            handler(event)
+        except Exception as e:
+            print(f"[invalidation] 处理事件失败 {event}: {e}")
+
+
+def _is_postgres(bind=None) -> bool:
+    bind = bind if bind is not None else deps.engine
+    return bind is not None and bind.dialect.name == "postgresql"
+
+
+def publish(db: Session, kind: str, **fields) -> None:
+    """
+    发布失效事件（在业务事务提交之后调用）。
+
+    本进程立即处理；其他进程通过 NOTIFY 或轮询表收到。发布失败只记录日志，不影响写入本身。
+    """
+    event = {"k": kind, **{k: v for k, v in fields.items() if v is not None}}
+    _dispatch(event)
+    payload = json.dumps({**event, "o": ORIGIN}, ensure_ascii=False, separators=(",", ":"))
+    try:
+        bind = db.get_bind()
+        if _is_postgres(bind):
+            db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+        else:
+            db.add(models.CacheInvalidation(payload=payload))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[invalidation] 发布失败 {payload}: {e}")
+
+
+def _handle_payload(payload: str) -> None:
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return
+    if event.pop("o", None) == ORIGIN:
+        return
+    _dispatch(event)
+
+
+def _listen_postgres() -> None:
+    """建立独立连接（不占用连接池）并 LISTEN，直到出错或收到停止信号。"""
+    engine = deps.engine
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    conn = engine.dialect.dbapi.connect(*cargs, **cparams)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{CHANNEL}"')
+        print(f"[invalidation] LISTEN {CHANNEL}")
+        while not _stop.is_set():
+            if select.select([conn], [], [], POLL_INTERVAL) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                _handle_payload(conn.notifies.pop(0).payload)
+    finally:
+        conn.close()
+
+
+def _poll_table() -> None:
+    """轮询 cache_invalidations 表（SQLite 等不支持 LISTEN 的数据库）。"""
+    table = models.CacheInvalidation.__table__
+    with deps.engine.connect() as conn:
+        last_id = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table.name}")).scalar()
+    print(f"[invalidation] 轮询 {table.name}（间隔 {POLL_INTERVAL}s）")
+    last_prune = 0.0
+    while not _stop.wait(POLL_INTERVAL):
+        with deps.engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, payload FROM {table.name} WHERE id > :last_id ORDER BY id"),
+                {"last_id": last_id},
+            ).all()
+            if not rows and last_id:
+                # 旧表（没有 AUTOINCREMENT）被删空后 id 从头分配：回到 0 重新读取，重复处理失效事件无害
+                max_id = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table.name}")).scalar()
+                if max_id < last_id:
+                    print(f"[invalidation] 事件 id 回退（{last_id} -> {max_id}），重新读取")
+                    last_id = 0
+                    rows = conn.execute(
+                        text(f"SELECT id, payload FROM {table.name} ORDER BY id")).all()
+            for row_id, payload in rows:
+                _handle_payload(payload)
+                last_id = row_id
+            if time.monotonic() - last_prune > RETENTION_SECONDS:
+                # 保留 id 最大的一行，旧表也不会因删空而复用 id
+                newest = conn.execute(text(f"SELECT MAX(id) FROM {table.name}")).scalar()
+                conn.execute(table.delete().where(
+                    table.c.created_at < datetime.utcnow() - timedelta(seconds=RETENTION_SECONDS),
+                    table.c.id < (newest or 0)))
+                conn.commit()
+                last_prune = time.monotonic()
+
+
+def _run() -> None:
+    backoff = 1.0
+    connected_once = False
+    while not _stop.is_set():
+        try:
+            if connected_once:
+                # 断线期间可能漏掉事件，重连后整体清空本地缓存
+                _dispatch({"k": "*"})
+            connected_once = True
+            if _is_postgres():
+                _listen_postgres()
+            else:
+                _poll_table()
+            backoff = 1.0
+        except Exception as e:
+            print(f"[invalidation] 监听中断，{backoff:.0f}s 后重连: {e}")
+            _stop.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+def start() -> None:
+    """启动本进程的后台监听线程（由应用 lifespan 调用）。"""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="cache-invalidation", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5.0) -> None:
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
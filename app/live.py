@@ -0,0 +1,162 @@
+# app/live.py
+"""
+文章页实时更新（Server-Sent Events）
+
+评论发表/删除、点赞后，正在阅读同一篇文章的页面不必整体重新拉取评论，而是收到增量事件直接更新 DOM。
+事件来源是失效总线（invalidation）：本进程的写入直接分发，其他实例的写入经 NOTIFY/轮询到达，
+因此多实例部署时各实例的订阅者都能收到。事件里带有写入后的评论数/点赞数，分发时不必再查文章。
+
+每个订阅者有一个有界队列；客户端太慢导致队列写满时清空队列并改发 resync，由客户端整体重新加载。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, Optional, Set
+
+from . import crud, deps, invalidation
+
+QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "64"))
+MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "1000"))
+HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "20"))
+# 单个连接的最长时间，到期后由客户端 EventSource 自动重连（也便于实例下线时连接能及时结束）
+MAX_LIFETIME = float(os.getenv("LIVE_MAX_LIFETIME", "900"))
+RETRY_MS = 3000
+
+RESYNC = {"type": "resync"}
+
+
+class Subscriber:
+    def __init__(self, article_id: int, loop: asyncio.AbstractEventLoop):
+        self.article_id = article_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, event: dict) -> None:
+        """在事件循环线程中调用；队列满时丢弃积压，改为要求客户端重新同步"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class Hub:
+    """按文章 id 分组的进程内发布/订阅"""
+
+    def __init__(self, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, article_id: int) -> Optional[Subscriber]:
+        """在事件循环中调用；订阅者已满时返回 None"""
+        subscriber = Subscriber(article_id, asyncio.get_running_loop())
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            self._subscribers.setdefault(article_id, set()).add(subscriber)
+            self._count += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            group = self._subscribers.get(subscriber.article_id)
+            if group is None or subscriber not in group:
+                return
+            group.discard(subscriber)
+            if not group:
+                del self._subscribers[subscriber.article_id]
+            self._count -= 1
+
+    def has_subscribers(self, article_id: int) -> bool:
+        return article_id in self._subscribers
+
+    def publish(self, article_id: Optional[int], event: dict) -> None:
+        """可在任意线程调用；article_id 为 None 时发给所有订阅者"""
+        with self._lock:
+            if article_id is None:
+                targets = [s for group in self._subscribers.values() for s in group]
+            else:
+                targets = list(self._subscribers.get(article_id, ()))
+            self.published += 1
+        for subscriber in targets:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"subscribers": self._count, "articles": len(self._subscribers), "published": self.published}
+
+
+hub = Hub()
+
+
+def _comment_event(event: dict) -> Optional[dict]:
+    # 评论数随事件携带；新评论的内容要查库，评论事件由 outbox 工作线程或监听线程发布，不在事件循环上
+    if event.get("op") == "del":
+        return {"type": "comment_deleted", "id": event.get("id"), "comment_count": event.get("n")}
+    db = deps.SessionLocal()
+    try:
+        comment = crud.get_comment(db, event.get("id"))
+        if comment is None:
+            return None
+        return {"type": "comment_created", "comment": crud.comment_payload(comment, 0),
+                "comment_count": event.get("n")}
+    finally:
+        db.close()
+
+
+def _like_event(event: dict) -> Optional[dict]:
+    # 点赞事件在请求处理中同步发布，只用事件里带的点赞数，不查库
+    return {"type": "like_count", "delta": event.get("d", 0), "like_count": event.get("n")}
+
+
+@invalidation.subscribe
+def _on_event(event: dict) -> None:
+    kind = event.get("k")
+    if kind == "*":
+        hub.publish(None, RESYNC)
+        return
+    if kind not in ("comment", "like") or not hub.has_subscribers(event.get("aid")):
+        return
+    if "n" not in event:
+        # 未携带计数的旧格式事件（滚动升级期间），让客户端整体重新加载
+        hub.publish(event["aid"], RESYNC)
+        return
+    payload = _comment_event(event) if kind == "comment" else _like_event(event)
+    if payload is not None:
+        hub.publish(event["aid"], payload)
+
+
+def format_event(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def stream(request, subscriber: Subscriber):
+    """SSE 响应体：事件、心跳注释，连接断开或到期时结束"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MAX_LIFETIME
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while loop.time() < deadline:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        hub.unsubscribe(subscriber)
@@ -1,13 +1,37 @@
+import base64
+import hmac
+import json
 import os
 from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
 
-from fastapi import FastAPI, Depends, Request, Form, HTTPException
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from fastapi import FastAPI, Depends, Request, Response, Form, HTTPException
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 from sqlalchemy.orm import Session
 
-from . import models, schemas, crud, auth, deps
+from . import (models, schemas, crud, auth, deps, cache, invalidation, export, media, rendering, content_codec,
+               admission, viewers, live, outbox, profiling, metrics, related, categories,
+               feeds, migrations)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 读写路径依赖的表在启动时建好
+    migrations.ensure_tables(deps.engine)
+    invalidation.start()
+    viewers.start()
+    outbox.start()
+    rendering.start()
+    yield
+    rendering.stop()
+    outbox.stop()
+    viewers.stop()
+    invalidation.stop()
+
 
 app = FastAPI(
     title="LiteBook",
@@ -15,9 +39,25 @@ app = FastAPI(
     version="1.0.0",
     docs_url=None,
     redoc_url=None,
+    lifespan=lifespan,
 )
+# 按需性能剖析（PROFILING_ENABLED=1 时才安装；放在准入控制内侧，不计入排队时间）
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+# 按路由类别限制并发，超出连接池承受能力时快速返回 503
+app.add_middleware(admission.AdmissionMiddleware)
+# 最外层：请求耗时包含准入排队，被拒绝的 503 也计入
+app.add_middleware(metrics.MetricsMiddleware)
 app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
+os.makedirs(media.MEDIA_DIR, exist_ok=True)
+app.mount(media.MEDIA_URL, media.MediaFiles(directory=media.MEDIA_DIR), name="media")
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
+# 模板编译结果落盘，多个 worker / 重启后可直接复用
+os.makedirs(cache.TEMPLATE_CACHE_DIR, exist_ok=True)
+templates.env.bytecode_cache = FileSystemBytecodeCache(cache.TEMPLATE_CACHE_DIR)
+
+# Prometheus 抓取 /metrics 用的令牌（Authorization: Bearer ...）
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 # 保留用户名前缀，避免与系统路由冲突
 RESERVED_USERNAMES = {"u"}
@@ -31,10 +71,9 @@ def group_articles_by_category(articles):
     return sorted(groups.items())
 
 
-# 工具函数：分类名转cat_id
+# 工具函数：分类名转cat_id（已有分类直接用 categories 表中预先算好的 slug）
 def to_cat_id(category: str) -> str:
-    return category.replace(' ', '_').replace('（', '_').replace('）', '_').replace('(', '_').replace(')', '_').replace(
-        '/', '_').replace('\\', '_')
+    return categories.slugify(category)
 
 
 # 工具函数：用户对象转dict
@@ -44,34 +83,115 @@ def serialize_user(user):
     return None
 
 
+# 工具函数：单个分类分组的分页信息
+def make_group(category, articles, current_page, total_articles, per_page, cat_id=None):
+    total_pages = (total_articles + per_page - 1) // per_page
+    start_page = max(1, current_page - 2)
+    end_page = min(total_pages, current_page + 2)
+    return {
+        "category": category,
+        "cat_id": cat_id or to_cat_id(category),
+        "articles": articles,
+        "current_page": current_page,
+        "total_pages": total_pages,
+        "total_articles": total_articles,
+        "page_numbers": list(range(start_page, end_page + 1)),
+        "start_page": start_page,
+        "end_page": end_page,
+    }
+
+
 # 工具函数：分页分组
 def get_grouped_data(db, request, per_page=10):
-    categories = [row[0] for row in db.query(models.Article.category).distinct().all()]
     grouped_data = []
-    for category in categories:
-        cat_id = to_cat_id(category)
-        page_param = f"page_{cat_id}"
+    # 分类列表与各组总数取自分类维表
+    for category in categories.list_categories(db):
+        page_param = f"page_{category.slug}"
         current_page = int(request.query_params.get(page_param, 1))
         skip = (current_page - 1) * per_page
-        articles = crud.get_articles_by_category(db, category, skip=skip, limit=per_page)
-        total_articles = crud.get_articles_count_by_category(db, category)
-        total_pages = (total_articles + per_page - 1) // per_page
-        start_page = max(1, current_page - 2)
-        end_page = min(total_pages, current_page + 2)
-        page_numbers = list(range(start_page, end_page + 1))
-        grouped_data.append({
-            "category": category,
-            "articles": articles,
-            "current_page": current_page,
-            "total_pages": total_pages,
-            "total_articles": total_articles,
-            "page_numbers": page_numbers,
-            "start_page": start_page,
-            "end_page": end_page,
-        })
+        articles = crud.get_articles_by_category(db, category.name, skip=skip, limit=per_page)
+        grouped_data.append(make_group(category.name, articles, current_page, category.article_count, per_page,
+                                       category.slug))
     return grouped_data
 
 
+# 工具函数：侧边栏片段缓存的分页参数部分（只取 page_* 参数，与用户无关）
+def page_params_key(request):
+    return tuple(sorted((k, v) for k, v in request.query_params.items() if k.startswith("page_")))
+
+
+# 工具函数：文章正文的展示 HTML（写入时预先清洗好）
+def article_html(db, article):
+    return rendering.get_render(db, article).html if article else ""
+
+
+# 工具函数：相关文章（后台预先算好，按主键一次查询）
+def related_articles(db, article):
+    return related.get_related(db, article.id) if article else []
+
+
+# 工具函数：渲染片段模板（不含 request，可在多个用户间复用）
+def render_fragment(name, context):
+    return templates.get_template(name).render(context)
+
+
+EMPTY_RECOMMEND = {
+    "latest_articles": [],
+    "hot_articles": [],
+    "page_latest": 1,
+    "total_latest_pages": 1,
+    "page_hot": 1,
+    "total_hot_pages": 1,
+}
+
+
+# 侧边栏构建：返回侧边栏 html，动态路由与静态站点构建共用
+def build_article_sidebar(db, request):
+    return render_fragment("sidebar_article.html", {"grouped_data": get_grouped_data(db, request)})
+
+
+def build_author_sidebar(db, request, author, per_page=5):
+    # 作者维度的分类与计数走 (author_id, category, created_at) 索引
+    author_categories = [row[0] for row in
+                         db.query(models.Article.category).filter(models.Article.author_id == author.id).distinct()]
+    slugs = categories.slug_map(db, author_categories)
+    grouped_data = []
+    for category in author_categories:
+        cat_id = slugs[category]
+        page_param = f"page_{cat_id}"
+        current_page = int(request.query_params.get(page_param, 1))
+        skip = (current_page - 1) * per_page
+        articles = crud.get_user_articles_by_category(db, author.id, category, skip=skip, limit=per_page)
+        total_articles = crud.get_user_articles_count_by_category(db, author.id, category)
+        grouped_data.append(make_group(category, articles, current_page, total_articles, per_page, cat_id))
+    first_article_id = None
+    for group in grouped_data:
+        if group["articles"]:
+            first_article_id = group["articles"][0].id
+            break
+    if grouped_data:
+        html = render_fragment("sidebar_groups.html",
+                               {"grouped_data": grouped_data, "base_url": f"/u/{author.username}/articles"})
+    else:
+        # 该作者没有文章时沿用推荐区块的空状态
+        html = render_fragment("sidebar_recommend.html", EMPTY_RECOMMEND)
+    return html, first_article_id
+
+
+def build_category_sidebar(db, request, category, per_page=10):
+    """category 为分类维表中的一行"""
+    current_page = int(request.query_params.get(f"page_{category.slug}", 1))
+    articles = crud.get_articles_by_category(db, category.name, skip=(current_page - 1) * per_page, limit=per_page)
+    group = make_group(category.name, articles, current_page, category.article_count, per_page, category.slug)
+    html = render_fragment("sidebar_groups.html", {"grouped_data": [group], "base_url": f"/category/{category.slug}"})
+    return html, articles[0].id if articles else None
+
+
+def find_category(db, cat_id):
+    """按 slug 查分类（唯一索引）"""
+    return categories.get_by_slug(db, cat_id)
+
+
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request, db: Session = Depends(deps.get_db)):
     # 推荐数据分页
@@ -80,17 +200,33 @@ def index(request: Request, db: Session = Depends(deps.get_db)):
     per_page_hot = int(request.query_params.get('page_hot_size', 10))
     page_hot = int(request.query_params.get('page_hot', 1))
 
-    skip_latest = (page_latest - 1) * per_page_latest
-    skip_hot = (page_hot - 1) * per_page_hot
-
-    latest_articles = crud.get_articles(db, skip=skip_latest, limit=per_page_latest)
-    hot_articles = crud.get_hot_articles_paginated(db, skip=skip_hot, limit=per_page_hot)
+    def build_sidebar():
+        skip_latest = (page_latest - 1) * per_page_latest
+        skip_hot = (page_hot - 1) * per_page_hot
+
+        latest_articles = crud.get_articles(db, skip=skip_latest, limit=per_page_latest)
+        hot_articles = crud.get_hot_articles_paginated(db, skip=skip_hot, limit=per_page_hot)
+
+        total_latest = crud.get_articles_count(db)
+        # 热门总数等同于文章总数（评论聚合后仍是文章集合）
+        total_hot = total_latest
+        total_latest_pages = (total_latest + per_page_latest - 1) // per_page_latest
+        total_hot_pages = (total_hot + per_page_hot - 1) // per_page_hot
+
+        html = render_fragment("sidebar_recommend.html", {
+            "latest_articles": latest_articles,
+            "hot_articles": hot_articles,
+            "page_latest": page_latest,
+            "total_latest_pages": total_latest_pages,
+            "page_hot": page_hot,
+            "total_hot_pages": total_hot_pages,
+        })
+        # 右侧默认展示的文章（无 highlight 时）：最新第一篇，否则热门第一篇
+        default_article = (latest_articles or hot_articles or [None])[0]
+        return html, default_article.id if default_article else None
 
-    total_latest = crud.get_articles_count(db)
-    # 热门总数等同于文章总数（评论聚合后仍是文章集合）
-    total_hot = total_latest
-    total_latest_pages = (total_latest + per_page_latest - 1) // per_page_latest
-    total_hot_pages = (total_hot + per_page_hot - 1) // per_page_hot
+    sidebar_html, default_article_id = cache.fragments.get_or_render(
+        ("sidebar", "recommend", per_page_latest, page_latest, per_page_hot, page_hot), build_sidebar)
 
     # 右侧默认展示第一篇（优先highlight）
     first_article = None
@@ -102,25 +238,18 @@ def index(request: Request, db: Session = Depends(deps.get_db)):
                 first_article = highlight_article
         except (ValueError, TypeError):
             pass
-    if not first_article:
-        if latest_articles:
-            first_article = latest_articles[0]
-        elif hot_articles:
-            first_article = hot_articles[0]
+    if not first_article and default_article_id is not None:
+        first_article = crud.get_article(db, default_article_id)
 
     user = get_current_user_from_cookie(request, db)
-    user_id = int(getattr(user, 'id', 0)) if user and hasattr(user, 'id') and isinstance(user.id, (int, str)) else None
     user_dict = serialize_user(user)
     response = templates.TemplateResponse("index.html", {
         "request": request,
         "user": user_dict,
-        "latest_articles": latest_articles,
-        "hot_articles": hot_articles,
-        "page_latest": page_latest,
-        "total_latest_pages": total_latest_pages,
-        "page_hot": page_hot,
-        "total_hot_pages": total_hot_pages,
+        "sidebar_html": sidebar_html,
         "first_article": first_article,
+        "first_article_html": article_html(db, first_article),
+        "related_articles": related_articles(db, first_article),
     })
     response.headers["Content-Type"] = "text/html; charset=utf-8"
     return response
@@ -169,56 +298,72 @@ def user_articles(username: str, request: Request, db: Session = Depends(deps.ge
     author = crud.get_user_by_username(db, username)
     if not author:
         return RedirectResponse("/", status_code=302)
-    per_page = 5
-    categories = [row[0] for row in
-                  db.query(models.Article.category).filter(models.Article.author_id == author.id).distinct().all()]
-    grouped_data = []
-    for category in categories:
-        cat_id = to_cat_id(category)
-        page_param = f"page_{cat_id}"
-        current_page = int(request.query_params.get(page_param, 1))
-        skip = (current_page - 1) * per_page
-        articles = crud.get_user_articles_by_category(db, author.id, category, skip=skip, limit=per_page)
-        total_articles = crud.get_user_articles_count_by_category(db, author.id, category)
-        total_pages = (total_articles + per_page - 1) // per_page
-        start_page = max(1, current_page - 2)
-        end_page = min(total_pages, current_page + 2)
-        page_numbers = list(range(start_page, end_page + 1))
-        grouped_data.append({
-            "category": category,
-            "articles": articles,
-            "current_page": current_page,
-            "total_pages": total_pages,
-            "total_articles": total_articles,
-            "page_numbers": page_numbers,
-            "start_page": start_page,
-            "end_page": end_page,
-        })
-    first_article = None
-    for group in grouped_data:
-        if group["articles"]:
-            first_article = group["articles"][0]
-            break
+    sidebar_html, first_article_id = cache.fragments.get_or_render(
+        ("sidebar", "author", author.id, page_params_key(request)),
+        lambda: build_author_sidebar(db, request, author))
+    first_article = crud.get_article(db, first_article_id) if first_article_id is not None else None
     current_user = get_current_user_from_cookie(request, db)
     user_dict = serialize_user(current_user)
     response = templates.TemplateResponse("index.html", {
         "request": request,
         "user": user_dict,
-        "grouped_data": grouped_data,
+        "sidebar_html": sidebar_html,
+        "first_article": first_article,
+        "first_article_html": article_html(db, first_article),
+        "related_articles": related_articles(db, first_article),
+    })
+    response.headers["Content-Type"] = "text/html; charset=utf-8"
+    return response
+
+
+@app.get("/category/{cat_id}", response_class=HTMLResponse)
+def category_articles(cat_id: str, request: Request, db: Session = Depends(deps.get_db)):
+    category = find_category(db, cat_id)
+    if category is None:
+        return RedirectResponse("/", status_code=302)
+    sidebar_html, first_article_id = cache.fragments.get_or_render(
+        ("sidebar", "category", cat_id, page_params_key(request)),
+        lambda: build_category_sidebar(db, request, category))
+    first_article = crud.get_article(db, first_article_id) if first_article_id is not None else None
+    user_dict = serialize_user(get_current_user_from_cookie(request, db))
+    response = templates.TemplateResponse("index.html", {
+        "request": request,
+        "user": user_dict,
+        "sidebar_html": sidebar_html,
         "first_article": first_article,
-        "base_url": f"/u/{username}/articles",
-        # 为模板提供必需的变量
-        "latest_articles": [],
-        "hot_articles": [],
-        "page_latest": 1,
-        "total_latest_pages": 1,
-        "page_hot": 1,
-        "total_hot_pages": 1,
+        "first_article_html": article_html(db, first_article),
+        "related_articles": related_articles(db, first_article),
     })
     response.headers["Content-Type"] = "text/html; charset=utf-8"
     return response
 
 
+@app.get("/feed.xml", include_in_schema=False)
+def site_feed(request: Request, db: Session = Depends(deps.get_db)):
+    return feeds.respond(request, feeds.site_feed(db, feeds.base_url(request)))
+
+
+@app.get("/category/{cat_id}/feed.xml", include_in_schema=False)
+def category_feed(cat_id: str, request: Request, db: Session = Depends(deps.get_db)):
+    category = find_category(db, cat_id)
+    if category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return feeds.respond(request, feeds.category_feed(db, feeds.base_url(request), category))
+
+
+@app.get("/u/{username}/feed.xml", include_in_schema=False)
+def author_feed(username: str, request: Request, db: Session = Depends(deps.get_db)):
+    author = crud.get_user_by_username(db, username)
+    if not author:
+        raise HTTPException(status_code=404, detail="User not found")
+    return feeds.respond(request, feeds.author_feed(db, feeds.base_url(request), author))
+
+
+@app.get("/sitemap.xml", include_in_schema=False)
+def sitemap(request: Request, db: Session = Depends(deps.get_db)):
+    return feeds.respond(request, feeds.sitemap(db, feeds.base_url(request)))
+
+
 def get_current_user_from_cookie(request: Request, db: Session):
     token = request.cookies.get("access_token")
     if not token:
@@ -301,14 +446,17 @@ def read_article(request: Request, article_id: int, db: Session = Depends(deps.g
 
     user = get_current_user_from_cookie(request, db)
 
-    grouped_data = get_grouped_data(db, request)
+    sidebar_html = cache.fragments.get_or_render(
+        ("sidebar", "article", page_params_key(request)), lambda: build_article_sidebar(db, request))
     user_dict = serialize_user(user)
     return templates.TemplateResponse("article_detail.html", {
         "request": request,
         "article": article,
         "user": user_dict,
-        "grouped_data": grouped_data,
-        "first_article": article
+        "sidebar_html": sidebar_html,
+        "first_article": article,
+        "article_html": article_html(db, article),
+        "related_articles": related_articles(db, article),
     })
 
 
@@ -328,10 +476,10 @@ def edit_article_page(request: Request, article_id: int, db: Session = Depends(d
         return RedirectResponse("/", status_code=302)
 
     # 查询所有分类
-    categories = [row[0] for row in db.query(models.Article.category).distinct().all()]
+    category_names = categories.names(db)
     user_dict = serialize_user(user)
     return templates.TemplateResponse("edit_article.html", {"request": request, "article": article, "user": user_dict,
-                                                            "categories": categories})
+                                                            "categories": category_names})
 
 
 @app.post("/article/{article_id}/edit")
@@ -349,8 +497,7 @@ def edit_article(request: Request, article_id: int, title: str = Form(...), cont
         return RedirectResponse("/", status_code=302)
     crud.update_article(db, article_id, schemas.ArticleUpdate(title=title, content=content, category=category))
     # 跳转到首页并带上分组hash和文章id，自动高亮该分组该文章
-    cat_id = category.replace(' ', '_').replace('（', '_').replace('）', '_').replace('(', '_').replace(')', '_').replace(
-        '/', '_').replace('\\', '_')
+    cat_id = categories.slug_for(db, category)
     return RedirectResponse(f"/?highlight_id={article_id}#group-{cat_id}", status_code=302)
 
 
@@ -360,9 +507,8 @@ def new_article_page(request: Request, db: Session = Depends(deps.get_db)):
     if not user:
         return RedirectResponse("/login", status_code=302)
     user_dict = serialize_user(user)
-    categories = [row[0] for row in db.query(models.Article.category).distinct().all()]
     return templates.TemplateResponse("new_article.html",
-                                      {"request": request, "categories": categories, "user": user_dict})
+                                      {"request": request, "categories": categories.names(db), "user": user_dict})
 
 
 @app.post("/new")
@@ -377,7 +523,7 @@ def new_article(request: Request, title: str = Form(...), content: str = Form(..
         new_article_obj = crud.create_article(db, user_id,
                                               schemas.ArticleCreate(title=title, content=content, category=category))
         # 跳转到首页并高亮显示新创建的文章
-        cat_id = to_cat_id(category)
+        cat_id = categories.slug_for(db, category)
         return RedirectResponse(f"/?highlight_id={new_article_obj.id}#group-{cat_id}", status_code=302)
     return RedirectResponse("/", status_code=302)
 
@@ -393,13 +539,15 @@ def get_article_content(article_id: int, request: Request, db: Session = Depends
     # 浏览历史功能已移除
     can_edit = user_id is not None and article.author_id is not None and user_id == int(article.author_id)
 
-    # 返回原始内容，不进行HTML转义
-    content = str(article.content) if article.content else ""
+    # 返回写入时清洗好的HTML（不再逐次处理原始内容）
+    rendered = rendering.get_render(db, article)
 
     return {
         "id": article.id,
         "title": article.title,
-        "content": content,
+        "content": rendered.html,
+        "excerpt": rendered.excerpt,
+        "word_count": rendered.word_count,
         "author": (article.author.nickname if (article.author and getattr(article.author, "nickname", None)) else (
             article.author.username if article.author else "匿名")),
         "author_id": article.author_id,
@@ -407,7 +555,8 @@ def get_article_content(article_id: int, request: Request, db: Session = Depends
         "can_edit": can_edit,
         "view_count": article.view_count or 0,
         "like_count": article.like_count or 0,
-        "comment_count": article.comment_count or 0
+        "comment_count": article.comment_count or 0,
+        "related": [{"id": item.id, "title": item.title} for item in related_articles(db, article)],
     }
 
 
@@ -423,8 +572,7 @@ def delete_article(article_id: int, request: Request, db: Session = Depends(deps
     if user_id is not None and int(article.author_id) != user_id:
         return RedirectResponse("/", status_code=302)
     category = article.category or "未分类"
-    cat_id = category.replace(' ', '_').replace('（', '_').replace('）', '_').replace('(', '_').replace(')', '_').replace(
-        '/', '_').replace('\\', '_')
+    cat_id = categories.slug_for(db, category)
     page_param = f"page_{cat_id}"
     per_page = 10
 
@@ -463,8 +611,7 @@ def delete_article(article_id: int, request: Request, db: Session = Depends(deps
         first_article = db.query(models.Article).order_by(asc(models.Article.created_at)).first()
         if first_article:
             first_cat = first_article.category or "未分类"
-            first_cat_id = first_cat.replace(' ', '_').replace('（', '_').replace('）', '_').replace('(', '_').replace(
-                ')', '_').replace('/', '_').replace('\\', '_')
+            first_cat_id = categories.slug_for(db, first_cat)
             target_articles = crud.get_articles_by_category(db, first_cat, skip=0, limit=1000)
             target_article_ids = [a.id for a in target_articles]
             try:
@@ -486,35 +633,82 @@ def delete_article(article_id: int, request: Request, db: Session = Depends(deps
 
 
 # 评论相关API
+COMMENT_PAGE_SIZE = 20
+REPLY_PAGE_SIZE = 50
+COMMENT_PAGE_MAX = 100
+
+
+def encode_comment_cursor(comment) -> str:
+    raw = f"{comment.created_at.isoformat()}|{comment.id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_comment_cursor(cursor: str):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        created_at, comment_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(comment_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def stream_comment_page(db: Session, rows, limit: int) -> StreamingResponse:
+    """逐条编码输出一页评论：{"comments": [...], "next_cursor": ...}"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    reply_counts = crud.count_replies(db, [c.id for c in rows])
+    next_cursor = encode_comment_cursor(rows[-1]) if has_more else None
+    # 生成器在会话关闭后才执行，这里先取出所需字段
+    items = [crud.comment_payload(c, reply_counts.get(c.id, 0)) for c in rows]
+
+    def generate():
+        yield '{"comments":['
+        for i, item in enumerate(items):
+            yield ("," if i else "") + json.dumps(item, ensure_ascii=False)
+        yield '],"next_cursor":' + json.dumps(next_cursor) + "}"
+
+    return StreamingResponse(generate(), media_type="application/json; charset=utf-8")
+
+
+@app.get("/api/articles/{article_id}/comments")
+def get_comments_page(article_id: int, cursor: str = "", limit: int = COMMENT_PAGE_SIZE,
+                      db: Session = Depends(deps.get_db)):
+    """分页获取文章的顶级评论（最新在前），每条带直接回复数，回复通过 /api/comments/{id}/replies 按需展开"""
+    limit = max(1, min(limit, COMMENT_PAGE_MAX))
+    rows = crud.get_top_level_comments_page(db, article_id, decode_comment_cursor(cursor), limit)
+    return stream_comment_page(db, rows, limit)
+
+
+@app.get("/api/comments/{comment_id}/replies")
+def get_comment_replies_page(comment_id: int, cursor: str = "", limit: int = REPLY_PAGE_SIZE,
+                             db: Session = Depends(deps.get_db)):
+    """分页获取一条评论的直接回复（最早在前），每条带回复数，可继续逐层展开"""
+    limit = max(1, min(limit, COMMENT_PAGE_MAX))
+    rows = crud.get_replies_page(db, comment_id, decode_comment_cursor(cursor), limit)
+    return stream_comment_page(db, rows, limit)
+
+
+@app.get("/api/articles/{article_id}/events")
+async def article_events(article_id: int, request: Request):
+    """文章的实时事件流（SSE）：新评论、删除评论、点赞数变化；不占用数据库连接"""
+    subscriber = live.hub.subscribe(article_id)
+    if subscriber is None:
+        raise HTTPException(status_code=503, detail="Too many live connections", headers={"Retry-After": "30"})
+    return StreamingResponse(live.stream(request, subscriber), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/api/comments/{article_id}")
 def get_comments(article_id: int, db: Session = Depends(deps.get_db)):
-    """获取文章的所有评论"""
+    """获取文章的所有评论（含全部嵌套回复；评论多的文章请用分页接口）"""
     comments = crud.get_comments_by_article(db, article_id)
     result = []
     for comment in comments:
+        comment_data = crud.comment_payload(comment)
         # 获取回复（现在返回的是字典列表）
-        replies = crud.get_comment_replies(db, comment.id)
-
-        # 优先显示昵称，如果没有昵称则显示用户名
-        user_display_name = None
-        if comment.user:
-            user_display_name = comment.user.nickname or comment.user.username
-
-        comment_data = {
-            "id": comment.id,
-            "content": comment.content,
-            "created_at": comment.created_at.strftime('%Y-%m-%d %H:%M'),
-            "user": {
-                "id": comment.user.id,
-                "username": comment.user.username,
-                "nickname": comment.user.nickname,
-                "display_name": user_display_name  # 添加显示名称字段
-            } if comment.user else None,
-            "anonymous_name": comment.anonymous_name,
-            "parent_id": comment.parent_id,
-            "replies": replies  # 直接使用返回的字典列表
-        }
-
+        comment_data["replies"] = crud.get_comment_replies(db, comment.id)
         result.append(comment_data)
 
     response = JSONResponse(content={"comments": result})
@@ -556,24 +750,7 @@ def create_comment(
     user_id = int(getattr(user, 'id', 0)) if user and hasattr(user, 'id') and isinstance(user.id, (int, str)) else None
     comment = crud.create_comment(db, comment_data, user_id)
 
-    # 优先显示昵称，如果没有昵称则显示用户名
-    user_display_name = None
-    if comment.user:
-        user_display_name = comment.user.nickname or comment.user.username
-
-    response = JSONResponse(content={
-        "id": comment.id,
-        "content": comment.content,
-        "created_at": comment.created_at.strftime('%Y-%m-%d %H:%M'),
-        "user": {
-            "id": comment.user.id,
-            "username": comment.user.username,
-            "nickname": comment.user.nickname,
-            "display_name": user_display_name  # 添加显示名称字段
-        } if comment.user else None,
-        "anonymous_name": comment.anonymous_name,
-        "parent_id": comment.parent_id
-    })
+    response = JSONResponse(content=crud.comment_payload(comment))
     response.headers["Content-Type"] = "application/json; charset=utf-8"
     return response
 
@@ -597,14 +774,25 @@ def delete_comment(comment_id: int, request: Request, db: Session = Depends(deps
 @app.post("/api/articles/{article_id}/view")
 async def increment_view_count(
         article_id: int,
+        request: Request,
+        response: Response,
         db: Session = Depends(deps.get_db)
 ):
-    """增加文章浏览数"""
+    """增加文章浏览数，并计入独立访客草图"""
     try:
         article = crud.increment_view_count(db, article_id)
         if not article:
             raise HTTPException(status_code=404, detail="Article not found")
-        return {"message": "View count incremented", "view_count": article.view_count}
+        user = get_current_user_from_cookie(request, db)
+        key, new_cookie = viewers.visitor_key(user, request.cookies.get(viewers.COOKIE_NAME))
+        if new_cookie:
+            response.set_cookie(viewers.COOKIE_NAME, new_cookie, max_age=viewers.COOKIE_MAX_AGE,
+                                httponly=True, samesite="lax")
+        viewers.record(article_id, key)
+        return {"message": "View count incremented", "view_count": article.view_count,
+                "unique_views": viewers.unique_views(db, article_id)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -642,6 +830,43 @@ async def toggle_article_like(
     }
 
 
+# 批量查询点赞状态时单次最多的文章数；点赞数超过 LIKED_SET_MAX 的用户不缓存整个集合
+LIKE_STATUS_MAX_IDS = 200
+LIKED_SET_MAX = int(os.getenv("LIKED_SET_MAX", "5000"))
+
+
+def _load_liked_set(db: Session, user_id: int):
+    liked = crud.get_user_liked_article_ids(db, user_id, limit=LIKED_SET_MAX + 1)
+    return frozenset(liked) if len(liked) <= LIKED_SET_MAX else None
+
+
+def liked_article_ids(db: Session, user_id: int, article_ids):
+    """用户在 article_ids 中点赞过的文章；优先用缓存的点赞集合，点赞后由失效事件清除"""
+    liked = cache.liked_sets.get_or_render(("liked", user_id), lambda: _load_liked_set(db, user_id))
+    if liked is None:
+        return crud.get_user_liked_article_ids(db, user_id, list(article_ids))
+    return liked.intersection(article_ids)
+
+
+@app.get("/api/articles/like-status")
+async def get_articles_like_status(
+        request: Request,
+        ids: str = "",
+        db: Session = Depends(deps.get_db)
+):
+    """批量获取用户对多篇文章的点赞状态（ids 以逗号分隔），用于侧边栏标记"""
+    try:
+        article_ids = list(dict.fromkeys(int(x) for x in ids.split(",") if x.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid article ids")
+    if len(article_ids) > LIKE_STATUS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {LIKE_STATUS_MAX_IDS} ids per request")
+
+    user = get_current_user_from_cookie(request, db)
+    liked = liked_article_ids(db, user.id, article_ids) if user and article_ids else set()
+    return {"is_liked": {str(article_id): article_id in liked for article_id in article_ids}}
+
+
 @app.get("/api/articles/{article_id}/like-status")
 async def get_article_like_status(
         article_id: int,
@@ -653,5 +878,148 @@ async def get_article_like_status(
     if not user:
         return {"is_liked": False}
 
-    is_liked = crud.get_user_article_like_status(db, user.id, article_id)
+    is_liked = article_id in liked_article_ids(db, user.id, [article_id])
     return {"is_liked": is_liked}
+
+
+@app.get("/admin/export/{table}")
+def export_table(table: str, request: Request, format: str = "jsonl", gzip: bool = False,
+                 after_id: int = None, max_id: int = None, db: Session = Depends(deps.get_db)):
+    """流式导出整表（仅管理员），after_id/max_id 用于断点续传"""
+    user = get_current_user_from_cookie(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    if not auth.is_admin(user):
+        raise HTTPException(status_code=403, detail="Admin only")
+    if table not in export.EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown table")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+
+    filename = f"{table}.{format}" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    # 流内自行取连接，不占用请求的会话
+    return StreamingResponse(export.stream_export(table, format, gzip, after_id, max_id),
+                             media_type="application/gzip" if gzip else export.FORMATS[format], headers=headers)
+
+
+@app.get("/admin/stats/compression")
+def compression_stats(request: Request, db: Session = Depends(deps.get_db)):
+    """本进程读取正文的解压次数、平均耗时与压缩率（仅管理员）"""
+    user = get_current_user_from_cookie(request, db)
+    if not auth.is_admin(user):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return content_codec.stats.snapshot()
+
+
+@app.get("/admin/stats/admission")
+def admission_stats(request: Request, db: Session = Depends(deps.get_db)):
+    """各路由类别的并发、排队与拒绝计数（仅管理员）"""
+    user = get_current_user_from_cookie(request, db)
+    if not auth.is_admin(user):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return {**admission.snapshot(), "live": live.hub.snapshot()}
+
+
+@app.get("/admin/stats/outbox")
+def outbox_stats(request: Request, db: Session = Depends(deps.get_db)):
+    """后台任务积压与失败数（仅管理员）"""
+    user = get_current_user_from_cookie(request, db)
+    if not auth.is_admin(user):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return outbox.snapshot(db)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    """Prometheus 抓取入口：设置了 METRICS_TOKEN 时用 Bearer 令牌，否则仅管理员登录后可见"""
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    else:
+        with deps.SessionLocal() as db:
+            if not auth.is_admin(get_current_user_from_cookie(request, db)):
+                raise HTTPException(status_code=403, detail="Admin only")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def require_profiling_admin(request: Request, db: Session):
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    user = get_current_user_from_cookie(request, db)
+    if not auth.is_admin(user):
+        raise HTTPException(status_code=403, detail="Admin only")
+
+
+@app.get("/admin/profiling")
+def profiling_status(request: Request, db: Session = Depends(deps.get_db)):
+    """当前 CPU 采集与 tracemalloc 状态（仅管理员）"""
+    require_profiling_admin(request, db)
+    return profiling.snapshot()
+
+
+@app.post("/admin/profiling/cpu/start")
+def profiling_cpu_start(request: Request, rate: float = 0.0, route: str = None, count: int = 0,
+                        interval_ms: float = profiling.DEFAULT_INTERVAL_MS, db: Session = Depends(deps.get_db)):
+    """开始 CPU 采样：按比例抽取请求（rate），或剖析路由模板 route 接下来的 count 个请求（仅管理员）"""
+    require_profiling_admin(request, db)
+    if route is not None:
+        if count <= 0:
+            raise HTTPException(status_code=400, detail="count must be positive when route is given")
+        if route not in {getattr(r, "path", None) for r in app.routes}:
+            raise HTTPException(status_code=400, detail="Unknown route")
+    elif not 0 < rate <= 1:
+        raise HTTPException(status_code=400, detail="rate must be in (0, 1]")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be in [1, 1000]")
+    return profiling.start(rate=rate, route=route, count=count, interval_ms=interval_ms).snapshot()
+
+
+@app.post("/admin/profiling/cpu/stop")
+def profiling_cpu_stop(request: Request, db: Session = Depends(deps.get_db)):
+    """结束 CPU 采样，结果保留到下一次开始（仅管理员）"""
+    require_profiling_admin(request, db)
+    session = profiling.stop()
+    return session.snapshot() if session else {}
+
+
+@app.get("/admin/profiling/cpu/profile")
+def profiling_cpu_profile(request: Request, db: Session = Depends(deps.get_db)):
+    """下载 collapsed stack 格式的采样结果，可用 flamegraph.pl / speedscope 查看（仅管理员）"""
+    require_profiling_admin(request, db)
+    session = profiling.current()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profile")
+    filename = f"profile-{int(session.started_at)}.folded"
+    return PlainTextResponse(session.folded(), headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.post("/admin/profiling/memory/start")
+def profiling_memory_start(request: Request, frames: int = 10, db: Session = Depends(deps.get_db)):
+    """开启 tracemalloc（仅管理员）"""
+    require_profiling_admin(request, db)
+    if not 1 <= frames <= 100:
+        raise HTTPException(status_code=400, detail="frames must be in [1, 100]")
+    profiling.tracemalloc_start(frames)
+    return profiling.snapshot()["tracemalloc"]
+
+
+@app.post("/admin/profiling/memory/snapshot")
+def profiling_memory_snapshot(request: Request, group_by: str = "lineno", limit: int = 30, match: str = None,
+                              db: Session = Depends(deps.get_db)):
+    """拍摄内存快照并与上一次对比；match 只统计路径包含该字符串的分配（如 jinja2、sqlalchemy/orm）（仅管理员）"""
+    require_profiling_admin(request, db)
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return profiling.tracemalloc_snapshot(group_by, max(1, min(limit, 200)), match)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/profiling/memory/stop")
+def profiling_memory_stop(request: Request, db: Session = Depends(deps.get_db)):
+    """关闭 tracemalloc 并丢弃基准快照（仅管理员）"""
+    require_profiling_admin(request, db)
+    profiling.tracemalloc_stop()
+    return profiling.snapshot()["tracemalloc"]
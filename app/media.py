@@ -0,0 +1,170 @@
+# app/media.py
+"""
+文章内嵌图片的媒体存储
+
+Quill 编辑器把粘贴的图片以 data: URI 写进正文，单篇文章可达数 MB。
+保存时把这些图片解码后按内容哈希存到本地磁盘，正文里改为可长期缓存的 /media 链接；
+安装了 Pillow 时同时生成缩小版本（srcset），未安装时只保存原图。
+经 crud 写入时缩小版本由 outbox 后台生成，生成前对应链接返回原图。
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
+
+from . import outbox
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "media"))
+MEDIA_URL = "/media"
+# 缩略版本的宽度（像素），原图更窄时不生成
+VARIANT_WIDTHS = (480, 960)
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+# SVG 可以携带脚本，不转存到同源的 /media（留在正文里作为 data: URI，<img> 中不会执行脚本）
+# 只对这些格式生成缩略版本（gif 动图原样保存）
+RESIZABLE = {"png": "PNG", "jpg": "JPEG", "webp": "WEBP"}
+
+VARIANT_NAME_RE = re.compile(r"^([0-9a-f]{64})_\d+\.(\w+)$")
+
+DATA_URI_IMG_RE = re.compile(
+    r'(<img\b[^>]*?\bsrc=)(["\'])data:(image/[\w.+-]+);base64,([A-Za-z0-9+/=\s]+)\2', re.IGNORECASE)
+
+
+def _media_path(name: str) -> str:
+    # 两级目录分散文件，避免单目录文件过多
+    return os.path.join(MEDIA_DIR, name[:2], name[2:4], name)
+
+
+def _media_url(name: str) -> str:
+    return f"{MEDIA_URL}/{name[:2]}/{name[2:4]}/{name}"
+
+
+def _write_once(path: str, data: bytes) -> None:
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _make_variants(data: bytes, digest: str, ext: str, generate: bool = True) -> list:
+    """返回缩小版本 [(url, 宽度), ...]；generate 为 False 时只读取图片尺寸，不生成文件"""
+    if Image is None or ext not in RESIZABLE:
+        return []
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            variants = []
+            for target in VARIANT_WIDTHS:
+                if target >= width:
+                    break
+                name = f"{digest}_{target}.{ext}"
+                path = _media_path(name)
+                if generate and not os.path.exists(path):
+                    resized = img.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+                    if ext == "jpg" and resized.mode not in ("RGB", "L"):
+                        resized = resized.convert("RGB")
+                    buf = io.BytesIO()
+                    resized.save(buf, RESIZABLE[ext], optimize=True)
+                    _write_once(path, buf.getvalue())
+                variants.append((_media_url(name), target))
+            if variants:
+                variants.append((_media_url(f"{digest}.{ext}"), width))
+            return variants
+    except Exception as e:
+        print(f"[media] 生成缩略图失败 {digest}: {e}")
+        return []
+
+
+def store_image(data: bytes, mime: str, db=None):
+    """
+    保存图片（内容相同只存一份），返回 (原图 url, srcset 字符串或 None)。
+
+    传入 db 时缩小版本登记到 outbox 随事务提交后由后台生成，否则当场生成。
+    """
+    ext = EXTENSIONS.get(mime.lower())
+    if ext is None:
+        return None, None
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{digest}.{ext}"
+    _write_once(_media_path(name), data)
+    variants = _make_variants(data, digest, ext, generate=db is None)
+    if variants and db is not None:
+        outbox.enqueue(db, "media.variants", key=f"media:{digest}", digest=digest, ext=ext)
+    srcset = ", ".join(f"{url} {width}w" for url, width in variants) or None
+    return _media_url(name), srcset
+
+
+@outbox.handler("media.variants")
+def _generate_variants(db, payloads: list) -> None:
+    for payload in payloads:
+        name = f"{payload['digest']}.{payload['ext']}"
+        with open(_media_path(name), "rb") as f:
+            _make_variants(f.read(), payload["digest"], payload["ext"])
+
+
+def extract_images(html: str, db=None) -> str:
+    """把正文中的 data: URI 图片替换为媒体链接；无法解码的保持原样"""
+    if not html or "data:image/" not in html:
+        return html
+
+    def replace(match):
+        prefix, quote, mime, payload = match.groups()
+        try:
+            data = base64.b64decode(re.sub(r"\s+", "", payload), validate=True)
+        except (binascii.Error, ValueError):
+            return match.group(0)
+        url, srcset = store_image(data, mime, db)
+        if url is None:
+            return match.group(0)
+        replaced = f"{prefix}{quote}{url}{quote}"
+        if srcset:
+            replaced += f' srcset="{srcset}"'
+        return replaced
+
+    return DATA_URI_IMG_RE.sub(replace, html)
+
+
+class MediaFiles(StaticFiles):
+    """文件名即内容哈希，内容永不改变，可让浏览器和 CDN 长期缓存"""
+
+    def file_response(self, full_path, *args, **kwargs):
+        response = super().file_response(full_path, *args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        if str(full_path).lower().endswith(".svg"):
+            # 早先转存的 SVG：禁止在站点源内执行脚本，并作为下载返回
+            response.headers["Content-Security-Policy"] = "sandbox"
+            response.headers["Content-Disposition"] = "attachment"
+        return response
+
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            match = VARIANT_NAME_RE.match(os.path.basename(path))
+            if e.status_code != 404 or match is None:
+                raise
+        # 缩小版本还没生成（outbox 排队中）时先返回原图，且不让浏览器长期缓存
+        original = os.path.join(os.path.dirname(path), f"{match.group(1)}.{match.group(2)}")
+        response = await super().get_response(original, scope)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
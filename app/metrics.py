@@ -0,0 +1,265 @@
+# app/metrics.py
+"""
+Prometheus 文本格式的进程内指标（/metrics）
+
+- 按路由模板统计的请求耗时直方图与状态码计数、处理中请求数
+- 数据库连接池：已借出、溢出、等待借出连接的耗时与超时次数；SQLite 写入排队等待写锁的耗时
+- bcrypt 计算次数与耗时
+- 缓存命中、未命中与淘汰计数：缓存通过 register_cache() 登记，抓取时读取
+- 其他模块可用 register_collector() 在抓取时追加任意指标
+
+不依赖 prometheus_client；每个进程（uvicorn worker）各自暴露一份，由抓取端按实例区分。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from .profiling import route_path
+
+PREFIX = "litebook_"
+# 与 prometheus_client 默认一致，覆盖 5ms ~ 10s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# 抓取时的样本：(标签, 值)
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _header(name: str, kind: str, help_text: str) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        lines = _header(self.name, self.kind, self.help)
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 各桶计数（非累计）+ 总和 + 总数
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = _header(self.name, self.kind, self.help)
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+_metrics: List[Metric] = []
+# 抓取时调用，返回 [(名称, 类型, 说明, 样本列表)]
+_collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+_caches: Dict[str, Callable[[], dict]] = {}
+
+
+def register_collector(collect: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]):
+    """登记抓取时执行的采集函数（可作装饰器）；名称不需要带前缀"""
+    _collectors.append(collect)
+    return collect
+
+
+def register_cache(name: str, stats: Callable[[], dict]) -> None:
+    """登记一个缓存：stats() 返回 hits、misses、evictions（累计值）及可选的 size"""
+    _caches[name] = stats
+
+
+# ---- 请求 ----
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Request latency by route template",
+                             ("method", "route"))
+REQUESTS = Counter("http_requests_total", "Requests by route template and status code",
+                   ("method", "route", "status"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being served")
+
+# ---- 连接池与写锁（等待时间在 deps 中记录）----
+
+POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+                               buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                                        5.0, 10.0, 30.0))
+POOL_TIMEOUTS = Counter("db_pool_checkout_timeouts_total", "Checkouts that gave up waiting for a connection")
+# SQLite 写入排队（deps._setup_sqlite）
+DB_WRITE_LOCK_WAIT = Histogram("db_write_lock_wait_seconds", "Time SQLite writers spent queued for the write lock",
+                               buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+# ---- bcrypt ----
+
+BCRYPT_DURATION = Histogram("bcrypt_duration_seconds", "bcrypt hash/verify calls and their duration", ("op",),
+                            buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0))
+
+
+@register_collector
+def _collect_pool():
+    from . import deps
+
+    pool = deps.engine.pool if deps.engine is not None else None
+    if pool is None or not hasattr(pool, "checkedout"):
+        return []
+    return [
+        ("db_pool_size", "gauge", "Configured pool size", [({}, pool.size())]),
+        ("db_pool_checked_out", "gauge", "Connections currently checked out", [({}, pool.checkedout())]),
+        ("db_pool_checked_in", "gauge", "Idle connections in the pool", [({}, pool.checkedin())]),
+        ("db_pool_overflow", "gauge", "Connections opened beyond pool_size (negative while the pool is filling)",
+         [({}, pool.overflow())]),
+        ("db_pool_max_overflow", "gauge", "Configured max_overflow", [({}, deps.MAX_OVERFLOW)]),
+    ]
+
+
+@register_collector
+def _collect_caches():
+    if not _caches:
+        return []
+    stats = {name: read() for name, read in _caches.items()}
+    families = []
+    for field, kind, help_text in (("hits", "counter", "Cache hits"),
+                                   ("misses", "counter", "Cache misses"),
+                                   ("evictions", "counter", "Entries evicted by size limit or expiry"),
+                                   ("size", "gauge", "Entries currently cached")):
+        samples = [({"cache": name}, values[field]) for name, values in stats.items() if field in values]
+        if samples:
+            families.append((f"cache_{field}" + ("_total" if kind == "counter" else ""), kind, help_text, samples))
+    return families
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines += metric.render()
+    for collect in _collectors:
+        try:
+            families = list(collect())
+        except Exception as e:
+            print(f"[metrics] 采集失败 {getattr(collect, '__name__', collect)}: {e}")
+            continue
+        for name, kind, help_text, samples in families:
+            lines += _header(PREFIX + name, kind, help_text)
+            lines += [f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+def route_label(scope, routes) -> str:
+    """请求对应的路由模板；未匹配的路径归为一类，避免标签基数随 URL 增长"""
+    return route_path(scope, routes) or "unmatched"
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件，放在最外层：耗时包含准入排队，503 拒绝也会计入"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            route = route_label(scope, scope["app"].router.routes)
+            REQUEST_DURATION.observe(time.perf_counter() - started, method=scope["method"], route=route)
+            REQUESTS.inc(method=scope["method"], route=route, status=str(status))
@@ -0,0 +1,209 @@
+# app/migrations.py
+"""
+版本化的结构迁移（新表与索引）
+
+每个版本列出要创建的表名或索引名，定义以 models 中的声明为准（新库由 create_all 直接建好，
+这里负责给已有的库补上）。已执行的版本记录在 schema_migrations 表，重复执行会跳过。
+迁移中列出的表在应用启动时也会由 ensure_tables() 建好（已存在则跳过，不建索引），
+读写路径上不再逐次检查表是否存在。
+
+- PostgreSQL：CREATE INDEX CONCURRENTLY，不阻塞读写；上次中断留下的无效索引先删掉再重建
+- MySQL：ALGORITHM=INPLACE, LOCK=NONE 在线建索引
+- SQLite：CREATE INDEX IF NOT EXISTS
+
+命令行:
+    python -m app.migrations            # 执行未完成的版本
+    python -m app.migrations --status   # 查看各版本状态
+    python -m app.migrations --dry-run  # 只打印将执行的语句
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import List, Optional
+
+from sqlalchemy import Index, Table, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import models
+
+# (版本, 说明, 表名或索引名列表)
+MIGRATIONS = [
+    (1, "列表、评论分页与点赞的访问路径索引", [
+        "ix_articles_created",
+        "ix_articles_category_created",
+        "ix_articles_author_category_created",
+        "ix_comments_article_parent_created",
+        "ix_comments_parent_created",
+        "ix_comments_user",
+        "ix_article_likes_article",
+    ]),
+    (2, "独立访客草图表", [
+        "article_viewers",
+    ]),
+    (3, "正文预计算结果表", [
+        "article_renders",
+    ]),
+    (4, "分类维表（建表后按文章回填）", [
+        "categories",
+    ]),
+    (5, "事务性发件箱", [
+        "outbox",
+    ]),
+    (6, "相关文章近邻表", [
+        "article_related",
+    ]),
+    (7, "跨进程缓存失效事件表", [
+        "cache_invalidations",
+    ]),
+]
+
+
+def _sync_categories(engine: Engine) -> None:
+    from . import categories
+    with Session(engine) as db:
+        categories.sync(db)
+
+
+# 建表后需要按已有数据回填的表
+BACKFILLS = {
+    "categories": _sync_categories,
+}
+
+
+def find_index(name: str) -> Index:
+    for table in models.Base.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"models 中没有索引 {name}")
+
+
+def find_table(name: str) -> Optional[Table]:
+    return models.Base.metadata.tables.get(name)
+
+
+def create_index_sql(index: Index, dialect: str, quote) -> str:
+    columns = ", ".join(quote(column.name) for column in index.columns)
+    table = quote(index.table.name)
+    if dialect == "postgresql":
+        return f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(index.name)} ON {table} ({columns})"
+    if dialect == "mysql":
+        return f"CREATE INDEX {quote(index.name)} ON {table} ({columns}) ALGORITHM=INPLACE LOCK=NONE"
+    return f"CREATE INDEX IF NOT EXISTS {quote(index.name)} ON {table} ({columns})"
+
+
+def _ensure_table(engine: Engine) -> None:
+    models.SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+
+
+def applied_versions(engine: Engine) -> set:
+    _ensure_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _index_state(conn, dialect: str, index: Index) -> Optional[bool]:
+    """None 表示不存在；PostgreSQL 上返回索引是否有效（CONCURRENTLY 中断会留下无效索引）"""
+    if dialect == "postgresql":
+        row = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name"), {"name": index.name}).first()
+        return None if row is None else bool(row[0])
+    names = {ix["name"] for ix in inspect(conn).get_indexes(index.table.name)}
+    return True if index.name in names else None
+
+
+def _create_index(engine: Engine, index: Index, dry_run: bool) -> None:
+    dialect = engine.dialect.name
+    quote = engine.dialect.identifier_preparer.quote
+    statement = create_index_sql(index, dialect, quote)
+    # CONCURRENTLY 不能在事务中执行
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        state = _index_state(conn, dialect, index)
+        if state is True:
+            print(f"  {index.name} 已存在")
+            return
+        if state is False:
+            drop = f"DROP INDEX CONCURRENTLY IF EXISTS {quote(index.name)}"
+            print(f"  {drop}")
+            if not dry_run:
+                conn.execute(text(drop))
+        print(f"  {statement}")
+        if dry_run:
+            return
+        started = time.monotonic()
+        conn.execute(text(statement))
+        print(f"  {index.name} 完成，{time.monotonic() - started:.1f}s")
+
+
+def _create_table(engine: Engine, table: Table, dry_run: bool = False) -> bool:
+    """表不存在时建表并回填，返回是否新建"""
+    if inspect(engine).has_table(table.name):
+        return False
+    print(f"  CREATE TABLE {table.name}")
+    if dry_run:
+        return True
+    table.create(bind=engine, checkfirst=True)
+    if table.name in BACKFILLS:
+        BACKFILLS[table.name](engine)
+    return True
+
+
+def ensure_tables(engine: Engine) -> None:
+    """建好迁移中列出的表并回填（已存在则跳过；索引仍由 upgrade 负责）"""
+    for _, _, names in MIGRATIONS:
+        for name in names:
+            table = find_table(name)
+            if table is not None:
+                _create_table(engine, table)
+
+
+def upgrade(engine: Engine, dry_run: bool = False) -> List[int]:
+    """执行所有未完成的版本，返回本次执行的版本号"""
+    done = applied_versions(engine)
+    executed = []
+    for version, description, names in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"迁移 {version}: {description}")
+        for name in names:
+            table = find_table(name)
+            if table is not None:
+                if not _create_table(engine, table, dry_run):
+                    print(f"  {table.name} 已存在")
+            else:
+                _create_index(engine, find_index(name), dry_run)
+        if not dry_run:
+            with engine.begin() as conn:
+                conn.execute(models.SchemaMigration.__table__.insert().values(
+                    version=version, description=description))
+        executed.append(version)
+    if not executed:
+        print("结构已是最新")
+    return executed
+
+
+def status(engine: Engine) -> None:
+    done = applied_versions(engine)
+    for version, description, _ in MIGRATIONS:
+        print(f"{version:>4}  {'已执行' if version in done else '未执行'}  {description}")
+
+
+def main() -> None:
+    from .deps import engine
+
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("--status", action="store_true", help="Show applied and pending versions")
+    parser.add_argument("--dry-run", action="store_true", help="Print statements without executing them")
+    args = parser.parse_args()
+
+    if args.status:
+        status(engine)
+    else:
+        upgrade(engine, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
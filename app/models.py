@@ -1,8 +1,11 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import (Column, Integer, String, Text, DateTime, Float, ForeignKey, UniqueConstraint, LargeBinary,
+                        Index)
 from sqlalchemy.orm import relationship, declarative_base
 
+from .content_codec import CompressedText
+
 Base = declarative_base()
 
 
@@ -20,7 +23,8 @@ class Article(Base):
     __tablename__ = "articles"
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(128), nullable=False)
-    content = Column(Text, nullable=False)
+    # 可选压缩存储，见 content_codec
+    content = Column(CompressedText, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     author_id = Column(Integer, ForeignKey("users.id"))
     author = relationship("User", back_populates="articles")
@@ -30,10 +34,20 @@ class Article(Base):
     like_count = Column(Integer, default=0, index=True)
     comment_count = Column(Integer, default=0, index=True)
 
+    # 分类列表、作者分类列表按创建时间倒序分页
+    __table_args__ = (
+        Index("ix_articles_created", "created_at"),
+        Index("ix_articles_category_created", "category", "created_at"),
+        Index("ix_articles_author_category_created", "author_id", "category", "created_at"),
+    )
+
 
 class ArticleLike(Base):
     __tablename__ = "article_likes"
-    __table_args__ = (UniqueConstraint("user_id", "article_id", name="uq_user_article_like"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "article_id", name="uq_user_article_like"),
+        Index("ix_article_likes_article", "article_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -65,3 +79,86 @@ class Comment(Base):
     # 回复功能
     parent_id = Column(Integer, ForeignKey("comments.id"), nullable=True)
     replies = relationship("Comment", backref="parent", remote_side=[id])
+
+    # 评论分页按 (created_at, id) 游标查询；新建的 SQLite 表用 AUTOINCREMENT，删除的评论 id 不再复用
+    __table_args__ = (
+        Index("ix_comments_article_parent_created", "article_id", "parent_id", "created_at", "id"),
+        Index("ix_comments_parent_created", "parent_id", "created_at", "id"),
+        Index("ix_comments_user", "user_id"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class CacheInvalidation(Base):
+    """缓存失效事件（不支持 LISTEN/NOTIFY 的数据库用轮询方式跨进程同步）"""
+    __tablename__ = "cache_invalidations"
+    id = Column(Integer, primary_key=True)
+    payload = Column(String(1024), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    # 轮询按 id 递增读取；SQLite 默认会在删空后复用 rowid，AUTOINCREMENT 保证 id 不回退
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class ArticleRender(Base):
+    """文章正文的预计算结果（摘要、字数、清洗后的 HTML），content_hash 与正文不一致时重算"""
+    __tablename__ = "article_renders"
+    article_id = Column(Integer, ForeignKey("articles.id"), primary_key=True)
+    content_hash = Column(String(32), nullable=False)
+    excerpt = Column(Text, nullable=False, default="")
+    word_count = Column(Integer, nullable=False, default=0)
+    html = Column(Text, nullable=False, default="")
+
+
+class ArticleViewers(Base):
+    """文章独立访客的 HyperLogLog 草图（固定大小）及其估计值"""
+    __tablename__ = "article_viewers"
+    article_id = Column(Integer, ForeignKey("articles.id"), primary_key=True)
+    sketch = Column(LargeBinary, nullable=False)
+    unique_views = Column(Integer, nullable=False, default=0, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class OutboxEvent(Base):
+    """事务性发件箱：与业务数据在同一事务中写入，由后台工作线程处理后续工作"""
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    # 幂等键：相同键的任务在处理前只登记一次
+    key = Column(String(191), nullable=False, index=True)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)
+    processed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_outbox_pending", "processed_at", "available_at", "id"),)
+
+
+class Category(Base):
+    """分类维表：稳定 id、预先算好的 slug（页面上的 cat_id）与文章数，见 app/categories.py"""
+    __tablename__ = "categories"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(64), unique=True, nullable=False)
+    slug = Column(String(128), unique=True, nullable=False)
+    article_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArticleRelated(Base):
+    """相关文章（TF-IDF 相似度最高的若干篇），按 (article_id, rank) 顺序读取，见 app/related.py"""
+    __tablename__ = "article_related"
+    article_id = Column(Integer, ForeignKey("articles.id"), primary_key=True)
+    rank = Column(Integer, primary_key=True, autoincrement=False)
+    related_id = Column(Integer, ForeignKey("articles.id"), nullable=False, index=True)
+    score = Column(Float, nullable=False)
+
+
+class SchemaMigration(Base):
+    """已执行的结构迁移版本，见 app/migrations.py"""
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,262 @@
+# app/outbox.py
+"""
+事务性发件箱与后台工作线程
+
+写入文章、评论时，后续工作（预计算渲染结果、重算评论数、生成图片缩略版本等）不在请求里完成，
+而是由 enqueue() 在同一事务里写一行 outbox，业务数据提交即任务落库；实例在处理中途被杀掉也不会丢。
+每个进程在 lifespan 中启动若干工作线程：
+- 按批领取到期任务，写入租约（locked_until）后提交；PostgreSQL 用 FOR UPDATE SKIP LOCKED 避免多实例抢同一行
+- 同类任务一起交给 handler 处理；失败按指数退避重试，超过 MAX_ATTEMPTS 次不再重试（保留 last_error）
+- 处理中实例退出时租约到期后由其他线程重新领取，因此 handler 必须幂等；相同幂等键的任务在处理前只登记一次
+
+outbox 表由 app/migrations.py 创建（应用启动时自动建好）。
+Cloud Run 默认只在处理请求时分配 CPU，空闲时任务会积压到下一次有请求时再处理。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
+
+from . import deps, models
+
+WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE", "60"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+RETENTION_SECONDS = int(os.getenv("OUTBOX_RETENTION", str(24 * 3600)))
+MAX_BACKOFF = 600
+
+Handler = Callable[[Session, List[dict]], None]
+
+_handlers: Dict[str, Handler] = {}
+_threads: List[threading.Thread] = []
+_stop = threading.Event()
+_wake = threading.Event()
+
+
+def handler(kind: str) -> Callable[[Handler], Handler]:
+    """注册某类任务的处理函数（装饰器）。处理函数收到同类任务的 payload 列表，返回后由调用方提交。"""
+    def register(func: Handler) -> Handler:
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(db: Session, kind: str, key: str, **payload) -> None:
+    """
+    在当前事务中登记任务（不提交）；同一幂等键还有未处理的任务时跳过。
+    已处理的任务不参与去重：内容改回之前的版本（A→B→A）时同一个键需要再执行一次
+    """
+    # 会话未开启 autoflush，本事务中尚未写入的任务也要检查
+    if any(isinstance(obj, models.OutboxEvent) and obj.key == key for obj in db.new):
+        return
+    exists = (db.query(models.OutboxEvent.id)
+              .filter(models.OutboxEvent.key == key,
+                      models.OutboxEvent.processed_at.is_(None),
+                      models.OutboxEvent.attempts < MAX_ATTEMPTS)
+              .first())
+    if exists is not None:
+        return
+    db.add(models.OutboxEvent(kind=kind, key=key, payload=json.dumps(payload, ensure_ascii=False)))
+    db.info["outbox_pending"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    # 本进程刚提交的任务立即唤醒工作线程，不必等下一次轮询
+    if session.info.pop("outbox_pending", False):
+        _wake.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session) -> None:
+    session.info.pop("outbox_pending", None)
+
+
+def _claim(db: Session) -> List[models.OutboxEvent]:
+    now = datetime.utcnow()
+    unlocked = or_(models.OutboxEvent.locked_until.is_(None), models.OutboxEvent.locked_until < now)
+    candidates = (db.query(models.OutboxEvent)
+                  .filter(models.OutboxEvent.processed_at.is_(None),
+                          models.OutboxEvent.attempts < MAX_ATTEMPTS,
+                          models.OutboxEvent.available_at <= now,
+                          unlocked)
+                  .order_by(models.OutboxEvent.id)
+                  .limit(BATCH_SIZE)
+                  .with_for_update(skip_locked=True)
+                  .all())
+    # 条件更新：不支持 SKIP LOCKED 的数据库上两个线程读到同一行时只有一个能领到
+    lease = now + timedelta(seconds=LEASE_SECONDS)
+    claimed = []
+    for row in candidates:
+        updated = db.query(models.OutboxEvent).filter(models.OutboxEvent.id == row.id, unlocked).update(
+            {"locked_until": lease}, synchronize_session=False)
+        if updated:
+            claimed.append(row)
+    db.commit()
+    return claimed
+
+
+def _mark(db: Session, ids: List[int], **values) -> None:
+    if ids:
+        db.query(models.OutboxEvent).filter(models.OutboxEvent.id.in_(ids)).update(
+            values, synchronize_session=False)
+        db.commit()
+
+
+def _fail(db: Session, rows: List[models.OutboxEvent], error: str) -> None:
+    db.rollback()
+    now = datetime.utcnow()
+    for row in rows:
+        attempts = row.attempts + 1
+        db.query(models.OutboxEvent).filter(models.OutboxEvent.id == row.id).update({
+            "attempts": attempts,
+            "available_at": now + timedelta(seconds=min(2 ** attempts, MAX_BACKOFF)),
+            "locked_until": None,
+            "last_error": error[-2000:],
+        }, synchronize_session=False)
+        if attempts >= MAX_ATTEMPTS:
+            print(f"[outbox] 任务 {row.id}（{row.kind}）已失败 {attempts} 次，不再重试")
+    db.commit()
+
+
+def _process(db: Session, rows: List[models.OutboxEvent]) -> int:
+    # 幂等：同一键在本行登记之后已被（其他行、其他实例）处理过的直接标记完成，同批内重复的键只执行一次；
+    # 更早处理过的同键任务不算，内容改回旧版本时需要再执行
+    last_done = dict(db.query(models.OutboxEvent.key, func.max(models.OutboxEvent.processed_at)).filter(
+        models.OutboxEvent.key.in_({row.key for row in rows}),
+        models.OutboxEvent.processed_at.isnot(None)).group_by(models.OutboxEvent.key))
+    groups: Dict[str, List[models.OutboxEvent]] = defaultdict(list)
+    skipped, seen = [], set()
+    for row in rows:
+        done_at = last_done.get(row.key)
+        if (done_at is not None and done_at >= row.created_at) or row.key in seen:
+            skipped.append(row.id)
+        else:
+            seen.add(row.key)
+            groups[row.kind].append(row)
+    _mark(db, skipped, processed_at=datetime.utcnow(), locked_until=None)
+
+    processed = 0
+    for kind, group in groups.items():
+        handle = _handlers.get(kind)
+        if handle is None:
+            _fail(db, group, f"no handler for {kind}")
+            continue
+        try:
+            handle(db, [json.loads(row.payload) for row in group])
+            db.commit()
+        except Exception:
+            if len(group) == 1:
+                _fail(db, group, traceback.format_exc())
+                continue
+            # 整批失败时逐条重试，只让出错的任务退避
+            db.rollback()
+            for row in group:
+                try:
+                    handle(db, [json.loads(row.payload)])
+                    db.commit()
+                except Exception:
+                    _fail(db, [row], traceback.format_exc())
+                    continue
+                _mark(db, [row.id], processed_at=datetime.utcnow(), locked_until=None)
+                processed += 1
+            continue
+        _mark(db, [row.id for row in group], processed_at=datetime.utcnow(), locked_until=None)
+        processed += len(group)
+    return processed
+
+
+def drain() -> int:
+    """处理所有到期任务直到没有可领取的，返回完成数（工作线程与运维脚本共用）"""
+    total = 0
+    db = deps.SessionLocal()
+    try:
+        while not _stop.is_set():
+            rows = _claim(db)
+            if not rows:
+                return total
+            total += _process(db, rows)
+    finally:
+        db.close()
+    return total
+
+
+def _prune() -> None:
+    db = deps.SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=RETENTION_SECONDS)
+        db.query(models.OutboxEvent).filter(models.OutboxEvent.processed_at < cutoff).delete(
+            synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _run(index: int) -> None:
+    name = f"outbox-{index}"
+    backoff = POLL_INTERVAL
+    last_prune = 0.0
+    while not _stop.is_set():
+        try:
+            drain()
+            if index == 0 and time.monotonic() - last_prune > 3600:
+                _prune()
+                last_prune = time.monotonic()
+            backoff = POLL_INTERVAL
+        except Exception as e:
+            print(f"[outbox] {name} 处理失败，{backoff:.0f}s 后重试: {e}")
+            backoff = min(backoff * 2, MAX_BACKOFF)
+        _wake.wait(backoff)
+        _wake.clear()
+
+
+def start(workers: int = WORKERS) -> None:
+    """启动本进程的工作线程（由应用 lifespan 调用）"""
+    if any(t.is_alive() for t in _threads):
+        return
+    _stop.clear()
+    _threads.clear()
+    for i in range(workers):
+        thread = threading.Thread(target=_run, args=(i,), name=f"outbox-{i}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+    if workers:
+        print(f"[outbox] 启动 {workers} 个工作线程")
+
+
+def stop(timeout: float = 5.0) -> None:
+    """停止工作线程；未完成的任务留在表里，租约到期后由其他实例处理"""
+    _stop.set()
+    _wake.set()
+    for thread in _threads:
+        thread.join(timeout)
+    _threads.clear()
+
+
+def snapshot(db: Session) -> dict:
+    now = datetime.utcnow()
+    pending = models.OutboxEvent.processed_at.is_(None)
+    rows = (db.query(models.OutboxEvent.kind,
+                     func.count(models.OutboxEvent.id),
+                     func.min(models.OutboxEvent.created_at))
+            .filter(pending, models.OutboxEvent.attempts < MAX_ATTEMPTS)
+            .group_by(models.OutboxEvent.kind).all())
+    dead = db.query(func.count(models.OutboxEvent.id)).filter(
+        pending, models.OutboxEvent.attempts >= MAX_ATTEMPTS).scalar()
+    return {
+        "workers": sum(t.is_alive() for t in _threads),
+        "pending": {kind: {"count": count, "oldest_seconds": round((now - oldest).total_seconds(), 1)}
+                    for kind, count, oldest in rows},
+        "dead": dead,
+    }
@@ -0,0 +1,285 @@
+# app/profiling.py
+"""
+线上实例的按需性能剖析（仅管理员，需 PROFILING_ENABLED=1 显式开启）
+
+- CPU：统计采样。开始一次采集后，按比例抽取请求，或只剖析某个路由接下来的 N 个请求；
+  被选中的请求执行期间，后台线程每隔 interval 毫秒抓取一次所有线程的调用栈（跳过空闲等待的线程），
+  累计为 collapsed stack 格式（"帧;帧;帧 次数"），可直接交给 flamegraph.pl / speedscope / inferno 生成火焰图。
+  同一时间其他请求的栈也会被采到，因此结果反映的是“被选中请求执行期间进程在做什么”。
+- 内存：tracemalloc 快照，与上一次快照对比，按代码行/文件汇总增长（例如模板渲染、ORM identity map 的累积）。
+
+未设置 PROFILING_ENABLED 时不安装中间件、接口返回 404；开启但没有进行中的采集时，每个请求只多一次判断。
+tracemalloc 本身开销较大，只在显式 start 之后生效，用完应 stop。
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+from starlette.routing import Match
+
+ENABLED = os.getenv("PROFILING_ENABLED", "0") in ("1", "true", "on")
+DEFAULT_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+# 单次采集最长时间与最多保留的不同调用栈数，防止忘记停止时无限增长
+MAX_DURATION = float(os.getenv("PROFILING_MAX_DURATION", "600"))
+MAX_STACKS = int(os.getenv("PROFILING_MAX_STACKS", "20000"))
+MAX_DEPTH = 128
+
+# 叶子帧落在这些函数里的线程视为空闲（等锁、等队列、事件循环等 IO）
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+
+class Session:
+    """一次 CPU 采集：选择哪些请求、采样结果"""
+
+    def __init__(self, rate: float = 0.0, route: Optional[str] = None, count: int = 0,
+                 interval_ms: float = DEFAULT_INTERVAL_MS):
+        self.rate = rate
+        self.route = route
+        self.remaining = count
+        self.interval = interval_ms / 1000.0
+        self.started_at = time.time()
+        self.ended_at: Optional[float] = None
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.truncated = 0
+        self.requests = 0
+        self.active = 0
+        self._lock = threading.Lock()
+        self._busy = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def select(self, scope, routes) -> bool:
+        """在事件循环中调用：本次请求是否剖析"""
+        if self.finished:
+            return False
+        if time.time() - self.started_at > MAX_DURATION:
+            self.finish()
+            return False
+        if self.route is not None:
+            if self.remaining <= 0 or route_path(scope, routes) != self.route:
+                return False
+            self.remaining -= 1
+            return True
+        return random.random() < self.rate
+
+    def begin(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.active += 1
+            self._busy.set()
+
+    def end(self) -> None:
+        with self._lock:
+            self.active -= 1
+            if self.active == 0:
+                self._busy.clear()
+                if self.route is not None and self.remaining <= 0:
+                    self.finish()
+
+    def finish(self) -> None:
+        if not self._done.is_set():
+            self.ended_at = time.time()
+            self._done.set()
+            self._busy.set()
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._done.is_set():
+            if not self._busy.wait(1.0) or self._done.is_set():
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = collapse(frame, names.get(ident, "thread"))
+                if stack is None:
+                    continue
+                with self._lock:
+                    self.samples += 1
+                    if stack in self.stacks or len(self.stacks) < MAX_STACKS:
+                        self.stacks[stack] += 1
+                    else:
+                        self.truncated += 1
+            time.sleep(self.interval)
+
+    def folded(self) -> str:
+        with self._lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def snapshot(self) -> dict:
+        return {
+            "rate": self.rate,
+            "route": self.route,
+            "remaining": self.remaining if self.route is not None else None,
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "finished": self.finished,
+            "requests": self.requests,
+            "in_flight": self.active,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "truncated": self.truncated,
+        }
+
+
+def collapse(frame, thread_name: str) -> Optional[str]:
+    """调用栈转为 collapsed 格式（根在前）；空闲线程返回 None"""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+        return None
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.append(thread_name)
+    return ";".join(reversed(parts))
+
+
+def route_path(scope, routes) -> Optional[str]:
+    """按应用的路由表解析请求对应的路由模板（如 /article/{article_id}）"""
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", None)
+    return None
+
+
+_session: Optional[Session] = None
+
+
+def start(rate: float = 0.0, route: Optional[str] = None, count: int = 0,
+          interval_ms: float = DEFAULT_INTERVAL_MS) -> Session:
+    """开始新的采集（替换上一次的结果）"""
+    global _session
+    if _session is not None:
+        _session.finish()
+    _session = Session(rate=rate, route=route, count=count, interval_ms=interval_ms)
+    print(f"[profiling] 开始采集: rate={rate} route={route} count={count} interval={interval_ms}ms")
+    return _session
+
+
+def stop() -> Optional[Session]:
+    if _session is not None:
+        _session.finish()
+    return _session
+
+
+def current() -> Optional[Session]:
+    return _session
+
+
+class ProfilingMiddleware:
+    """纯 ASGI 中间件；没有进行中的采集时直接放行"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = _session
+        if session is None or session.finished or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not session.select(scope, scope["app"].router.routes):
+            await self.app(scope, receive, send)
+            return
+        session.begin()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.end()
+
+
+# ---- tracemalloc ----
+
+_snapshot: Optional[tracemalloc.Snapshot] = None
+
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def tracemalloc_start(frames: int = 10) -> None:
+    global _snapshot
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _snapshot = None
+    tracemalloc.start(frames)
+    print(f"[profiling] tracemalloc 已开启（{frames} 帧）")
+
+
+def tracemalloc_stop() -> None:
+    global _snapshot
+    tracemalloc.stop()
+    _snapshot = None
+    print("[profiling] tracemalloc 已关闭")
+
+
+def _format_stat(stat, group_by: str) -> dict:
+    item = {"size_kb": round(stat.size / 1024, 1), "count": stat.count}
+    if hasattr(stat, "size_diff"):
+        item["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+        item["count_diff"] = stat.count_diff
+    if group_by == "traceback":
+        item["traceback"] = stat.traceback.format()
+    else:
+        frame = stat.traceback[0]
+        item["location"] = frame.filename if group_by == "filename" else f"{frame.filename}:{frame.lineno}"
+    return item
+
+
+def tracemalloc_snapshot(group_by: str = "lineno", limit: int = 30, match: Optional[str] = None) -> dict:
+    """拍一次快照：返回占用最多的位置，以及相对上一次快照增长最多的位置；本次快照成为下一次的基准"""
+    global _snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running")
+    filters = list(SNAPSHOT_FILTERS)
+    if match:
+        filters.append(tracemalloc.Filter(True, f"*{match}*"))
+    raw = tracemalloc.take_snapshot()
+    snapshot = raw.filter_traces(filters)
+    current_size, peak_size = tracemalloc.get_traced_memory()
+    result = {
+        "traced_kb": round(current_size / 1024, 1),
+        "peak_kb": round(peak_size / 1024, 1),
+        "top": [_format_stat(stat, group_by) for stat in snapshot.statistics(group_by)[:limit]],
+        "diff": None,
+    }
+    if _snapshot is not None:
+        # 基准保存未过滤的快照，两次可以用不同的 match 过滤
+        baseline = _snapshot.filter_traces(filters)
+        result["diff"] = [_format_stat(stat, group_by)
+                          for stat in snapshot.compare_to(baseline, group_by)[:limit]]
+    _snapshot = raw
+    return result
+
+
+def snapshot() -> dict:
+    return {
+        "enabled": ENABLED,
+        "cpu": _session.snapshot() if _session is not None else None,
+        "tracemalloc": {"tracing": tracemalloc.is_tracing(), "has_baseline": _snapshot is not None},
+    }
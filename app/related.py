@@ -0,0 +1,404 @@
+# app/related.py
+"""
+相关文章（字符 n-gram TF-IDF + 余弦相似度）
+
+- 文本：标题（计两次）+ 去掉标签的正文前 TEXT_LIMIT 个字符，转小写，标点与空白合并为一个空格
+- 特征：字符 2-gram 与 3-gram（中文不需要分词），用哈希映射到 2^FEATURE_BITS 维，
+  整个语料一次性用 NumPy 向量化计算，组成 SciPy 稀疏矩阵；tf 取 1 + log(tf)，乘 idf 后按行 L2 归一化；
+  只在一篇中出现或超过半数文章都有的 n-gram 去掉，每篇只保留权重最高的 MAX_TERMS 个
+- 近邻：按批计算 X[batch] @ X.T，每篇取相似度最高的 TOP_K 篇（低于 MIN_SCORE 的不要）
+- 存储：article_related(article_id, rank) 为主键（表由 app/migrations.py 创建），页面按主键前缀一次查询取出
+
+写入文章时经 outbox 登记后台任务，只重写这几篇文章的近邻列表，以及因此会进入或离开近邻列表的其他文章。
+TF-IDF 矩阵常驻进程内（进程启动后第一个任务读取整个语料构建一次），之后每个任务只重新向量化变化的文章，
+idf 沿用构建时的值；其他进程改过的文章经失效事件标记，下次更新前重新向量化。
+idf 随语料变化的累积偏差由定期全量重建消除，重建后各进程丢弃旧索引：
+    python -m app.related            # 全量重建
+    python -m app.related --article 12 --article 15   # 只更新指定文章
+
+需要安装 numpy 与 scipy；未安装时不登记任务，页面上不显示相关文章。
+"""
+from __future__ import annotations
+
+import argparse
+import html
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, load_only
+
+from . import deps, invalidation, migrations, models, outbox, rendering
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - 可选依赖
+    np = None
+    sparse = None
+
+TOP_K = int(os.getenv("RELATED_TOP_K", "5"))
+MIN_SCORE = float(os.getenv("RELATED_MIN_SCORE", "0.05"))
+TEXT_LIMIT = int(os.getenv("RELATED_TEXT_LIMIT", "4000"))
+# 每篇保留的特征数上限，以及 n-gram 出现在超过该比例的文章中时不计入
+MAX_TERMS = int(os.getenv("RELATED_MAX_TERMS", "300"))
+MAX_DF = 0.5
+FEATURE_BITS = 20
+NGRAM_SIZES = (2, 3)
+BATCH_SIZE = 256
+
+TAG_RE = re.compile(r"<[^>]*>")
+# 保留字母、数字（含中日韩文字），其他字符视为分隔
+SEPARATOR_RE = re.compile(r"[\W_]+")
+
+def available() -> bool:
+    return np is not None and sparse is not None
+
+
+def normalize(title: str, content: str) -> str:
+    body = html.unescape(TAG_RE.sub(" ", content or ""))[:TEXT_LIMIT]
+    text = f"{title or ''} {title or ''} {body}".lower()
+    return SEPARATOR_RE.sub(" ", text).strip()
+
+
+def _ngram_ids(text: str) -> "np.ndarray":
+    """文本的字符 n-gram 哈希（特征列号），按码点数组向量化计算"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    hashes = []
+    for n in NGRAM_SIZES:
+        if len(codes) < n:
+            continue
+        h = np.full(len(codes) - n + 1, (n * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF, dtype=np.uint64)
+        for offset in range(n):
+            # FNV 风格的乘法混合，溢出按 2^64 回绕
+            h = (h ^ codes[offset:len(codes) - n + 1 + offset]) * np.uint64(0x100000001B3)
+        hashes.append(h >> np.uint64(64 - FEATURE_BITS))
+    if not hashes:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(hashes).astype(np.int64)
+
+
+def _term_counts(texts: List[str]) -> "sparse.csr_matrix":
+    """词频矩阵（每行一篇文章，tf 已取 1 + log(tf)）"""
+    ids = [_ngram_ids(text) for text in texts]
+    lengths = np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+    rows = np.repeat(np.arange(len(ids)), lengths)
+    cols = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    matrix = sparse.csr_matrix((np.ones(len(cols), dtype=np.float32), (rows, cols)),
+                               shape=(len(ids), 1 << FEATURE_BITS))
+    matrix.sum_duplicates()
+    matrix.data = 1.0 + np.log(matrix.data)
+    return matrix
+
+
+def _feature_weights(counts) -> "np.ndarray":
+    """按语料计算每个特征的权重（idf；无用的 n-gram 为 0）"""
+    documents = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = (np.log((1.0 + documents) / (1.0 + df)) + 1.0).astype(np.float32)
+    # 只出现在一篇里的 n-gram 对相似度没有贡献，几乎每篇都有的只会让乘积变稠密
+    useful = (df > 1) & (df <= max(2, MAX_DF * documents))
+    return idf * useful
+
+
+def _vectorize(counts, weights) -> "sparse.csr_matrix":
+    """乘以特征权重、截取每篇权重最高的特征并按行 L2 归一化"""
+    matrix = counts.copy()
+    matrix.data *= weights[matrix.indices]
+    matrix.eliminate_zeros()
+    _keep_top_terms(matrix, MAX_TERMS)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return (sparse.diags((1.0 / norms).astype(np.float32)) @ matrix).tocsr()
+
+
+def build_matrix(texts: List[str]) -> "sparse.csr_matrix":
+    """TF-IDF 矩阵（每行一篇文章，已 L2 归一化）"""
+    counts = _term_counts(texts)
+    return _vectorize(counts, _feature_weights(counts))
+
+
+def _keep_top_terms(matrix, limit: int) -> None:
+    """每行只保留权重最高的 limit 个特征（原地），近邻计算的开销随之有界"""
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        if end - start > limit:
+            values = matrix.data[start:end]
+            values[np.argpartition(values, end - start - limit)[:end - start - limit]] = 0
+    matrix.eliminate_zeros()
+
+
+def top_neighbors(matrix, positions: Iterable[int], k: int = TOP_K) -> Dict[int, List[Tuple[int, float]]]:
+    """按批计算指定行的近邻：{行号: [(行号, 相似度), ...]}（相似度降序）"""
+    positions = list(positions)
+    result = {}
+    transposed = matrix.T.tocsc()
+    for start in range(0, len(positions), BATCH_SIZE):
+        batch = np.asarray(positions[start:start + BATCH_SIZE])
+        scores = (matrix[batch] @ transposed).toarray()
+        scores[np.arange(len(batch)), batch] = -1.0
+        take = min(k, scores.shape[1] - 1)
+        if take <= 0:
+            result.update((int(p), []) for p in batch)
+            continue
+        best = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        for i, position in enumerate(batch):
+            order = best[i][np.argsort(-scores[i, best[i]])]
+            result[int(position)] = [(int(j), float(scores[i, j])) for j in order if scores[i, j] >= MIN_SCORE]
+    return result
+
+
+def _texts(db: Session, article_ids: Optional[Iterable[int]] = None) -> Dict[int, str]:
+    """{文章 id: 归一化文本}；不指定 id 时读取全部文章"""
+    # 只取列，不把整库文章放进会话的 identity map
+    query = db.query(models.Article.id, models.Article.title, models.Article.content)
+    if article_ids is None:
+        return {article_id: normalize(title, content)
+                for article_id, title, content in query.order_by(models.Article.id).yield_per(500)}
+    article_ids = sorted(article_ids)
+    texts = {}
+    for start in range(0, len(article_ids), 500):
+        chunk = article_ids[start:start + 500]
+        texts.update((article_id, normalize(title, content))
+                     for article_id, title, content in query.filter(models.Article.id.in_(chunk)))
+    return texts
+
+
+class _Index:
+    """
+    进程内的 TF-IDF 矩阵及构建时的特征权重，在增量更新之间复用。
+
+    文章变化时只重新向量化这一篇（沿用已有的 idf），旧的行清零、新行追加到末尾，
+    清零的行超过四分之一时压缩一次。
+    """
+
+    def __init__(self, texts: Dict[int, str]):
+        self.ids: List[Optional[int]] = list(texts)
+        counts = _term_counts([texts[article_id] for article_id in self.ids])
+        self.weights = _feature_weights(counts)
+        self.matrix = _vectorize(counts, self.weights)
+        self.position = {article_id: p for p, article_id in enumerate(self.ids)}
+        self.dead = 0
+
+    def refresh(self, db: Session, article_ids: Iterable[int]) -> None:
+        """重新读取并向量化这些文章；已删除的文章从矩阵中去掉"""
+        article_ids = set(article_ids)
+        if not article_ids:
+            return
+        texts = _texts(db, article_ids)
+        for article_id in article_ids:
+            p = self.position.pop(article_id, None)
+            if p is not None:
+                self.matrix.data[self.matrix.indptr[p]:self.matrix.indptr[p + 1]] = 0
+                self.ids[p] = None
+                self.dead += 1
+        if texts:
+            order = sorted(texts)
+            rows = _vectorize(_term_counts([texts[article_id] for article_id in order]), self.weights)
+            self.position.update((article_id, len(self.ids) + i) for i, article_id in enumerate(order))
+            self.ids.extend(order)
+            self.matrix = sparse.vstack([self.matrix, rows], format="csr")
+        if self.dead * 4 > len(self.ids):
+            live = [p for p, article_id in enumerate(self.ids) if article_id is not None]
+            self.matrix = self.matrix[live]
+            self.ids = [self.ids[p] for p in live]
+            self.position = {article_id: p for p, article_id in enumerate(self.ids)}
+            self.dead = 0
+
+
+_index: Optional[_Index] = None
+_index_lock = threading.Lock()
+# 其他进程（或绕过 crud 的脚本）改过的文章：下次更新前重新向量化
+_dirty: set = set()
+_dirty_lock = threading.Lock()
+
+
+@invalidation.subscribe
+def _on_invalidate(event: dict) -> None:
+    global _index
+    kind = event.get("k")
+    if kind in ("*", "related"):
+        # 全量重建后 idf 已变，下次更新时重新构建
+        _index = None
+    elif kind == "article" and event.get("id") is not None:
+        with _dirty_lock:
+            _dirty.add(event["id"])
+
+
+def _take_dirty() -> set:
+    with _dirty_lock:
+        taken = set(_dirty)
+        _dirty.clear()
+    return taken
+
+
+def _load_index(db: Session) -> _Index:
+    """取进程内的索引；没有时读取整个语料构建（进程启动后或全量重建后一次）"""
+    global _index
+    if _index is None:
+        _take_dirty()
+        started = time.monotonic()
+        _index = _Index(_texts(db))
+        print(f"[related] 构建索引 {len(_index.ids)} 篇，耗时 {time.monotonic() - started:.1f}s")
+    return _index
+
+
+def _write(db: Session, article_ids: List[int], neighbors: Dict[int, List[Tuple[int, float]]]) -> None:
+    """替换这些文章的近邻列表（不提交）"""
+    table = models.ArticleRelated.__table__
+    db.execute(table.delete().where(table.c.article_id.in_(article_ids)))
+    rows = [{"article_id": article_id, "rank": rank, "related_id": related_id, "score": round(score, 4)}
+            for article_id in article_ids
+            for rank, (related_id, score) in enumerate(neighbors.get(article_id, []))]
+    if rows:
+        db.execute(table.insert(), rows)
+
+
+def _store(db: Session, ids: List[Optional[int]], found: Dict[int, List[Tuple[int, float]]]) -> None:
+    by_id = {ids[p]: [(ids[j], score) for j, score in items if ids[j] is not None] for p, items in found.items()}
+    targets = sorted(by_id)
+    for start in range(0, len(targets), 500):
+        _write(db, targets[start:start + 500], by_id)
+
+
+def rebuild(db: Session) -> int:
+    """全量重建所有文章的近邻列表（重新计算 idf），返回文章数"""
+    global _index
+    started = time.monotonic()
+    with _index_lock:
+        _take_dirty()
+        index = _Index(_texts(db))
+        db.execute(models.ArticleRelated.__table__.delete())
+        for start in range(0, len(index.ids), BATCH_SIZE):
+            _store(db, index.ids, top_neighbors(index.matrix, range(start, min(start + BATCH_SIZE, len(index.ids)))))
+        db.commit()
+    print(f"[related] 全量重建 {len(index.ids)} 篇，耗时 {time.monotonic() - started:.1f}s")
+    # 其他进程丢弃旧索引，按新的 idf 重新构建；本进程直接沿用刚构建的
+    invalidation.publish(db, "related")
+    _index = index
+    return len(index.ids)
+
+
+def _current_lists(db: Session, article_ids: List[int], changed_ids: set) -> Dict[int, Tuple[int, float, bool]]:
+    """这些文章当前的近邻列表：{文章: (条数, 最低分, 是否包含本次变化的文章)}"""
+    related = models.ArticleRelated
+    current: Dict[int, Tuple[int, float, bool]] = {}
+    for start in range(0, len(article_ids), 500):
+        chunk = article_ids[start:start + 500]
+        for article_id, count, lowest in (db.query(related.article_id, func.count(), func.min(related.score))
+                                          .filter(related.article_id.in_(chunk))
+                                          .group_by(related.article_id)):
+            current[article_id] = (count, lowest, False)
+    for (article_id,) in db.query(related.article_id).filter(related.related_id.in_(changed_ids)).distinct():
+        count, lowest, _ = current.get(article_id, (0, 0.0, False))
+        current[article_id] = (count, lowest, True)
+    return current
+
+
+def update(db: Session, article_ids: Iterable[int]) -> int:
+    """
+    增量更新：重新向量化这些文章（沿用索引构建时的 idf），重算它们的近邻，
+    并修正因此受影响的其他文章（不提交），返回重写的文章数
+    """
+    requested = set(article_ids)
+    with _index_lock:
+        index = _load_index(db)
+        index.refresh(db, requested | _take_dirty())
+        ids, matrix = index.ids, index.matrix
+        changed = sorted(index.position[a] for a in requested if a in index.position)
+        if not changed:
+            return 0
+
+        # 与变化文章的相似度：超过某篇文章当前的最低分（或其列表未满）就可能进入其列表
+        best = (matrix @ matrix[changed].T).max(axis=1).toarray().ravel()
+        candidates = [ids[p] for p in np.flatnonzero(best >= MIN_SCORE) if ids[p] is not None]
+        current = _current_lists(db, candidates, {ids[p] for p in changed})
+        affected = set(changed)
+        for article_id, (count, lowest, contains) in current.items():
+            p = index.position.get(article_id)
+            if p is not None and (contains or (best[p] >= MIN_SCORE and (count < TOP_K or best[p] > lowest))):
+                affected.add(p)
+        for article_id in candidates:
+            if article_id not in current:
+                affected.add(index.position[article_id])
+        _store(db, ids, top_neighbors(matrix, sorted(affected)))
+    return len(affected)
+
+
+def text_version(title: str, content: str) -> str:
+    """文章新建、修改后的任务版本：标题与正文的哈希"""
+    return rendering.content_hash(f"{title or ''}\0{content or ''}")
+
+
+def removed_version(removed_ids: Iterable[int]) -> str:
+    """近邻被删除后的任务版本：被删除文章的 id"""
+    return "del:" + rendering.content_hash(",".join(str(i) for i in sorted(removed_ids)))
+
+
+def schedule(db: Session, article_id: int, version: str) -> None:
+    """文章新建、修改或其近邻被删除后登记后台更新（不提交）；同一版本只登记一次"""
+    if available():
+        outbox.enqueue(db, "article.related", key=f"related:{article_id}:{version}", id=article_id)
+
+
+@outbox.handler("article.related")
+def _update_related(db: Session, payloads: list) -> None:
+    if not available():
+        raise RuntimeError("related articles need numpy and scipy")
+    started = time.monotonic()
+    count = update(db, {payload["id"] for payload in payloads})
+    print(f"[related] 更新 {count} 篇文章的相关列表，耗时 {time.monotonic() - started:.2f}s")
+
+
+def discard(db_or_conn, article_ids) -> set:
+    """
+    文章删除时删除其近邻列表（不提交），返回列表中含有它的其他文章；
+    传入会话时直接为这些文章登记重算，传入连接（绕过 crud 的脚本）时由调用方登记
+    """
+    ids = list(article_ids)
+    table = models.ArticleRelated.__table__
+    referrers = {row[0] for row in db_or_conn.execute(
+        table.select().with_only_columns(table.c.article_id).where(table.c.related_id.in_(ids)))} - set(ids)
+    db_or_conn.execute(table.delete().where(table.c.article_id.in_(ids) | table.c.related_id.in_(ids)))
+    if isinstance(db_or_conn, Session):
+        for article_id in referrers:
+            schedule(db_or_conn, article_id, removed_version(ids))
+    return referrers
+
+
+def get_related(db: Session, article_id: int, limit: int = TOP_K) -> List["models.Article"]:
+    """按主键前缀查出近邻文章（不加载正文）"""
+    related = models.ArticleRelated
+    return (db.query(models.Article)
+            .options(load_only(models.Article.id, models.Article.title, models.Article.category))
+            .join(related, related.related_id == models.Article.id)
+            .filter(related.article_id == article_id)
+            .order_by(related.rank)
+            .limit(limit)
+            .all())
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build related-article lists from TF-IDF similarity")
+    parser.add_argument("--article", type=int, action="append", help="Only update these article ids")
+    args = parser.parse_args(argv)
+    if not available():
+        raise SystemExit("需要安装 numpy 与 scipy")
+    migrations.ensure_tables(deps.engine)
+    db = deps.SessionLocal()
+    try:
+        if args.article:
+            count = update(db, args.article)
+            db.commit()
+            print(f"[related] 重写 {count} 篇文章的相关列表")
+        else:
+            rebuild(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
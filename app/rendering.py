@@ -0,0 +1,272 @@
+# app/rendering.py
+"""
+文章正文的预计算结果：摘要、字数、清洗后的 HTML
+
+写入文章时登记到 outbox，由后台计算后存入 article_renders（以正文哈希为键，正文未变不重算），
+读取时直接使用。后台尚未算完、旧文章或绕过 crud 写入的文章读取时在内存中现算（不写库），
+同时唤醒补算线程用 fill_missing() 批量补齐；补算线程在应用启动时也会先补一遍。
+article_renders 由 app/migrations.py 建表（应用启动时自动建好）。
+HTML 清洗只保留 Quill 编辑器能产生的标签和属性，去掉脚本、事件属性和危险链接。
+"""
+import hashlib
+import re
+import threading
+from html import escape
+from html.parser import HTMLParser
+
+from sqlalchemy.orm import Session
+
+from . import deps, models, outbox
+
+EXCERPT_LENGTH = 140
+
+ALLOWED_TAGS = {
+    "p", "br", "strong", "b", "em", "i", "u", "s", "strike", "a", "img", "h1", "h2", "h3", "h4", "h5", "h6",
+    "ol", "ul", "li", "blockquote", "pre", "code", "span", "sub", "sup", "div",
+}
+VOID_TAGS = {"br", "img"}
+# 这些标签连同内容一起丢弃
+DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "template", "noscript", "textarea", "select"}
+ALLOWED_ATTRS = {
+    "a": {"href", "target", "rel"},
+    "img": {"src", "srcset", "alt", "width", "height"},
+    "pre": {"spellcheck"},
+    "li": {"data-list"},
+}
+COMMON_ATTRS = {"class", "style"}
+SAFE_URL_RE = re.compile(r"^(https?:|mailto:|/|#|\.{0,2}/|[^:]*$)", re.IGNORECASE)
+# SVG 不转存到 /media，留在正文里作为 data: URI（<img> 中不执行脚本），见 media.EXTENSIONS
+SAFE_IMG_DATA_RE = re.compile(r"^data:image/(png|jpe?g|gif|webp|svg\+xml);base64,", re.IGNORECASE)
+# Quill 的颜色、对齐等用行内样式
+SAFE_STYLE_RE = re.compile(
+    r"^\s*((color|background-color|text-align)\s*:\s*[#\w\s(),.%-]+;?\s*)+$", re.IGNORECASE)
+CLASS_RE = re.compile(r"^[\w\s-]*$")
+
+WORD_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9]+(?:['\u2019-][A-Za-z0-9]+)*")
+SPACE_RE = re.compile(r"\s+")
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.text = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def _attrs(self, tag, attrs):
+        allowed = ALLOWED_ATTRS.get(tag, set()) | COMMON_ATTRS
+        kept = []
+        for name, value in attrs:
+            name = name.lower()
+            value = value or ""
+            if name not in allowed:
+                continue
+            if name in ("href", "src"):
+                url = value.strip()
+                if not (SAFE_URL_RE.match(url) or (tag == "img" and SAFE_IMG_DATA_RE.match(url))):
+                    continue
+            elif name == "srcset" and not all(SAFE_URL_RE.match(candidate.split()[0])
+                                              for candidate in value.split(",") if candidate.strip()):
+                continue
+            elif name == "style" and not SAFE_STYLE_RE.match(value):
+                continue
+            elif name == "class" and not CLASS_RE.match(value):
+                continue
+            kept.append(f' {name}="{escape(value, quote=True)}"')
+        if tag == "a" and any(k.startswith(' target=') for k in kept):
+            kept = [k for k in kept if not k.startswith(" rel=")] + [' rel="noopener noreferrer"']
+        return "".join(kept)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        self.out.append(f"<{tag}{self._attrs(tag, attrs)}>")
+        if tag in VOID_TAGS:
+            self.text.append(" ")
+        else:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in VOID_TAGS and not self.dropping:
+            self.out.append(f"<{tag}{self._attrs(tag, attrs)}>")
+            self.text.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # 补齐未闭合的内层标签
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+        if tag in ("p", "li", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "div"):
+            self.text.append(" ")
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.out.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.out.append(f"</{self.open_tags.pop()}>")
+
+
+def content_hash(content: str) -> str:
+    return hashlib.blake2b((content or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+def sanitize(content: str):
+    """返回 (清洗后的 HTML, 纯文本)"""
+    parser = _Sanitizer()
+    parser.feed(content or "")
+    parser.close()
+    return "".join(parser.out), SPACE_RE.sub(" ", "".join(parser.text)).strip()
+
+
+def make_excerpt(text: str, length: int = EXCERPT_LENGTH) -> str:
+    return text if len(text) <= length else text[:length].rstrip() + "…"
+
+
+def word_count(text: str) -> int:
+    """中文按字计，英文和数字按词计"""
+    return len(WORD_RE.findall(text))
+
+
+_stop = threading.Event()
+_wake = threading.Event()
+_thread = None
+
+
+def _compute(row: "models.ArticleRender", article, digest: str) -> "models.ArticleRender":
+    html, text = sanitize(article.content)
+    row.content_hash = digest
+    row.html = html
+    row.excerpt = make_excerpt(text)
+    row.word_count = word_count(text)
+    return row
+
+
+def refresh(db: Session, article) -> "models.ArticleRender":
+    """正文哈希变化时重算（不提交，随文章一起提交）"""
+    digest = content_hash(article.content)
+    row = db.get(models.ArticleRender, article.id)
+    if row is not None and row.content_hash == digest:
+        return row
+    if row is None:
+        row = models.ArticleRender(article_id=article.id)
+        db.add(row)
+    return _compute(row, article, digest)
+
+
+def schedule(db: Session, article) -> None:
+    """正文变化时作废旧结果并登记后台重算（不提交，随文章一起提交）"""
+    digest = content_hash(article.content)
+    row = db.get(models.ArticleRender, article.id)
+    if row is not None:
+        if row.content_hash == digest:
+            return
+        db.delete(row)
+    outbox.enqueue(db, "article.render", key=f"render:{article.id}:{digest}", id=article.id)
+
+
+@outbox.handler("article.render")
+def _render_articles(db: Session, payloads: list) -> None:
+    ids = {payload["id"] for payload in payloads}
+    for article in db.query(models.Article).filter(models.Article.id.in_(ids)):
+        refresh(db, article)
+
+
+def get_render(db: Session, article) -> "models.ArticleRender":
+    """读取预计算结果；缺失时（旧数据、批量导入）在内存中现算并唤醒补算线程，读路径不写库"""
+    row = db.get(models.ArticleRender, article.id)
+    if row is None:
+        _wake.set()
+        row = _compute(models.ArticleRender(article_id=article.id), article, content_hash(article.content))
+    return row
+
+
+def excerpts(db: Session, article_ids) -> dict:
+    """
+    批量读取摘要（只查摘要列，不加载正文）；还没有预计算结果的文章（后台尚未算完）
+    读取正文在内存中现算，并唤醒补算线程
+    """
+    article_ids = list(article_ids)
+    if not article_ids:
+        return {}
+    found = dict(db.query(models.ArticleRender.article_id, models.ArticleRender.excerpt)
+                 .filter(models.ArticleRender.article_id.in_(article_ids)))
+    missing = set(article_ids) - set(found)
+    if missing:
+        _wake.set()
+        for article_id, content in (db.query(models.Article.id, models.Article.content)
+                                    .filter(models.Article.id.in_(missing))):
+            found[article_id] = make_excerpt(sanitize(content)[1])
+    return found
+
+
+def discard(db_or_conn, article_ids) -> None:
+    """正文被绕过 crud 改写或文章被删除后，丢弃对应的预计算结果（之后由补算线程补齐）"""
+    table = models.ArticleRender.__table__
+    db_or_conn.execute(table.delete().where(table.c.article_id.in_(list(article_ids))))
+
+
+def fill_missing(db: Session, batch_size: int = 200) -> int:
+    """为还没有预计算结果的文章补算（按批提交），返回补算篇数"""
+    filled = 0
+    while True:
+        articles = (db.query(models.Article)
+                    .outerjoin(models.ArticleRender, models.ArticleRender.article_id == models.Article.id)
+                    .filter(models.ArticleRender.article_id.is_(None))
+                    .order_by(models.Article.id).limit(batch_size).all())
+        if not articles:
+            return filled
+        for article in articles:
+            refresh(db, article)
+        db.commit()
+        filled += len(articles)
+
+
+def _run() -> None:
+    # 启动时先补一遍，之后读取时遇到缺失再唤醒
+    while not _stop.is_set():
+        _wake.clear()
+        db = deps.SessionLocal()
+        try:
+            filled = fill_missing(db)
+            if filled:
+                print(f"[rendering] 补算 {filled} 篇文章的预计算结果")
+        except Exception as e:
+            db.rollback()
+            print(f"[rendering] 补算失败: {e}")
+        finally:
+            db.close()
+        _wake.wait()
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="render-backfill", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5.0) -> None:
+    global _thread
+    _stop.set()
+    _wake.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
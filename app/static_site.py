@@ -0,0 +1,268 @@
+# app/static_site.py
+"""
+静态站点预渲染（增量构建）
+
+用现有模板把文章页、分类页和作者主页渲染成静态 HTML：
+    <out>/article/<id>/index.html
+    <out>/category/<cat_id>/index.html
+    <out>/u/<username>/articles/index.html
+    <out>/static/...
+
+页面以匿名身份渲染，评论、点赞仍由页面 JS 调接口加载。
+构建清单（<out>/.build-manifest.json）记录每个页面的输入签名（标题、分类、作者名、正文哈希、
+相关文章、模板），签名未变的页面不再渲染；已删除的文章/分类/作者对应的页面会被移除。
+正文哈希取自 article_renders（先补齐缺失的预计算结果），判断是否变化时不读取、不解压正文。
+
+文章页共用的侧边栏单独写成 <out>/article/sidebar.html，页面里只有一条 SSI include，
+新增文章只需重写这一个片段，不必重新渲染所有文章页。
+
+nginx 示例：带查询参数（分页）或已登录（access_token cookie）的请求转给应用，其余直接读文件：
+    location / {
+        ssi on;
+        if ($args) { proxy_pass http://app; }
+        if ($cookie_access_token) { proxy_pass http://app; }
+        try_files $uri $uri/index.html @app;
+    }
+    location /media/ { alias <MEDIA_DIR>/; expires max; }
+
+命令行:
+    python -m app.static_site --out dist
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from starlette.requests import Request
+
+from . import categories, deps, migrations, models, related, rendering
+from .main import (app, templates, article_html, related_articles, build_article_sidebar,
+                   build_author_sidebar, build_category_sidebar)
+
+# 站点对外地址，用于模板里 url_for 生成的静态资源链接
+SITE_URL = os.getenv("SITE_URL", "http://localhost:8000")
+MANIFEST_NAME = ".build-manifest.json"
+# 文章页侧边栏片段，页面中以 SSI 引入
+ARTICLE_SIDEBAR = "/article/sidebar.html"
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+
+
+def make_request(path: str, site_url: str = SITE_URL) -> Request:
+    """构造一个匿名 GET 请求，供模板里的 url_for / query_params 使用"""
+    parts = urlsplit(site_url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "scheme": parts.scheme,
+        "server": (parts.hostname, port),
+        "root_path": parts.path.rstrip("/"),
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"host", parts.netloc.encode("latin-1"))],
+        "app": app,
+        "router": app.router,
+    })
+
+
+def digest(*parts) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def templates_signature() -> str:
+    """模板或静态资源有改动时全部重建"""
+    h = hashlib.blake2b(digest_size=16)
+    for directory in (TEMPLATES_DIR, STATIC_DIR):
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), "rb") as f:
+                h.update(name.encode("utf-8"))
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def article_signature(title, category, created_at, author, content_hash) -> str:
+    author_name = (author.nickname or author.username) if author else ""
+    return digest(title, category, created_at, author_name, content_hash)
+
+
+def article_signatures(db) -> Dict[int, str]:
+    """{文章 id: 输入签名}，只查列表列与正文哈希，不加载正文"""
+    # 作者一次载入，之后渲染时文章的 author 关系也直接命中会话缓存
+    authors = {user.id: user for user in db.query(models.User)}
+    query = (db.query(models.Article.id, models.Article.title, models.Article.category, models.Article.created_at,
+                      models.Article.author_id, models.ArticleRender.content_hash)
+             .outerjoin(models.ArticleRender, models.ArticleRender.article_id == models.Article.id)
+             .order_by(models.Article.id))
+    return {article_id: article_signature(title, category, created_at, authors.get(author_id), content_hash)
+            for article_id, title, category, created_at, author_id, content_hash in query.yield_per(1000)}
+
+
+def related_signatures(db) -> Dict[int, str]:
+    """{文章 id: 相关文章签名}，一次查出全部近邻"""
+    neighbors: Dict[int, list] = {}
+    query = (db.query(models.ArticleRelated.article_id, models.Article.id, models.Article.title)
+             .join(models.Article, models.Article.id == models.ArticleRelated.related_id)
+             .order_by(models.ArticleRelated.article_id, models.ArticleRelated.rank))
+    for article_id, related_id, title in query.yield_per(1000):
+        items = neighbors.setdefault(article_id, [])
+        if len(items) < related.TOP_K:
+            items.append((related_id, title))
+    return {article_id: digest(*items) for article_id, items in neighbors.items()}
+
+
+def load_manifest(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("pages", {})
+
+
+def save_manifest(path: str, pages: Dict[str, str]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"built_at": datetime.utcnow().isoformat(), "pages": pages}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def write_page(out_dir: str, url_path: str, html: str) -> None:
+    target = os.path.join(out_dir, url_path.strip("/"), "index.html")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = target + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(html)
+    os.replace(tmp, target)
+
+
+def write_fragment(out_dir: str, path: str, html: str) -> bool:
+    """内容有变化时才写入片段文件，返回是否写入"""
+    target = os.path.join(out_dir, path.strip("/"))
+    if os.path.exists(target):
+        with open(target, "r", encoding="utf-8") as f:
+            if f.read() == html:
+                return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = target + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(html)
+    os.replace(tmp, target)
+    return True
+
+
+def remove_page(out_dir: str, url_path: str) -> None:
+    target = os.path.join(out_dir, url_path.strip("/"), "index.html")
+    if os.path.exists(target):
+        os.remove(target)
+        try:
+            os.removedirs(os.path.dirname(target))
+        except OSError:
+            pass
+
+
+def build_site(out_dir: str, *, full: bool = False, site_url: str = SITE_URL) -> dict:
+    started = time.monotonic()
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    previous = {} if full else load_manifest(manifest_path)
+    pages: Dict[str, str] = {}
+    stats = {"rendered": 0, "skipped": 0, "removed": 0}
+    base = templates_signature()
+    index_template = templates.get_template("index.html")
+    detail_template = templates.get_template("article_detail.html")
+
+    def emit(url_path: str, signature: str, render) -> None:
+        pages[url_path] = signature
+        if previous.get(url_path) == signature and \
+                os.path.exists(os.path.join(out_dir, url_path.strip("/"), "index.html")):
+            stats["skipped"] += 1
+            return
+        write_page(out_dir, url_path, render())
+        stats["rendered"] += 1
+
+    def index_page(request: Request, sidebar_html: str, first_id: Optional[int]) -> str:
+        first_article = db.get(models.Article, first_id) if first_id is not None else None
+        neighbors = related_articles(db, first_article)
+        return index_template.render({"request": request, "user": None, "sidebar_html": sidebar_html,
+                                      "first_article": first_article,
+                                      "first_article_html": article_html(db, first_article),
+                                      "related_articles": neighbors})
+
+    shutil.copytree(STATIC_DIR, os.path.join(out_dir, "static"), dirs_exist_ok=True)
+    migrations.ensure_tables(deps.engine)
+
+    db = deps.SessionLocal()
+    try:
+        # 先补齐正文预计算结果，遍历文章时不再需要写库，正文哈希也都是最新的
+        rendering.fill_missing(db)
+        signatures = article_signatures(db)
+        neighbor_sigs = related_signatures(db)
+
+        # 文章页共用同一个侧边栏片段（各分类第一页），单独写文件，不计入文章页签名
+        article_sidebar = build_article_sidebar(db, make_request("/article/", site_url))
+        if write_fragment(out_dir, ARTICLE_SIDEBAR, article_sidebar):
+            stats["rendered"] += 1
+        sidebar_include = f'<!--# include virtual="{ARTICLE_SIDEBAR}" -->'
+
+        def detail_page(url_path: str, article_id: int) -> str:
+            article = db.get(models.Article, article_id)
+            return detail_template.render({"request": make_request(url_path, site_url), "article": article,
+                                           "user": None, "sidebar_html": sidebar_include,
+                                           "first_article": article,
+                                           "article_html": article_html(db, article),
+                                           "related_articles": related_articles(db, article)})
+
+        for article_id, signature in signatures.items():
+            url_path = f"/article/{article_id}"
+            emit(url_path, digest(base, signature, neighbor_sigs.get(article_id, digest())),
+                 lambda: detail_page(url_path, article_id))
+
+        for category in categories.list_categories(db):
+            url_path = f"/category/{category.slug}"
+            request = make_request(url_path, site_url)
+            sidebar_html, first_id = build_category_sidebar(db, request, category)
+            emit(url_path, digest(base, sidebar_html, signatures.get(first_id),
+                                  neighbor_sigs.get(first_id, digest())),
+                 lambda: index_page(request, sidebar_html, first_id))
+
+        for author in db.query(models.User).order_by(models.User.id):
+            url_path = f"/u/{author.username}/articles"
+            request = make_request(url_path, site_url)
+            sidebar_html, first_id = build_author_sidebar(db, request, author)
+            emit(url_path, digest(base, sidebar_html, signatures.get(first_id),
+                                  neighbor_sigs.get(first_id, digest())),
+                 lambda: index_page(request, sidebar_html, first_id))
+    finally:
+        db.close()
+
+    for url_path in previous.keys() - pages.keys():
+        remove_page(out_dir, url_path)
+        stats["removed"] += 1
+    save_manifest(manifest_path, pages)
+
+    print(f"[static_site] 渲染 {stats['rendered']}，未变 {stats['skipped']}，删除 {stats['removed']}，"
+          f"耗时 {time.monotonic() - started:.1f}s -> {out_dir}")
+    return stats
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pre-render LiteBook pages to static HTML")
+    parser.add_argument("--out", default="dist", help="Output directory (default: dist)")
+    parser.add_argument("--full", action="store_true", help="Ignore the build manifest and re-render everything")
+    parser.add_argument("--site-url", default=SITE_URL, help="Public site URL (default: $SITE_URL)")
+    args = parser.parse_args(argv)
+    build_site(args.out, full=args.full, site_url=args.site_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# app/viewers.py
+"""
+文章独立访客计数（HyperLogLog）
+
+view_count 每次调用都加一（刷新、重复点击都算），热门排行因此被放大。
+这里为每篇文章维护一个 HyperLogLog：登录用户按用户 id，匿名访客按 cookie 中随机 id 的哈希计入。
+进程内先累积在内存里，后台线程定期与库中的草图合并后写回 article_viewers（每篇固定 1KB），
+同时写入估计的独立访客数供热门排行使用。article_viewers 由 app/migrations.py 建表（应用启动时自动建好）。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import secrets
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from . import deps, models
+from .hll import HyperLogLog
+
+FLUSH_INTERVAL = float(os.getenv("VIEWERS_FLUSH_INTERVAL", "30"))
+COOKIE_NAME = "lb_vid"
+COOKIE_MAX_AGE = 365 * 24 * 3600
+
+_pending: Dict[int, HyperLogLog] = {}
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def visitor_key(user, visitor_id: Optional[str]):
+    """返回 (计数用的访客键, 需要新设置的 cookie 值或 None)"""
+    if user is not None:
+        return f"u:{user.id}", None
+    new_cookie = None
+    if not visitor_id:
+        visitor_id = new_cookie = secrets.token_urlsafe(16)
+    # 只保存哈希后的值，草图本身也不可逆
+    return "a:" + hashlib.blake2b(visitor_id.encode("utf-8"), digest_size=16).hexdigest(), new_cookie
+
+
+def record(article_id: int, key: str) -> None:
+    with _lock:
+        sketch = _pending.get(article_id)
+        if sketch is None:
+            sketch = _pending[article_id] = HyperLogLog()
+        sketch.add(key)
+
+
+def _requeue(article_id: int, sketch: HyperLogLog) -> None:
+    with _lock:
+        current = _pending.get(article_id)
+        if current is None:
+            _pending[article_id] = sketch
+        else:
+            current.merge(sketch)
+
+
+def flush() -> int:
+    """把内存中的草图合并进数据库，返回写入的文章数"""
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+    flushed = 0
+    db = deps.SessionLocal()
+    try:
+        for article_id, sketch in batch.items():
+            try:
+                row = (db.query(models.ArticleViewers)
+                       .filter(models.ArticleViewers.article_id == article_id)
+                       .with_for_update().first())
+                if row is None:
+                    if db.get(models.Article, article_id) is None:
+                        continue
+                    row = models.ArticleViewers(article_id=article_id)
+                    db.add(row)
+                    merged = sketch
+                else:
+                    merged = HyperLogLog.from_bytes(row.sketch)
+                    merged.merge(sketch)
+                row.sketch = merged.to_bytes()
+                row.unique_views = merged.count()
+                row.updated_at = datetime.utcnow()
+                db.commit()
+                flushed += 1
+            except Exception as e:
+                db.rollback()
+                _requeue(article_id, sketch)
+                print(f"[viewers] 写入文章 {article_id} 的访客草图失败: {e}")
+    finally:
+        db.close()
+    return flushed
+
+
+def unique_views(db: Session, article_id: int) -> int:
+    """库中草图与本进程未写入部分合并后的估计值"""
+    row = db.get(models.ArticleViewers, article_id)
+    with _lock:
+        pending = _pending.get(article_id)
+        if pending is None:
+            return row.unique_views if row else 0
+        merged = HyperLogLog(pending.p, pending.registers)
+    if row is not None:
+        merged.merge(HyperLogLog.from_bytes(row.sketch))
+    return merged.count()
+
+
+def discard(conn, article_ids) -> None:
+    """文章被删除时一并删除草图"""
+    ids = list(article_ids)
+    with _lock:
+        for article_id in ids:
+            _pending.pop(article_id, None)
+    table = models.ArticleViewers.__table__
+    conn.execute(table.delete().where(table.c.article_id.in_(ids)))
+
+
+def _run() -> None:
+    while not _stop.wait(FLUSH_INTERVAL):
+        try:
+            flush()
+        except Exception as e:
+            print(f"[viewers] 定期写入失败: {e}")
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="viewer-sketches", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5.0) -> None:
+    """停止后台线程，并把剩余的草图写入数据库"""
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
+    flush()
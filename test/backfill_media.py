@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+一次性回填：把已有文章正文里的 data: 内嵌图片转存到媒体目录
+
+只处理正文包含 data:image/ 的文章，按 id 分批读取、改写、批量更新；可重复执行。
+
+用法:
+    python test/backfill_media.py [--batch-size 50] [--dry-run]
+"""
+import argparse
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import bindparam, select, update  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import content_codec, invalidation, media, migrations, rendering  # noqa: E402
+from app.models import Article  # noqa: E402
+
+DEFAULT_BATCH_SIZE = 50
+
+
+def backfill(engine: Engine, *, batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False) -> dict:
+    table = Article.__table__
+    migrations.ensure_tables(engine)
+    with engine.connect() as conn:
+        query = select(table.c.id).order_by(table.c.id)
+        # 压缩存储的正文无法用 LIKE 过滤，逐篇检查
+        if not content_codec.binary_storage():
+            query = query.where(table.c.content.like("%data:image/%"))
+        ids = [row[0] for row in conn.execute(query)]
+    print(f"待检查文章 {len(ids)} 篇，媒体目录 {media.MEDIA_DIR}")
+
+    stats = {"articles": 0, "bytes_before": 0, "bytes_after": 0}
+    touched = []
+    started = time.monotonic()
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        with engine.connect() as conn:
+            rows = conn.execute(select(table.c.id, table.c.content).where(table.c.id.in_(chunk))).all()
+        updates = []
+        for article_id, content in rows:
+            # dry-run 不写图片，只估算去掉内嵌图片后的大小
+            rewritten = media.DATA_URI_IMG_RE.sub("", content) if dry_run else media.extract_images(content)
+            if rewritten != content:
+                updates.append({"b_id": article_id, "content": rewritten})
+                stats["bytes_before"] += len(content)
+                stats["bytes_after"] += len(rewritten)
+        if updates and not dry_run:
+            with engine.begin() as conn:
+                conn.execute(update(table).where(table.c.id == bindparam("b_id"))
+                             .values(content=bindparam("content")), updates)
+                rendering.discard(conn, [u["b_id"] for u in updates])
+        stats["articles"] += len(updates)
+        touched.extend(u["b_id"] for u in updates)
+        print(f"  已处理 {min(start + batch_size, len(ids))}/{len(ids)}，改写 {stats['articles']} 篇")
+
+    if touched and not dry_run:
+        with Session(engine) as db:
+            invalidation.publish(db, "*")
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    print(f"{'[dry-run] ' if dry_run else ''}回填完成: 改写 {stats['articles']} 篇，"
+          f"正文减少 {saved / 1024 / 1024:.1f} MB，耗时 {time.monotonic() - started:.1f}s")
+    return stats
+
+
+def main() -> None:
+    from app.deps import engine
+
+    parser = argparse.ArgumentParser(description="Move embedded data: images out of article content")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Articles per batch (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+    backfill(engine, batch_size=args.batch_size, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
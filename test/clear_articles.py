@@ -5,6 +5,7 @@ from google.cloud.sql.connector import Connector
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from app import categories, migrations
 from app.models import Article
 
 load_dotenv()
@@ -46,6 +47,8 @@ def clear_all_articles():
         # 删除所有文章
         deleted_count = db.query(Article).delete()
         db.commit()
+        migrations.ensure_tables(engine)
+        categories.sync(db)
         print(f"成功删除 {deleted_count} 篇文章")
     except Exception as e:
         db.rollback()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+文章正文压缩存储的迁移与统计
+
+- 压缩：PostgreSQL/MySQL 先把 articles.content 改为二进制列，再按 id 分批重写已有正文
+- 解压（--codec none）：分批还原为 UTF-8 文本，最后把列改回 Text
+- 每批之间可暂停（--sleep），可在线慢慢跑；已是目标格式的行会跳过，中断后重跑即可
+- --stats 只统计当前占用与解压耗时，不写库
+
+迁移完成后再以相同的 ARTICLE_COMPRESSION 部署应用。
+
+用法:
+    python test/compress_articles.py --codec zstd
+    python test/compress_articles.py --stats
+"""
+import argparse
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import LargeBinary, inspect, text  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+from app import content_codec  # noqa: E402
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _column_is_binary(engine: Engine) -> bool:
+    column = next(c for c in inspect(engine).get_columns("articles") if c["name"] == "content")
+    return column["type"]._type_affinity is not None and \
+        issubclass(column["type"]._type_affinity, LargeBinary)
+
+
+def alter_column(engine: Engine, binary: bool) -> None:
+    """SQLite 列类型宽松，无需修改"""
+    dialect = engine.dialect.name
+    if dialect == "sqlite" or _column_is_binary(engine) == binary:
+        return
+    with engine.begin() as conn:
+        if dialect == "postgresql":
+            if binary:
+                conn.execute(text("ALTER TABLE articles ALTER COLUMN content TYPE bytea "
+                                  "USING convert_to(content, 'UTF8')"))
+            else:
+                conn.execute(text("ALTER TABLE articles ALTER COLUMN content TYPE text "
+                                  "USING convert_from(content, 'UTF8')"))
+        elif dialect == "mysql":
+            conn.execute(text(f"ALTER TABLE articles MODIFY content {'LONGBLOB' if binary else 'LONGTEXT'} NOT NULL"))
+        else:
+            raise RuntimeError(f"不支持的数据库: {dialect}")
+    print(f"已将 articles.content 改为{'二进制' if binary else '文本'}列")
+
+
+def _raw_batches(engine: Engine, batch_size: int):
+    """按 id 分批读取未经类型处理的原始值（str 或 bytes）"""
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, content FROM articles WHERE id > :last ORDER BY id LIMIT :n"),
+                                {"last": last_id, "n": batch_size}).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def _stored_size(value) -> int:
+    return len(value.encode("utf-8")) if isinstance(value, str) else len(bytes(value))
+
+
+def _is_target(value, codec: str) -> bool:
+    if codec == "none":
+        return isinstance(value, str) or bytes(value[:1]) != b"\x00"
+    return not isinstance(value, str) and bytes(value[:2]) == content_codec.MARKERS[codec]
+
+
+def report(engine: Engine, batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    rows = stored = raw = decoded = 0
+    seconds = 0.0
+    for batch in _raw_batches(engine, batch_size):
+        for _, value in batch:
+            started = time.perf_counter()
+            body = content_codec.decode(value)
+            elapsed = time.perf_counter() - started
+            rows += 1
+            stored += _stored_size(value)
+            raw += len(body.encode("utf-8"))
+            if not isinstance(value, str) and bytes(value[:1]) == b"\x00":
+                decoded += 1
+                seconds += elapsed
+    result = {"rows": rows, "stored_bytes": stored, "raw_bytes": raw, "compressed_rows": decoded,
+              "decode_us_avg": round(seconds / decoded * 1e6, 1) if decoded else 0.0}
+    saved = raw - stored
+    print(f"文章 {rows} 篇，其中压缩 {decoded} 篇；"
+          f"原始 {raw / 1024 / 1024:.1f} MB，存储 {stored / 1024 / 1024:.1f} MB，"
+          f"节省 {saved / 1024 / 1024:.1f} MB（{(saved / raw * 100) if raw else 0:.1f}%）；"
+          f"平均解压 {result['decode_us_avg']} µs/篇")
+    return result
+
+
+def migrate(engine: Engine, codec: str, *, batch_size: int = DEFAULT_BATCH_SIZE, sleep: float = 0.0) -> int:
+    if codec not in ("none", *content_codec.MARKERS):
+        raise ValueError(f"未知的压缩方式: {codec}")
+    if codec == "zstd" and content_codec.zstandard is None:
+        raise RuntimeError("zstd 需要安装 zstandard")
+    if codec != "none":
+        alter_column(engine, binary=True)
+
+    rewritten = 0
+    started = time.monotonic()
+    for batch in _raw_batches(engine, batch_size):
+        updates = []
+        for article_id, value in batch:
+            if _is_target(value, codec):
+                continue
+            body = content_codec.decode(value)
+            if codec != "none":
+                new_value = content_codec.encode(body, codec)
+            else:
+                # 二进制列改回文本前先写成未压缩的 UTF-8 字节
+                new_value = body if engine.dialect.name == "sqlite" else body.encode("utf-8")
+            if new_value != value:
+                updates.append({"id": article_id, "content": new_value})
+        if updates:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE articles SET content = :content WHERE id = :id"), updates)
+            rewritten += len(updates)
+        print(f"  已处理至 id {batch[-1][0]}，重写 {rewritten} 篇，{time.monotonic() - started:.1f}s")
+        if sleep:
+            time.sleep(sleep)
+
+    if codec == "none":
+        alter_column(engine, binary=False)
+    print(f"迁移完成（{codec}）: 重写 {rewritten} 篇")
+    return rewritten
+
+
+def main() -> None:
+    from app.deps import engine
+
+    parser = argparse.ArgumentParser(description="Compress or decompress stored article bodies")
+    parser.add_argument("--codec", default=content_codec.CODEC, choices=["none", "zlib", "zstd"],
+                        help="Target storage format (default: $ARTICLE_COMPRESSION)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Rows per batch (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between batches")
+    parser.add_argument("--stats", action="store_true", help="Only report storage and decode cost")
+    args = parser.parse_args()
+
+    if not args.stats:
+        migrate(engine, args.codec, batch_size=args.batch_size, sleep=args.sleep)
+    report(engine, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
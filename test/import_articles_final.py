@@ -9,7 +9,8 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from google.cloud.sql.connector import Connector
-from app.models import Article, User
+from app.models import User
+from bulk_import import import_csv
 
 load_dotenv()
 
@@ -60,52 +61,8 @@ def import_articles_from_csv(csv_file_path):
             print(f"错误: 找不到文件 {csv_file_path}")
             return
 
-        imported_count = 0
-        skipped_count = 0
-
-        with open(csv_file_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row_num, row in enumerate(reader, 1):
-                try:
-                    # 检查必要字段
-                    if not row.get('title') or not row.get('content'):
-                        print(f"跳过第 {row_num} 行: 缺少标题或内容")
-                        skipped_count += 1
-                        continue
-
-                    # 检查文章是否已存在（基于标题）
-                    existing_article = db.query(Article).filter(
-                        Article.title == row['title'],
-                        Article.author_id == user.id
-                    ).first()
-
-                    if existing_article:
-                        print(f"跳过第 {row_num} 行: 文章 '{row['title']}' 已存在")
-                        skipped_count += 1
-                        continue
-
-                    # 创建新文章
-                    article = Article(
-                        title=row['title'].strip(),
-                        content=row['content'].strip(),
-                        category=row.get('category', '未分类').strip(),
-                        author_id=user.id
-                    )
-                    db.add(article)
-                    imported_count += 1
-
-                    # 每100篇文章提交一次，避免事务过大
-                    if imported_count % 100 == 0:
-                        db.commit()
-                        print(f"已导入 {imported_count} 篇文章...")
-
-                except Exception as e:
-                    print(f"处理第 {row_num} 行时出错: {e}")
-                    skipped_count += 1
-                    continue
-
-        db.commit()
-        print(f"导入完成！成功导入 {imported_count} 篇文章，跳过 {skipped_count} 篇文章")
+        # 流式批量导入：标题哈希去重 + executemany，支持断点续传
+        import_csv(engine, csv_file_path, user.id)
 
     except Exception as e:
         db.rollback()
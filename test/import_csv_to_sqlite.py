@@ -1,6 +1,5 @@
 import os
 import sys
-import csv
 import argparse
 
 # Ensure project root on sys.path
@@ -9,8 +8,9 @@ if PROJECT_ROOT not in sys.path:
     sys.path.append(PROJECT_ROOT)
 
 from app.deps import SessionLocal, engine  # noqa: E402
-from app.models import Base, User, Article  # noqa: E402
+from app.models import Base, User  # noqa: E402
 from app.crud import pwd_context  # noqa: E402
+from bulk_import import import_csv as bulk_import_csv  # noqa: E402
 
 
 def ensure_tables_exist() -> None:
@@ -23,7 +23,8 @@ def reset_db() -> None:
     Base.metadata.create_all(bind=engine)
 
 
-def import_csv(csv_path: str, author_username: str, *, nickname: str | None = None, password: str | None = None) -> None:
+def import_csv(csv_path: str, author_username: str, *, nickname: str | None = None, password: str | None = None,
+               batch_size: int = 5000, resume: bool = True) -> None:
     ensure_tables_exist()
     db = SessionLocal()
     try:
@@ -48,50 +49,12 @@ def import_csv(csv_path: str, author_username: str, *, nickname: str | None = No
                 db.commit()
                 db.refresh(user)
 
-        if not os.path.exists(csv_path):
-            print(f"CSV 不存在: {csv_path}")
-            return
-
-        imported = 0
-        skipped = 0
-
-        with open(csv_path, "r", encoding="utf-8", newline="") as f:
-            reader = csv.DictReader(f)
-            for idx, row in enumerate(reader, start=1):
-                title = (row.get("title") or "").strip()
-                content = (row.get("content") or "").strip()
-                category = (row.get("category") or "未分类").strip()
-
-                if not title or not content:
-                    skipped += 1
-                    continue
-
-                exists = (
-                    db.query(Article)
-                    .filter(Article.title == title, Article.author_id == user.id)
-                    .first()
-                )
-                if exists:
-                    skipped += 1
-                    continue
-
-                db.add(
-                    Article(
-                        title=title,
-                        content=content,
-                        category=category,
-                        author_id=user.id,
-                    )
-                )
-                imported += 1
-                if imported % 200 == 0:
-                    db.commit()
-
-        db.commit()
-        print(f"导入完成: 成功 {imported} 条, 跳过 {skipped} 条")
+        author_id = user.id
     finally:
         db.close()
 
+    bulk_import_csv(engine, csv_path, author_id, batch_size=batch_size, resume=resume)
+
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Import CSV into SQLite (articles)")
@@ -115,6 +78,17 @@ def main() -> None:
         default=None,
         help="Password for the author (optional)",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=5000,
+        help="Rows per batch insert (default: 5000)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint of a previous interrupted run",
+    )
     parser.add_argument(
         "--reset",
         action="store_true",
@@ -132,7 +106,8 @@ def main() -> None:
     if args.password:
         print("密码: ******")
     print(f"CSV 路径: {args.csv}")
-    import_csv(args.csv, args.user, nickname=args.nickname, password=args.password)
+    import_csv(args.csv, args.user, nickname=args.nickname, password=args.password,
+               batch_size=args.batch_size, resume=not args.restart)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+通用数据库迁移（SQLite / MySQL / PostgreSQL 之间任意方向）
+
+- 表结构与顺序来自 app.models.Base.metadata，按外键依赖分层，同层的表并行复制
+- 源库使用服务端游标分块读取，目标库按块批量插入（多行 VALUES）
+- 结束后重置自增序列，并逐表校验行数与校验和
+
+用法:
+    python test/migrate_database.py --source sqlite:///./litebook.db --target postgresql://user:pw@host/litebook
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import Table, create_engine, func, inspect, select, text  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+from app.models import Base  # noqa: E402
+
+DEFAULT_CHUNK_SIZE = 5000
+# 临时性数据，不迁移
+SKIP_TABLES = {"cache_invalidations"}
+
+
+def dependency_levels(tables: List[Table]) -> List[List[Table]]:
+    """按外键依赖分层：每层的表只依赖前面各层（自引用不计），同层可并行复制"""
+    names = {t.name for t in tables}
+    level: Dict[str, int] = {}
+    for table in Base.metadata.sorted_tables:
+        if table.name not in names:
+            continue
+        parents = {fk.column.table.name for fk in table.foreign_keys} - {table.name}
+        level[table.name] = max((level[p] + 1 for p in parents if p in level), default=0)
+    levels: List[List[Table]] = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for table in tables:
+        levels[level[table.name]].append(table)
+    return levels
+
+
+def shared_columns(source: Engine, table: Table) -> List:
+    """源库可能是旧结构：只复制两边都有的列"""
+    source_cols = {c["name"] for c in inspect(source).get_columns(table.name)}
+    return [c for c in table.columns if c.name in source_cols]
+
+
+def copy_table(source: Engine, target: Engine, table: Table, chunk_size: int) -> Tuple[str, int, float]:
+    columns = shared_columns(source, table)
+    names = [c.name for c in columns]
+    copied = 0
+    started = time.monotonic()
+    query = select(*columns).order_by(*table.primary_key.columns)
+    with source.connect() as src, target.connect() as dst:
+        result = src.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for chunk in result.partitions(chunk_size):
+            with dst.begin():
+                dst.execute(table.insert(), [dict(zip(names, row)) for row in chunk])
+            copied += len(chunk)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            print(f"  {table.name}: {copied} 行（{copied / elapsed:.0f} 行/秒）")
+    return table.name, copied, time.monotonic() - started
+
+
+def _normalize(value):
+    if isinstance(value, datetime):
+        # MySQL DATETIME 默认不保留微秒
+        return value.replace(microsecond=0, tzinfo=None).isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return value
+
+
+def table_checksum(engine: Engine, table: Table, columns: List, chunk_size: int) -> Tuple[int, str]:
+    digest = hashlib.sha256()
+    count = 0
+    query = select(*columns).order_by(*table.primary_key.columns)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for row in result:
+            digest.update(repr(tuple(_normalize(v) for v in row)).encode("utf-8"))
+            count += 1
+    return count, digest.hexdigest()
+
+
+def reset_sequences(target: Engine, tables: List[Table]) -> None:
+    dialect = target.dialect.name
+    with target.begin() as conn:
+        for table in tables:
+            pk = list(table.primary_key.columns)
+            if len(pk) != 1 or not pk[0].autoincrement:
+                continue
+            col = pk[0].name
+            if dialect == "postgresql":
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', '{col}'), "
+                    f"COALESCE(MAX({col}), 1), MAX({col}) IS NOT NULL) FROM {table.name}"))
+            elif dialect == "mysql":
+                max_id = conn.execute(select(func.max(pk[0]))).scalar() or 0
+                conn.execute(text(f"ALTER TABLE {table.name} AUTO_INCREMENT = {max_id + 1}"))
+    print(f"已重置自增序列（{dialect}）")
+
+
+def verify(source: Engine, target: Engine, tables: List[Table], chunk_size: int, workers: int) -> bool:
+    def check(table):
+        columns = shared_columns(source, table)
+        return table.name, table_checksum(source, table, columns, chunk_size), \
+            table_checksum(target, table, columns, chunk_size)
+
+    ok = True
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, (src_count, src_sum), (dst_count, dst_sum) in executor.map(check, tables):
+            match = src_count == dst_count and src_sum == dst_sum
+            ok = ok and match
+            print(f"{'✅' if match else '❌'} {name}: 源 {src_count} 行 / 目标 {dst_count} 行，"
+                  f"校验和{'一致' if src_sum == dst_sum else '不一致'}")
+    return ok
+
+
+def migrate(source_url: str, target_url: str, *, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 4,
+            only: Optional[List[str]] = None, truncate: bool = False, verify_only: bool = False) -> bool:
+    source = create_engine(source_url, pool_size=workers, future=True) \
+        if not source_url.startswith("sqlite") else create_engine(source_url, future=True)
+    target = create_engine(target_url, pool_size=workers, future=True) \
+        if not target_url.startswith("sqlite") else create_engine(target_url, future=True)
+
+    source_tables = set(inspect(source).get_table_names())
+    tables = [t for t in Base.metadata.sorted_tables
+              if t.name in source_tables and t.name not in SKIP_TABLES and (not only or t.name in only)]
+    skipped = [t.name for t in Base.metadata.sorted_tables if t.name not in source_tables | SKIP_TABLES]
+    if skipped:
+        print(f"源库缺少以下表，跳过: {', '.join(skipped)}")
+
+    if not verify_only:
+        Base.metadata.create_all(bind=target, tables=tables)
+        with target.begin() as conn:
+            for table in reversed(tables):
+                existing = conn.execute(select(func.count()).select_from(table)).scalar()
+                if existing and not truncate:
+                    print(f"目标表 {table.name} 已有 {existing} 行，如需覆盖请加 --truncate")
+                    return False
+                if existing:
+                    conn.execute(table.delete())
+
+        started = time.monotonic()
+        for depth, level in enumerate(dependency_levels(tables)):
+            print(f"第 {depth + 1} 层: {', '.join(t.name for t in level)}")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(copy_table, source, target, t, chunk_size) for t in level]
+                for future in futures:
+                    name, copied, elapsed = future.result()
+                    print(f"完成 {name}: {copied} 行，{elapsed:.1f}s")
+        print(f"复制完成，总耗时 {time.monotonic() - started:.1f}s")
+        reset_sequences(target, tables)
+
+    ok = verify(source, target, tables, chunk_size, workers)
+    print("🎉 迁移校验通过" if ok else "❌ 迁移校验失败")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate all LiteBook tables between databases")
+    parser.add_argument("--source", required=True, help="Source SQLAlchemy URL")
+    parser.add_argument("--target", default=os.getenv("DB_URL"), help="Target SQLAlchemy URL (default: $DB_URL)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Rows per read/insert chunk (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--workers", type=int, default=4, help="Tables copied in parallel (default: 4)")
+    parser.add_argument("--tables", nargs="*", default=None, help="Only migrate these tables")
+    parser.add_argument("--truncate", action="store_true", help="Empty non-empty target tables first")
+    parser.add_argument("--verify-only", action="store_true", help="Only compare row counts and checksums")
+    args = parser.parse_args()
+
+    ok = migrate(args.source, args.target, chunk_size=args.chunk_size, workers=args.workers, only=args.tables,
+                 truncate=args.truncate, verify_only=args.verify_only)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
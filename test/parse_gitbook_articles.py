@@ -1,71 +1,106 @@
 #!/usr/bin/env python3
 """
 解析Gitbook HTML文件，提取文章标题、内容和分类
+
+- 每个文件只解析一次，且只解析正文区域（page-inner）
+- 导航栏的 header 分类表每本书只解析一次，页面只需按 data-level 查表
+- 多进程并行解析，结果按顺序流式写入 CSV，或直接交给 bulk_import 导入数据库
 """
 
 from dotenv import load_dotenv
 load_dotenv()
+import argparse
 import os
-import sys
 import re
+import sys
 import csv
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from bs4 import BeautifulSoup
-from typing import List, Dict, Optional, Tuple
+from bs4 import BeautifulSoup, SoupStrainer
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+
+def default_parser() -> str:
+    """优先使用 lxml（快数倍），未安装时退回标准库解析器"""
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+# 当前页面在导航中的位置，例如 <li class="chapter active" data-level="2.10" ...>
+ACTIVE_LEVEL_RE = re.compile(r'<li[^>]*class="chapter active"[^>]*data-level="([\d.]+)"')
+PAGE_INNER = SoupStrainer('div', class_='page-inner')
+NAV = SoupStrainer('nav', attrs={'role': 'navigation'})
+
+
+def build_nav_category_map(html_content: str, parser: str = 'html.parser') -> Dict[int, str]:
+    """
+    解析导航栏，返回 分类序号(从1开始) -> 分类名
+    同一本书的所有页面导航相同，每本书解析一次即可
+    """
+    soup = BeautifulSoup(html_content, parser, parse_only=NAV)
+    nav = soup.find('nav')
+    if not nav:
+        return {}
+    headers = nav.find_all('li', class_='header')
+    return {i: header.get_text(strip=True) for i, header in enumerate(headers, start=1)}
+
+
+def category_from_level(active_level: Optional[str], nav_map: Dict[int, str]) -> Optional[str]:
+    """根据 data-level（如"2.10"表示第2个分类的第10篇文章）查分类名"""
+    if not active_level:
+        return None
+    level_parts = active_level.split('.')
+    if len(level_parts) != 2:
+        return None
+    return nav_map.get(int(level_parts[0]))
+
 
-def extract_category_from_nav(html_content: str) -> Optional[str]:
+def extract_category_from_nav(html_content: Union[str, BeautifulSoup], parser: str = 'html.parser') -> Optional[str]:
     """
     从导航栏中提取分类信息
     根据当前active chapter的data-level找到对应的header分类
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
+    soup = html_content if isinstance(html_content, BeautifulSoup) else BeautifulSoup(html_content, parser)
+
     # 查找导航栏
     nav = soup.find('nav', {'role': 'navigation'})
     if not nav:
         return None
-    
+
     # 查找active的chapter
     active_chapter = nav.find('li', class_='chapter active')
     if not active_chapter:
         return None
-    
-    # 获取active chapter的data-level
-    active_level = active_chapter.get('data-level')
-    if not active_level:
-        return None
-    
-    # 解析level，例如"2.10"表示第2个分类的第10篇文章
-    level_parts = active_level.split('.')
-    if len(level_parts) != 2:
-        return None
-    
-    category_index = int(level_parts[0]) - 1  # 分类索引从0开始
-    
-    # 查找所有header元素
+
     headers = nav.find_all('li', class_='header')
-    
-    if category_index < len(headers):
-        return headers[category_index].get_text(strip=True)
-    
-    return None
+    nav_map = {i: header.get_text(strip=True) for i, header in enumerate(headers, start=1)}
+    return category_from_level(active_chapter.get('data-level'), nav_map)
 
-def extract_article_info(html_content: str, file_path: str) -> Optional[Dict[str, str]]:
+
+def extract_article_info(html_content: str, file_path: str, nav_map: Optional[Dict[int, str]] = None,
+                         parser: str = 'html.parser') -> Optional[Dict[str, str]]:
     """
     从HTML内容中提取文章信息
+    传入 nav_map 时只解析正文区域，分类按 data-level 查表；否则完整解析一次页面
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
+    if nav_map is not None:
+        soup = BeautifulSoup(html_content, parser, parse_only=PAGE_INNER)
+    else:
+        soup = BeautifulSoup(html_content, parser)
+
     # 查找page-inner div
     page_inner = soup.find('div', class_='page-inner')
     if not page_inner:
         return None
-    
+
     # 查找section标签
     section = page_inner.find('section')
     if not section:
         return None
-    
+
     # 提取标题 - 使用第一个h1标签
     title_tag = section.find('h1')
     if not title_tag:
@@ -73,109 +108,180 @@ def extract_article_info(html_content: str, file_path: str) -> Optional[Dict[str
         title = Path(file_path).stem
     else:
         title = title_tag.get_text(strip=True)
-    
+
     # 提取内容 - 只提取<p>标签的内容并用<br/>拼接
-    p_tags = section.find_all('p')
     content_parts = []
-    
-    for p_tag in p_tags:
+    for p_tag in section.find_all('p'):
         # 获取<p>标签的文本内容
         p_text = p_tag.get_text(strip=True)
         if p_text:  # 只添加非空内容
             content_parts.append(p_text)
-    
+
     # 用<br/>拼接所有<p>标签的内容
     content = '<br/>'.join(content_parts)
-    
+
     # 如果没有找到<p>标签，尝试获取整个section的文本内容
     if not content:
         content = section.get_text(strip=True)
-    
+
     # 提取分类
-    category = extract_category_from_nav(html_content)
+    if nav_map is not None:
+        match = ACTIVE_LEVEL_RE.search(html_content)
+        category = category_from_level(match.group(1) if match else None, nav_map)
+    else:
+        category = extract_category_from_nav(soup)
     if not category:
         category = "默认"
-    
+
     return {
         'title': title,
         'category': category,
         'content': content
     }
 
-def parse_gitbook_directory(directory_path: str) -> List[Dict[str, str]]:
+
+def _parse_file(task: Tuple[str, Optional[Dict[int, str]], str]) -> Tuple[str, Optional[Dict[str, str]], Optional[str]]:
+    """进程池任务：返回 (文件路径, 文章信息, 错误信息)"""
+    file_path, nav_map, parser = task
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+        return file_path, extract_article_info(html_content, file_path, nav_map, parser), None
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+def find_book_root(html_file: Path, top: Path, cache: Dict[Path, Path]) -> Path:
+    """书的根目录：向上找到第一个包含 gitbook/ 资源目录的目录，找不到时就是输入目录"""
+    directory = html_file.parent
+    if directory in cache:
+        return cache[directory]
+    root = top
+    for candidate in [directory, *directory.parents]:
+        if (candidate / 'gitbook').is_dir():
+            root = candidate
+            break
+        if candidate == top:
+            break
+    cache[directory] = root
+    return root
+
+
+def load_book_nav_map(book_root: Path, first_page: Path, parser: str) -> Dict[int, str]:
+    index_page = book_root / 'index.html'
+    source = index_page if index_page.exists() else first_page
+    with open(source, 'r', encoding='utf-8') as f:
+        return build_nav_category_map(f.read(), parser)
+
+
+def iter_gitbook_articles(directory_path: str, workers: Optional[int] = None,
+                          parser: Optional[str] = None) -> Iterator[Dict[str, str]]:
     """
-    解析Gitbook目录中的所有HTML文件
+    并行解析Gitbook目录中的所有HTML文件，按文件顺序逐篇产出
     """
-    articles = []
     directory = Path(directory_path)
-    
     if not directory.exists():
         print(f"目录不存在: {directory_path}")
-        return articles
-    
+        return
+    parser = parser or default_parser()
+
     # 递归查找所有HTML文件
-    html_files = list(directory.rglob('*.html'))
-    
-    print(f"找到 {len(html_files)} 个HTML文件")
-    
+    html_files = sorted(directory.rglob('*.html'))
+    print(f"找到 {len(html_files)} 个HTML文件（解析器: {parser}）")
+
+    # 每本书构建一次导航分类表
+    root_cache: Dict[Path, Path] = {}
+    nav_maps: Dict[Path, Dict[int, str]] = {}
+    tasks = []
     for html_file in html_files:
-        try:
-            with open(html_file, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            
-            article_info = extract_article_info(html_content, str(html_file))
-            if article_info:
-                articles.append(article_info)
-                print(f"解析成功: {article_info['title']} ({article_info['category']})")
+        book_root = find_book_root(html_file, directory, root_cache)
+        if book_root not in nav_maps:
+            nav_maps[book_root] = load_book_nav_map(book_root, html_file, parser)
+            print(f"书目 {book_root}: {len(nav_maps[book_root])} 个分类")
+        # 导航中没有分类时，退回逐页解析导航
+        tasks.append((str(html_file), nav_maps[book_root] or None, parser))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for file_path, article_info, error in executor.map(_parse_file, tasks, chunksize=32):
+            if error:
+                print(f"处理文件 {file_path} 时出错: {error}")
+            elif article_info:
+                yield article_info
             else:
-                print(f"解析失败: {html_file}")
-                
-        except Exception as e:
-            print(f"处理文件 {html_file} 时出错: {e}")
-    
-    return articles
-
-def save_to_csv(articles: List[Dict[str, str]], output_file: str):
+                print(f"解析失败: {file_path}")
+
+
+def parse_gitbook_directory(directory_path: str) -> List[Dict[str, str]]:
     """
-    将文章信息保存到CSV文件
+    解析Gitbook目录中的所有HTML文件
+    """
+    return list(iter_gitbook_articles(directory_path))
+
+
+def save_to_csv(articles, output_file: str) -> int:
+    """
+    将文章信息流式写入CSV文件，返回写入篇数
     """
+    count = 0
     with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
         fieldnames = ['title', 'category', 'content']
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
+
         writer.writeheader()
         for article in articles:
             writer.writerow(article)
-    
-    print(f"已保存 {len(articles)} 篇文章到 {output_file}")
+            count += 1
+
+    print(f"已保存 {count} 篇文章到 {output_file}")
+    return count
+
 
 def main():
-    if len(sys.argv) != 2:
-        print("用法: python parse_gitbook_articles.py <gitbook_directory>")
-        sys.exit(1)
-    
-    directory_path = sys.argv[1]
-    
-    # 解析文章
-    articles = parse_gitbook_directory(directory_path)
-    
-    if not articles:
+    parser = argparse.ArgumentParser(description="解析Gitbook HTML，输出CSV或直接导入数据库")
+    parser.add_argument("directory", help="Gitbook 导出目录")
+    parser.add_argument("--output", default="gitbook_articles_with_categories.csv", help="输出CSV路径")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数（默认CPU核数）")
+    parser.add_argument("--parser", default=None, help="BeautifulSoup 解析器（默认 lxml，未安装时 html.parser）")
+    parser.add_argument("--import-user", default=None, help="直接导入数据库的作者用户名（不写CSV）")
+    args = parser.parse_args()
+
+    category_counts: Dict[str, int] = {}
+
+    def counted(articles):
+        for article in articles:
+            category_counts[article['category']] = category_counts.get(article['category'], 0) + 1
+            yield article
+
+    articles = counted(iter_gitbook_articles(args.directory, workers=args.workers, parser=args.parser))
+
+    if args.import_user:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from app.deps import SessionLocal, engine
+        from app.models import User
+        from bulk_import import import_rows
+
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.username == args.import_user).first()
+        finally:
+            db.close()
+        if not user:
+            print(f"错误: 找不到用户 '{args.import_user}'")
+            sys.exit(1)
+        imported, skipped = import_rows(engine, enumerate(articles, start=1), user.id)
+        print(f"导入完成: 成功 {imported} 条, 跳过 {skipped} 条")
+    else:
+        save_to_csv(articles, args.output)
+
+    if not category_counts:
         print("没有找到任何文章")
         return
-    
+
     # 统计分类
-    category_counts = {}
-    for article in articles:
-        category = article['category']
-        category_counts[category] = category_counts.get(category, 0) + 1
-    
     print("\n分类统计:")
     for category, count in category_counts.items():
         print(f"  {category}: {count}篇")
-    
-    # 保存到CSV
-    output_file = "gitbook_articles_with_categories.csv"
-    save_to_csv(articles, output_file)
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
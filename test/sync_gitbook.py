@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Gitbook 增量同步：只重新导入有变化的页面
+
+清单文件记录 源文件路径 -> (mtime, size, 内容哈希, 文章 id)：
+- mtime/size 未变的文件直接跳过（不读取）
+- 内容哈希未变的文件只刷新清单
+- 内容有变化的文件重新解析，按文章 id 原地更新标题/内容/分类（浏览、点赞、评论计数保持不变）
+- 新文件插入文章；已从目录中删除的文件，对应文章（及其评论、点赞）一并删除
+
+首次同步时清单为空，会按标题认领该作者已有的文章，避免重复导入。
+
+用法:
+    python test/sync_gitbook.py <gitbook_directory> --user test
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import bindparam, delete, insert, select, update  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import categories, invalidation, migrations, related, rendering, viewers  # noqa: E402
+from app.models import Article, ArticleLike, Comment, User  # noqa: E402
+from parse_gitbook_articles import _parse_file, default_parser, find_book_root, load_book_nav_map  # noqa: E402
+
+MANIFEST_NAME = ".litebook-sync.json"
+# 变更篇数不超过该值时逐篇发布失效事件，否则通知各实例整体清空
+PER_ARTICLE_EVENT_LIMIT = 100
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def load_manifest(path: str) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("files", {})
+
+
+def save_manifest(path: str, files: Dict[str, dict]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"updated_at": datetime.utcnow().isoformat(), "files": files}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def scan_changes(directory: Path, manifest: Dict[str, dict]):
+    """返回 (新清单, 需要重新解析的相对路径列表, 已删除的清单项列表)"""
+    files: Dict[str, dict] = {}
+    changed: List[str] = []
+    for html_file in sorted(directory.rglob("*.html")):
+        rel = html_file.relative_to(directory).as_posix()
+        st = html_file.stat()
+        entry = manifest.get(rel)
+        if entry and entry.get("mtime") == st.st_mtime and entry.get("size") == st.st_size:
+            files[rel] = entry
+            continue
+        digest = content_hash(html_file.read_bytes())
+        new_entry = {"mtime": st.st_mtime, "size": st.st_size, "hash": digest,
+                     "article_id": entry.get("article_id") if entry else None}
+        files[rel] = new_entry
+        if not entry or entry.get("hash") != digest or not entry.get("article_id"):
+            changed.append(rel)
+    removed = [entry for rel, entry in manifest.items() if rel not in files]
+    return files, changed, removed
+
+
+def parse_changed(directory: Path, changed: List[str], workers: Optional[int], parser: str) -> Dict[str, dict]:
+    """并行解析有变化的页面（导航分类表每本书解析一次）"""
+    root_cache: Dict[Path, Path] = {}
+    nav_maps: Dict[Path, Dict[int, str]] = {}
+    tasks = []
+    for rel in changed:
+        html_file = directory / rel
+        book_root = find_book_root(html_file, directory, root_cache)
+        if book_root not in nav_maps:
+            nav_maps[book_root] = load_book_nav_map(book_root, html_file, parser)
+        tasks.append((str(html_file), nav_maps[book_root] or None, parser))
+
+    parsed: Dict[str, dict] = {}
+    if not tasks:
+        return parsed
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for rel, (file_path, article_info, error) in zip(changed, executor.map(_parse_file, tasks, chunksize=16)):
+            if error:
+                print(f"处理文件 {file_path} 时出错: {error}")
+            elif article_info:
+                parsed[rel] = article_info
+            else:
+                print(f"解析失败: {file_path}")
+    return parsed
+
+
+def _insert_articles(conn, rows: List[dict]) -> List[int]:
+    if not rows:
+        return []
+    if conn.dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = conn.execute(insert(Article).returning(Article.id, sort_by_parameter_order=True), rows)
+        return [row[0] for row in result]
+    return [conn.execute(insert(Article), row).inserted_primary_key[0] for row in rows]
+
+
+def refresh_related(db: Session, versions: Dict[int, str]) -> None:
+    """
+    为新增、修改的文章（及近邻被删除的文章）重算相关文章：{文章 id: 任务版本}；
+    篇数不多时登记后台任务，否则直接全量重建
+    """
+    if not versions or not related.available():
+        return
+    if len(versions) <= PER_ARTICLE_EVENT_LIMIT:
+        for article_id, version in versions.items():
+            related.schedule(db, article_id, version)
+        db.commit()
+    else:
+        related.rebuild(db)
+
+
+def sync_directory(engine: Engine, directory_path: str, author_id: int, *, manifest_path: Optional[str] = None,
+                   workers: Optional[int] = None, parser: Optional[str] = None, dry_run: bool = False) -> dict:
+    directory = Path(directory_path)
+    manifest_path = manifest_path or str(directory / MANIFEST_NAME)
+    parser = parser or default_parser()
+    started = time.monotonic()
+
+    migrations.ensure_tables(engine)
+    manifest = load_manifest(manifest_path)
+    files, changed, removed = scan_changes(directory, manifest)
+    print(f"共 {len(files)} 个页面: 变化 {len(changed)}，删除 {len(removed)}，未变 {len(files) - len(changed)}")
+
+    parsed = parse_changed(directory, changed, workers, parser)
+
+    with engine.connect() as conn:
+        existing = {row.id: row.title for row in conn.execute(
+            select(Article.id, Article.title).where(Article.author_id == author_id))}
+    ids_by_title = {title: article_id for article_id, title in existing.items()}
+    claimed = {entry["article_id"] for entry in files.values() if entry.get("article_id")}
+
+    updates, inserts, insert_paths = [], [], []
+    for rel, info in parsed.items():
+        article_id = files[rel].get("article_id")
+        if article_id not in existing:
+            # 清单里没有或文章已被删：按标题认领（首次同步），否则新建
+            article_id = ids_by_title.get(info["title"])
+            if article_id in claimed and files[rel].get("article_id") != article_id:
+                article_id = None
+        if article_id:
+            files[rel]["article_id"] = article_id
+            claimed.add(article_id)
+            updates.append({"b_id": article_id, "title": info["title"], "content": info["content"],
+                            "category": info["category"]})
+        else:
+            insert_paths.append(rel)
+            inserts.append({"title": info["title"], "content": info["content"], "category": info["category"],
+                            "author_id": author_id, "created_at": datetime.utcnow(),
+                            "view_count": 0, "like_count": 0, "comment_count": 0})
+    # 解析失败的文件不写入清单，下次重试
+    for rel in changed:
+        if rel not in parsed:
+            files.pop(rel, None)
+    removed_ids = [entry["article_id"] for entry in removed
+                   if entry.get("article_id") in existing and entry["article_id"] not in claimed]
+
+    stats = {"updated": len(updates), "inserted": len(inserts), "deleted": len(removed_ids)}
+    if dry_run:
+        print(f"[dry-run] 将更新 {stats['updated']}，新增 {stats['inserted']}，删除 {stats['deleted']}")
+        return stats
+
+    referrers: set = set()
+    with engine.begin() as conn:
+        if updates:
+            conn.execute(
+                update(Article.__table__).where(Article.__table__.c.id == bindparam("b_id"))
+                .values(title=bindparam("title"), content=bindparam("content"), category=bindparam("category")),
+                updates)
+            # 正文变了，预计算的摘要/HTML 作废，读取时重算
+            rendering.discard(conn, [u["b_id"] for u in updates])
+        for rel, article_id in zip(insert_paths, _insert_articles(conn, inserts)):
+            files[rel]["article_id"] = article_id
+        if removed_ids:
+            comment_table = Comment.__table__
+            # 子评论引用父评论，先断开再整体删除
+            conn.execute(update(comment_table).where(comment_table.c.article_id.in_(removed_ids)).values(parent_id=None))
+            conn.execute(delete(comment_table).where(comment_table.c.article_id.in_(removed_ids)))
+            conn.execute(delete(ArticleLike.__table__).where(ArticleLike.__table__.c.article_id.in_(removed_ids)))
+            rendering.discard(conn, removed_ids)
+            viewers.discard(conn, removed_ids)
+            referrers = related.discard(conn, removed_ids)
+            conn.execute(delete(Article.__table__).where(Article.__table__.c.id.in_(removed_ids)))
+    save_manifest(manifest_path, files)
+
+    touched = [u["b_id"] for u in updates] + [files[rel]["article_id"] for rel in insert_paths] + removed_ids
+    if touched:
+        with Session(engine) as db:
+            categories.sync(db)
+            versions = {article_id: related.removed_version(removed_ids) for article_id in referrers}
+            versions.update((u["b_id"], related.text_version(u["title"], u["content"])) for u in updates)
+            versions.update((files[rel]["article_id"], related.text_version(row["title"], row["content"]))
+                            for rel, row in zip(insert_paths, inserts))
+            refresh_related(db, versions)
+            if len(touched) <= PER_ARTICLE_EVENT_LIMIT:
+                for article_id in touched:
+                    invalidation.publish(db, "article", id=article_id)
+            else:
+                invalidation.publish(db, "*")
+
+    print(f"同步完成: 更新 {stats['updated']}，新增 {stats['inserted']}，删除 {stats['deleted']}，"
+          f"耗时 {time.monotonic() - started:.1f}s")
+    return stats
+
+
+def main() -> None:
+    from app.deps import engine
+
+    parser = argparse.ArgumentParser(description="Incrementally sync a Gitbook export into articles")
+    parser.add_argument("directory", help="Gitbook export directory")
+    parser.add_argument("--user", default=os.environ.get("AUTHOR_USERNAME", "test"), help="Author username")
+    parser.add_argument("--manifest", default=None, help=f"Manifest path (default: <directory>/{MANIFEST_NAME})")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--parser", default=None, help="BeautifulSoup parser (default: lxml if installed)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+
+    with Session(engine) as db:
+        user = db.query(User).filter(User.username == args.user).first()
+    if user is None:
+        print(f"错误: 找不到用户 '{args.user}'")
+        sys.exit(1)
+    sync_directory(engine, args.directory, user.id, manifest_path=args.manifest, workers=args.workers,
+                   parser=args.parser, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
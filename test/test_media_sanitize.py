@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+测试正文图片转存与 HTML 清洗的衔接
+
+SVG 内嵌图片不转存到 /media，留在正文里作为 data: URI；清洗时 <img src> 必须保留它，
+而链接等其他位置的 data: URI 仍然去掉。
+
+用法:
+    MEDIA_DIR=/tmp/media python test/test_media_sanitize.py
+"""
+import base64
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import media, rendering  # noqa: E402
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="4" height="4"><rect width="4" height="4"/></svg>'
+
+
+def test_svg_data_image_round_trip():
+    src = "data:image/svg+xml;base64," + base64.b64encode(SVG).decode("ascii")
+    stored = media.extract_images(f'<p><img src="{src}" alt="x"></p>')
+    assert src in stored, "SVG 不应转存到 /media"
+    html, _ = rendering.sanitize(stored)
+    assert f'src="{src}"' in html, f"清洗后丢失了 SVG 图片: {html}"
+    print(f"✅ SVG 内嵌图片保留: {html[:80]}…")
+
+    html, _ = rendering.sanitize(f'<a href="{src}">x</a>')
+    assert "data:" not in html, f"链接中的 data: URI 应被去掉: {html}"
+    print("✅ 链接中的 data: URI 已去掉")
+
+
+if __name__ == "__main__":
+    test_svg_data_image_round_trip()